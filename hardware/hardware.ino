@@ -3,12 +3,18 @@
  *  HID Mouse Controlling
  *  ATX Power Supply Controlling
  */
+#include <HID.h>
 #include <Keyboard.h>
 #include <Mouse.h>
 #include <string.h>
 
 /* General settings */
-#define BAUD 19200
+// #define ABSOLUTE_MOUSE  // absolute pointer device, run the server with --abs-mouse
+#define BAUD 19200      // rate at power on, the server opens the serial at it and negotiates a higher one
+#define MAX_BAUD 1000000 // highest rate offered to the server, exact on a 16MHz board
+#define BAUD_CONFIRM_MS 1000 // Milliseconds, fall back to BAUD if no valid frame arrives at a new rate
+#define BAUD_MAX_ERRORS 16   // fall back to BAUD after so many bad bytes or frames in a row at another rate
+#define FW_VERSION 1
 #define MAX_KEY KEY_F24 // key with maximal value in Keyboard.h
 #define WHEEL_DOWN_AMOUNT  1
 #define WHEEL_UP_AMOUNT   -1
@@ -26,13 +32,20 @@
 #define MAGIC_HEAD  0x0f
 #define MAGIC_TAIL  0xe0
 #define CMD_RSV     0x00    // Reserved
+#define CMD_BATCH   0x01    // Many commands in one frame
+#define CMD_QUERY   0x02    // Reply firmware version, features and highest baud rate
+#define CMD_SET_BAUD 0x03   // Reply the rate then switch to it
 #define CMD_KEY     0x10
 #define CMD_TXT     0x11
 #define CMD_KEY_CLR 0x12
+#define CMD_KEY_RPT 0x13    // Keyboard report
+#define CMD_TEXT    0x14    // Many printable characters
 #define CMD_CUR_CLK 0x20    // Mouse click
 #define CMD_CUR_MV  0x21
 #define CMD_CUR_SCR 0x22
 #define CMD_CUR_CLR 0x23
+#define CMD_CUR_ABS 0x24    // Mouse move to absolute position, ABSOLUTE_MOUSE only
+#define CMD_CUR_RPT 0x25    // Mouse report
 #define CMD_PWR     0x31
 #define CMD_RST     0x32
 #define CMD_LPWR    0x33
@@ -44,6 +57,10 @@
 #define WHEEL_DOWN  0x00
 #define WHEEL_UP    0x01
 
+#define FEATURE_ABS_MOUSE 0x01 // query reply features bits
+#define FEATURE_REPORTS   0x02
+#define FEATURE_BATCH     0x04
+
 #define MAGIC_AT    0
 #define CMD_AT      2
 #define SIZE_AT     3
@@ -54,6 +71,10 @@
 #define X_AT        4 // mouse move command x-move position
 #define Y_AT        5 // mouse move command y-move position
 #define ORIENT_AT   4 // mouse scroll wheel command orientation position
+#define ABS_X_AT    4 // mouse absolute move command x position, 2 bytes big endian
+#define ABS_Y_AT    6 // mouse absolute move command y position, 2 bytes big endian
+#define REPORT_AT   4 // keyboard/mouse report command report position
+#define BAUD_AT     4 // set baud command rate position, 4 bytes big endian
 
 #define HEAD_SIZE     4 // from magic to size bytes size
 #define SND_KEY_SIZE  3 // send key message size
@@ -61,14 +82,34 @@
 #define CUR_CLK_SIZE  3 // send mouse click message size
 #define CUR_MV_SIZE   3 // send mouse move message size
 #define CUR_SCR_SIZE  2 // send mouse scroll wheel message size
+#define CUR_ABS_SIZE  5 // send mouse absolute move message size
+#define KEY_RPT_SIZE  8 // send keyboard report message size
+#define CUR_RPT_SIZE  5 // send mouse report message size
+#define SET_BAUD_SIZE 5 // set baud message size
 #define MIN_SIZE      1
+#define BATCH_HEAD    2 // command and content length bytes of a command in a batch
 
 /* Receive buffer settings */
-#define MSG_MAX_SIZE 8
+#define MSG_MAX_SIZE 64 // largest frame, batch and text frames included
 unsigned char g_buf[MSG_MAX_SIZE];
 int g_nBufCursor = 0;
 bool g_bBufFull = false;
 
+/* Receive ring buffer settings, serial input is drained into it while commands run */
+#define RING_SIZE 256 // power of 2
+#define RING_MASK (RING_SIZE-1)
+unsigned char g_ring[RING_SIZE];
+unsigned int g_nRingHead = 0; // next byte written
+unsigned int g_nRingTail = 0; // next byte read
+unsigned long g_ulRingDropped = 0; // bytes lost as the ring was full
+
+/* Serial rate negotiation */
+const unsigned long g_baudRates[] = {19200, 38400, 57600, 115200, 250000, 500000, 1000000};
+unsigned long g_ulBaud = BAUD;
+bool g_bBaudPending = false; // switched rate waiting for its first valid frame
+unsigned long g_baudTimer = 0; // recording the time the rate switched
+int g_nSerialErrors = 0; // bad bytes and frames since the last valid frame
+
 /* Asynchronous press PWR/RST buttons */
 bool g_isSendPwr = false; // is PWR button pressed by emulation
 bool g_isSendRst = false; // is RST button pressed by emulation
@@ -76,7 +117,43 @@ unsigned long g_pwrTimer = 0; // recording PWR button pressed time
 unsigned long g_rstTimer = 0; // recording RST button pressed time
 unsigned long g_pwrDelay = 0; // how long PWR Timer would delay (PWR_DELAY or LPWR_DELAY)
 
-bool checksum(char msg[], int len)
+#define MOUSE_REPORT_ID 1 // report ids of Mouse.h and Keyboard.h
+#define KEY_REPORT_ID   2
+
+#ifdef ABSOLUTE_MOUSE
+#define ABS_REPORT_ID 3
+static const uint8_t g_absDescriptor[] PROGMEM = {
+    0x05, 0x01,             // USAGE_PAGE (Generic Desktop)
+    0x09, 0x02,             // USAGE (Mouse)
+    0xa1, 0x01,             // COLLECTION (Application)
+    0x85, ABS_REPORT_ID,    //   REPORT_ID
+    0x09, 0x01,             //   USAGE (Pointer)
+    0xa1, 0x00,             //   COLLECTION (Physical)
+    0x05, 0x09,             //     USAGE_PAGE (Button), required by some hosts to accept a pointer
+    0x19, 0x01,             //     USAGE_MINIMUM (Button 1)
+    0x29, 0x03,             //     USAGE_MAXIMUM (Button 3)
+    0x15, 0x00,             //     LOGICAL_MINIMUM (0)
+    0x25, 0x01,             //     LOGICAL_MAXIMUM (1)
+    0x95, 0x03,             //     REPORT_COUNT (3)
+    0x75, 0x01,             //     REPORT_SIZE (1)
+    0x81, 0x02,             //     INPUT (Data,Var,Abs)
+    0x95, 0x01,             //     REPORT_COUNT (1)
+    0x75, 0x05,             //     REPORT_SIZE (5)
+    0x81, 0x03,             //     INPUT (Cnst,Var,Abs)
+    0x05, 0x01,             //     USAGE_PAGE (Generic Desktop)
+    0x09, 0x30,             //     USAGE (X)
+    0x09, 0x31,             //     USAGE (Y)
+    0x16, 0x00, 0x00,       //     LOGICAL_MINIMUM (0)
+    0x26, 0xff, 0x7f,       //     LOGICAL_MAXIMUM (32767)
+    0x75, 0x10,             //     REPORT_SIZE (16)
+    0x95, 0x02,             //     REPORT_COUNT (2)
+    0x81, 0x02,             //     INPUT (Data,Var,Abs)
+    0xc0,                   //   END_COLLECTION
+    0xc0                    // END_COLLECTION
+};
+#endif
+
+bool checksum(unsigned char msg[], int len)
 {
     unsigned char b = 0;
     for (int i = 0; i < len; i++)
@@ -84,14 +161,62 @@ bool checksum(char msg[], int len)
     return b == 0;
 }
 
-void ReadByteToBuf()
-{
-    unsigned char ucByte = Serial1.read();
+void SetBaud(unsigned long ulBaud)
+{   // flush the pending reply at the old rate, then restart the port with nothing received
+    Serial1.flush();
+    Serial1.end();
+    Serial1.begin(ulBaud);
+    g_ulBaud = ulBaud;
+    g_bBaudPending = ulBaud != BAUD;
+    g_baudTimer = millis();
+    g_nSerialErrors = 0;
+    g_nRingHead = g_nRingTail = 0;
+    memset(g_buf, '\0', sizeof(g_buf));
+    g_nBufCursor = 0;
+    g_bBufFull = false;
+}
+
+void SerialError()
+{   // a rate the server does not use shows as bad bytes, go back to the rate it opens with
+    if (++g_nSerialErrors >= BAUD_MAX_ERRORS && g_ulBaud != BAUD)
+        SetBaud(BAUD);
+}
+
+void SendReply(unsigned char ucCmd, const unsigned char content[], int nLen)
+{   // a frame to the server, same format as received ones
+    unsigned char head[HEAD_SIZE] = {MAGIC_HEAD, MAGIC_TAIL, ucCmd, (unsigned char)(nLen+1)};
+    unsigned char ucSum = 0;
+    for (int i = 0; i < HEAD_SIZE; i++)
+        ucSum ^= head[i];
+    for (int i = 0; i < nLen; i++)
+        ucSum ^= content[i];
+    Serial1.write(head, HEAD_SIZE);
+    Serial1.write(content, nLen);
+    Serial1.write(ucSum);
+}
+
+void PumpSerial()
+{   // move every received byte into the ring, called between slow HID writes
+    while (Serial1.available() > 0)
+    {
+        unsigned char ucByte = Serial1.read();
+        unsigned int nNext = (g_nRingHead+1) & RING_MASK;
+        if (nNext == g_nRingTail)
+        {   // ring full, the byte is lost and the frame fails its checksum
+            g_ulRingDropped++;
+            continue;
+        }
+        g_ring[g_nRingHead] = ucByte;
+        g_nRingHead = nNext;
+    }
+}
 
+void ReadByteToBuf(unsigned char ucByte)
+{
     if (g_bBufFull) // Full message received, skipped (should never encounter)
         return;
 
-    if (g_nBufCursor > MSG_MAX_SIZE)
+    if (g_nBufCursor >= MSG_MAX_SIZE)
     { // reset buffer as overflow
         memset(g_buf, '\0', sizeof(g_buf));
         g_nBufCursor = 0;
@@ -104,6 +229,8 @@ void ReadByteToBuf()
             g_buf[g_nBufCursor] = MAGIC_HEAD;
             g_nBufCursor++;
         }
+        else
+            SerialError();
         return;
     }
 
@@ -118,6 +245,7 @@ void ReadByteToBuf()
         {   // reset buffer as invalid magic
             memset(g_buf, '\0', CMD_AT);
             g_nBufCursor = 0;
+            SerialError();
         }
         return;
     }
@@ -126,13 +254,22 @@ void ReadByteToBuf()
     {   // read command byte
         switch (ucByte)
         {
+            case CMD_BATCH:
+            case CMD_QUERY:
+            case CMD_SET_BAUD:
+            case CMD_TEXT:
             case CMD_KEY:
             case CMD_TXT:
             case CMD_KEY_CLR:
+            case CMD_KEY_RPT:
             case CMD_CUR_CLK:
             case CMD_CUR_MV:
             case CMD_CUR_SCR:
             case CMD_CUR_CLR:
+            case CMD_CUR_RPT:
+#ifdef ABSOLUTE_MOUSE
+            case CMD_CUR_ABS:
+#endif
             case CMD_PWR:
             case CMD_RST:
             case CMD_LPWR:
@@ -142,16 +279,18 @@ void ReadByteToBuf()
             default: // reset buffer as invalid command
                 memset(g_buf, '\0', CMD_AT);
                 g_nBufCursor = 0;
+                SerialError();
         }
         return;
     }
 
     if (g_nBufCursor == SIZE_AT)
     {   // read size byte
-        if (ucByte < MIN_SIZE)
+        if (ucByte < MIN_SIZE || ucByte+HEAD_SIZE > MSG_MAX_SIZE)
         { // reset buffer as invalid size
             memset(g_buf, '\0', SIZE_AT);
             g_nBufCursor = 0;
+            SerialError();
         }
         else
         {
@@ -193,6 +332,34 @@ void WriteChar()
     Keyboard.write(g_buf[CHAR_AT]); // only one character write, ignore others for preventing serial byte lost
 }
 
+/* Reports are sent as they are, states kept by Keyboard/Mouse are not updated,
+ * so the server writes either reports or click commands for a device, not both */
+void SendKeyReport()
+{
+    if (g_buf[SIZE_AT] < KEY_RPT_SIZE) // skip not enough size
+        return;
+    uint8_t report[8] = {g_buf[REPORT_AT], 0}; // modifiers, reserved, 6 keys
+    memcpy(report+2, g_buf+REPORT_AT+1, 6);
+    HID().SendReport(KEY_REPORT_ID, report, sizeof(report));
+}
+
+void SendMouseReport()
+{
+    if (g_buf[SIZE_AT] < CUR_RPT_SIZE) // skip not enough size
+        return;
+    HID().SendReport(MOUSE_REPORT_ID, g_buf+REPORT_AT, 4); // buttons, x, y, wheel
+}
+
+void WriteText()
+{   // characters from CHAR_AT to the checksum
+    for (int i = CHAR_AT; i < g_buf[SIZE_AT]+HEAD_SIZE-1; i++)
+    {
+        if (g_buf[i] <= MAX_KEY)
+            Keyboard.write(g_buf[i]);
+        PumpSerial();
+    }
+}
+
 void MouseClick()
 {
     if (g_buf[SIZE_AT] < CUR_CLK_SIZE ||
@@ -219,6 +386,17 @@ void MoveMouse()
     Mouse.move((char)g_buf[X_AT], (char)g_buf[Y_AT]);
 }
 
+#ifdef ABSOLUTE_MOUSE
+void MoveMouseAbsolute()
+{
+    if (g_buf[SIZE_AT] < CUR_ABS_SIZE) // skip not enough size
+        return;
+    // buttons stay with the relative mouse, x and y are little endian in the report
+    uint8_t report[5] = {0, g_buf[ABS_X_AT+1], g_buf[ABS_X_AT], g_buf[ABS_Y_AT+1], g_buf[ABS_Y_AT]};
+    HID().SendReport(ABS_REPORT_ID, report, sizeof(report));
+}
+#endif
+
 void ScrollWheel()
 {
     if (g_buf[SIZE_AT] < CUR_SCR_SIZE) // skip not enough size
@@ -255,12 +433,86 @@ void ResetSignal()
     }
 }
 
+void Query()
+{
+    unsigned char features = FEATURE_REPORTS|FEATURE_BATCH;
+#ifdef ABSOLUTE_MOUSE
+    features |= FEATURE_ABS_MOUSE;
+#endif
+    unsigned char reply[6] = {FW_VERSION, features,
+        (unsigned char)(MAX_BAUD>>24), (unsigned char)(MAX_BAUD>>16), (unsigned char)(MAX_BAUD>>8), (unsigned char)MAX_BAUD};
+    SendReply(CMD_QUERY, reply, sizeof(reply));
+}
+
+void SwitchBaud()
+{   // reply the new rate if supported, otherwise the current one and stay
+    if (g_buf[SIZE_AT] < SET_BAUD_SIZE)
+        return;
+    unsigned long ulBaud = 0;
+    for (int i = 0; i < 4; i++)
+        ulBaud = ulBaud<<8 | g_buf[BAUD_AT+i];
+    bool bSupported = false;
+    for (unsigned int i = 0; i < sizeof(g_baudRates)/sizeof(g_baudRates[0]); i++)
+        bSupported = bSupported || (g_baudRates[i] == ulBaud && ulBaud <= MAX_BAUD);
+    if (!bSupported)
+        ulBaud = g_ulBaud;
+    unsigned char reply[4] = {(unsigned char)(ulBaud>>24), (unsigned char)(ulBaud>>16), (unsigned char)(ulBaud>>8), (unsigned char)ulBaud};
+    SendReply(CMD_SET_BAUD, reply, sizeof(reply));
+    if (ulBaud != g_ulBaud)
+        SetBaud(ulBaud);
+}
+
+void RunCommand();
+
+void RunBatch()
+{   // each command is [1B command]+[1B length]+[{length}B content], run as if it came in its own frame
+    unsigned char batch[MSG_MAX_SIZE];
+    int nLen = g_buf[SIZE_AT]-1; // content without checksum
+    memcpy(batch, g_buf+HEAD_SIZE, nLen);
+    for (int i = 0; i+BATCH_HEAD <= nLen && i+BATCH_HEAD+batch[i+1] <= nLen; i += BATCH_HEAD+batch[i+1])
+    {
+        if (batch[i] == CMD_BATCH || batch[i] == CMD_SET_BAUD) // skip nested batch and rate switch
+            continue;
+        g_buf[CMD_AT] = batch[i];
+        g_buf[SIZE_AT] = batch[i+1]+1; // as if followed by a checksum
+        memcpy(g_buf+HEAD_SIZE, batch+i+BATCH_HEAD, batch[i+1]);
+        RunCommand();
+        PumpSerial();
+    }
+}
+
 void AnalyzeByteFromBuf()
 {
-    if (!checksum(g_buf, g_nBufCursor)) // checksum failed
-        g_buf[CMD_AT] = CMD_RSV; // skip switch below for setting g_bBufFull to false
+    if (checksum(g_buf, g_nBufCursor))
+    {   // a valid frame confirms the rate
+        g_nSerialErrors = 0;
+        g_bBaudPending = false;
+        RunCommand();
+    }
+    else // skip the command if checksum failed
+        SerialError();
+    // reset buffer, cursor and full flag
+    memset(g_buf, '\0', sizeof(g_buf));
+    g_nBufCursor = 0;
+    g_bBufFull = false;
+}
+
+void RunCommand()
+{
     switch (g_buf[CMD_AT])
     {
+        case CMD_BATCH: // run many commands
+            RunBatch();
+            break;
+        case CMD_QUERY: // reply version, features and highest rate
+            Query();
+            break;
+        case CMD_SET_BAUD: // switch serial rate
+            SwitchBaud();
+            break;
+        case CMD_TEXT: // click many keyboard printable characters
+            WriteText();
+            break;
         case CMD_KEY: // click a keyboard key
             SendKey();
             break;
@@ -270,6 +522,12 @@ void AnalyzeByteFromBuf()
         case CMD_KEY_CLR: // release all pressed keyboard keys
             Keyboard.releaseAll();
             break;
+        case CMD_KEY_RPT: // set the whole keyboard state
+            SendKeyReport();
+            break;
+        case CMD_CUR_RPT: // set mouse buttons with a move and a scroll
+            SendMouseReport();
+            break;
         case CMD_CUR_CLK: // click a mouse button
             MouseClick();
             break;
@@ -279,6 +537,11 @@ void AnalyzeByteFromBuf()
         case CMD_CUR_SCR: // scroll the mouse wheel
             ScrollWheel();
             break;
+#ifdef ABSOLUTE_MOUSE
+        case CMD_CUR_ABS: // move mouse to absolute position
+            MoveMouseAbsolute();
+            break;
+#endif
         case CMD_CUR_CLR: // release all pressed mouse buttons
             Mouse.release(MOUSE_LEFT);
             Mouse.release(MOUSE_RIGHT);
@@ -294,10 +557,6 @@ void AnalyzeByteFromBuf()
             PowerSignal(LPWR_DELAY);
             break;
     }
-    // reset buffer, cursor and full flag
-    memset(g_buf, '\0', sizeof(g_buf));
-    g_nBufCursor = 0;
-    g_bBufFull = false;
 }
 
 void setup()
@@ -317,6 +576,10 @@ void setup()
     Serial1.begin(BAUD);  // hardware serial port
     Keyboard.begin();     // keyboard emulation
     Mouse.begin();        // mouse emulation
+#ifdef ABSOLUTE_MOUSE
+    static HIDSubDescriptor absNode(g_absDescriptor, sizeof(g_absDescriptor));
+    HID().AppendDescriptor(&absNode); // absolute pointer emulation
+#endif
 }
 
 void loop()
@@ -344,15 +607,26 @@ void loop()
         digitalWrite(RST, nSt^0x01);
     }
 
+    if (g_bBaudPending && ulCurTime-g_baudTimer > BAUD_CONFIRM_MS)
+    { // No valid frame at the new rate, the server gave it up
+        SetBaud(BAUD);
+    }
+
     // Full message received, now analyze
     if (g_bBufFull)
         AnalyzeByteFromBuf();
 
-    // Read from iKVM server
-    if (Serial1.available() > 0)
+    // Read from iKVM server, parse buffered bytes up to the end of a message
+    PumpSerial();
+    if (g_nRingTail != g_nRingHead && !g_bBufFull)
     {
         digitalWrite(LED_BUILTIN_RX, LOW);  // LED on, blinkies
-        ReadByteToBuf();
+        while (g_nRingTail != g_nRingHead && !g_bBufFull)
+        {
+            unsigned char ucByte = g_ring[g_nRingTail];
+            g_nRingTail = (g_nRingTail+1) & RING_MASK; // before parsing, a rate fall back empties the ring
+            ReadByteToBuf(ucByte);
+        }
         digitalWrite(LED_BUILTIN_RX, HIGH); // LED off, blinkies
     }
 }
@@ -0,0 +1,96 @@
+/** Host simulation of the Arduino core used by hardware.ino
+ *  time is simulated: serial bytes arrive at the line rate into the 64 bytes
+ *  receive FIFO of the board, every HID report sent takes SIM_REPORT_US
+ */
+#ifndef SIM_ARDUINO_H
+#define SIM_ARDUINO_H
+#include <stdint.h>
+#include <stdio.h>
+#include <string.h>
+#include <vector>
+
+#define PROGMEM
+#define LOW    0
+#define HIGH   1
+#define INPUT  0
+#define OUTPUT 1
+#define LED_BUILTIN_RX 17
+
+#define SIM_REPORT_US  1000 // a full speed USB HID report every 1ms poll
+#define SIM_LOOP_US    2    // time of a main loop pass
+#define SIM_RX_FIFO    64   // SERIAL_RX_BUFFER_SIZE of the board
+
+static unsigned long g_simMicros = 0;
+static int g_simPins[32];
+
+inline unsigned long millis() { return g_simMicros/1000; }
+inline void pinMode(int, int) {}
+inline int digitalRead(int nPin) { return g_simPins[nPin]; }
+inline void digitalWrite(int nPin, int nValue)
+{
+    if (nPin != LED_BUILTIN_RX && g_simPins[nPin] != nValue)
+        printf("pin %d %d\n", nPin, nValue);
+    g_simPins[nPin] = nValue;
+}
+
+inline void SimReport(int nReports)
+{
+    g_simMicros += nReports*SIM_REPORT_US;
+}
+
+struct SimSerial
+{
+    std::vector<uint8_t> bytes;
+    std::vector<unsigned long> arrivals; // simulated time each byte is received
+    size_t nNext = 0;
+    uint8_t fifo[SIM_RX_FIFO];
+    int nHead = 0, nCount = 0;
+    unsigned long ulDropped = 0; // bytes lost as the FIFO was full
+
+    void begin(unsigned long ulBaud) { printf("baud %lu\n", ulBaud); }
+    void end() {}
+    void flush() {}
+    size_t write(uint8_t ucByte) { return write(&ucByte, 1); }
+    size_t write(const uint8_t *data, size_t nLen)
+    {   // replies to the server
+        printf("serial");
+        for (size_t i = 0; i < nLen; i++)
+            printf(" %02x", data[i]);
+        printf("\n");
+        return nLen;
+    }
+    void Receive()
+    {
+        for (; nNext < bytes.size() && arrivals[nNext] <= g_simMicros; nNext++)
+        {
+            if (nCount == SIM_RX_FIFO)
+                ulDropped++;
+            else
+                fifo[(nHead+nCount++)%SIM_RX_FIFO] = bytes[nNext];
+        }
+    }
+    int available()
+    {
+        g_simMicros += SIM_LOOP_US;
+        Receive();
+        return nCount;
+    }
+    int read()
+    {
+        Receive();
+        if (nCount == 0)
+            return -1;
+        uint8_t ucByte = fifo[nHead];
+        nHead = (nHead+1)%SIM_RX_FIFO;
+        nCount--;
+        return ucByte;
+    }
+    bool Done()
+    {
+        Receive();
+        return nNext == bytes.size() && nCount == 0;
+    }
+};
+static SimSerial Serial1;
+
+#endif
@@ -0,0 +1,32 @@
+#ifndef SIM_HID_H
+#define SIM_HID_H
+#include "Arduino.h"
+
+class HIDSubDescriptor
+{
+public:
+    HIDSubDescriptor(const void *, uint16_t) {}
+};
+
+class HID_
+{
+public:
+    void AppendDescriptor(HIDSubDescriptor *) {}
+    int SendReport(uint8_t id, const void *data, int len)
+    {
+        printf("report %d", id);
+        for (int i = 0; i < len; i++)
+            printf(" %02x", ((const uint8_t *)data)[i]);
+        printf("\n");
+        SimReport(1);
+        return len;
+    }
+};
+
+inline HID_ &HID()
+{
+    static HID_ obj;
+    return obj;
+}
+
+#endif
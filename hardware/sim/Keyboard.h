@@ -0,0 +1,18 @@
+#ifndef SIM_KEYBOARD_H
+#define SIM_KEYBOARD_H
+#include "Arduino.h"
+
+#define KEY_F24 0xFB
+
+class Keyboard_
+{
+public:
+    void begin() {}
+    size_t press(uint8_t k) { printf("press %d\n", k); SimReport(1); return 1; }
+    size_t release(uint8_t k) { printf("release %d\n", k); SimReport(1); return 1; }
+    void releaseAll() { printf("release all\n"); SimReport(1); }
+    size_t write(uint8_t c) { printf("write %d\n", c); SimReport(2); return 1; } // press and release reports
+};
+static Keyboard_ Keyboard;
+
+#endif
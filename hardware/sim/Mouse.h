@@ -0,0 +1,32 @@
+#ifndef SIM_MOUSE_H
+#define SIM_MOUSE_H
+#include "Arduino.h"
+
+#define MOUSE_LEFT   1
+#define MOUSE_RIGHT  2
+#define MOUSE_MIDDLE 4
+
+class Mouse_
+{
+    uint8_t _buttons = 0;
+    void buttons(uint8_t b)
+    {   // a report only when the buttons change, as the Arduino library
+        if (b != _buttons)
+        {
+            _buttons = b;
+            move(0, 0, 0);
+        }
+    }
+public:
+    void begin() {}
+    void move(signed char x, signed char y, signed char wheel = 0)
+    {
+        printf("mouse %d %d %d %d\n", _buttons, x, y, wheel);
+        SimReport(1);
+    }
+    void press(uint8_t b = MOUSE_LEFT) { buttons(_buttons | b); }
+    void release(uint8_t b = MOUSE_LEFT) { buttons(_buttons & ~b); }
+};
+static Mouse_ Mouse;
+
+#endif
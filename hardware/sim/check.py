@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+feed the firmware simulation with the frames the server writes, legacy frames one by one
+and the same input packed into batch/text frames, then compare what reaches the host
+
+    make check
+"""
+import os, sys, subprocess
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from ikvm._uart import *
+
+SIM = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sim')
+
+def run(frames):
+    """ (HID reports, timing line) of [(earliest start, frame),] """
+    lines = ''.join(['%d %s\n' % (start, frame.hex()) for start, frame in frames])
+    result = subprocess.run([SIM], input=lines, capture_output=True, text=True, check=True)
+    return result.stdout.splitlines(), result.stderr.strip()
+
+def legacy(data):
+    return [(0, data[i:i+64]) for i in range(0, len(data), 64)] # the bytes as they are, no gaps
+
+def packed(data, paced=True):
+    """ frames as the server writes them with batch frames enabled, see Kvm.__uart_write """
+    frames, events = [], 0
+    for frame, count in uart_pack(data):
+        start = (events-UART_RING//2)*1000000//UART_EVENT_RATE if paced else 0
+        frames.append((max(start, 0), frame))
+        events += count
+    return frames
+
+text = b''.join([UART_SEND_CHAR(char) for char in b'The quick brown fox jumps over the lazy dog.\n'*20])
+mixed = b''.join([UART_SEND_KEY(1, 0x80), UART_SEND_CHAR(ord('c')), UART_SEND_KEY(0, 0x80)]
+        +[UART_SEND_MOUSE_MOVE(x, -x) for x in range(-60, 60, 3)]
+        +[UART_SEND_MOUSE_CLICK(1, MOUSE_LEFT), UART_SEND_MOUSE_MOVE(10, 10), UART_SEND_MOUSE_CLICK(0, MOUSE_LEFT)]
+        +[UART_SEND_MOUSE_WHEEL(i%2) for i in range(8)]+[UART_SEND_CHAR(char) for char in b'ok\n']
+        +[UART_SEND_KEY_CLEAR, UART_SEND_MOUSE_CLEAR, UART_SEND_ATX(0xFD)])
+
+failed, reports = False, {}
+for name, data in (('text', text), ('mixed', mixed)):
+    expected, timing = reports[name] = run(legacy(data))
+    print('%-6s legacy %6d bytes: %s' % (name, len(data), timing))
+    got, timing = run(packed(data))
+    print('%-6s packed %6d bytes: %s' % (name, sum([len(frame) for frame, _ in uart_pack(data)]), timing))
+    if got != expected:
+        failed = True
+        print('%-6s packed reports differ from legacy, %d vs %d reports' % (name, len(got), len(expected)))
+got, timing = run(packed(text, paced=False))
+print('text   packed unpaced: %s, %s' % (timing, 'reports lost' if got != reports['text'][0] else 'no loss'))
+got, _ = run([(0, UART_QUERY)])
+serial = bytes.fromhex(''.join([line[len('serial '):].replace(' ', '') for line in got if line.startswith('serial ')]))
+cmd, content, _ = uart_reply(serial)
+print('query  reply: version %d features 0x%02x highest %d baud' % (content[0], content[1], int.from_bytes(content[2:6], 'big')))
+failed = failed or cmd != CMD_QUERY
+sys.exit(1 if failed else 0)
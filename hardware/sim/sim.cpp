@@ -0,0 +1,31 @@
+/** Runs hardware.ino on the host
+ *  stdin: a frame per line "<earliest start in microseconds> <hex bytes>", bytes go out
+ *         back to back at the line rate, a frame starts after the previous one ended
+ *  stdout: the HID reports and ATX pin changes, stderr: timing and bytes lost
+ */
+#include "Arduino.h"
+#include "../hardware.ino"
+
+int main()
+{
+    unsigned long ulStart, ulEnd = 0, ulByte = 10000000UL/BAUD;
+    char hex[512+1];
+    while (scanf("%lu %512s", &ulStart, hex) == 2)
+    {
+        ulEnd = ulStart > ulEnd ? ulStart : ulEnd;
+        for (int i = 0; hex[i] && hex[i+1]; i += 2, ulEnd += ulByte)
+        {
+            unsigned int nByte;
+            sscanf(hex+i, "%2x", &nByte);
+            Serial1.bytes.push_back(nByte);
+            Serial1.arrivals.push_back(ulEnd);
+        }
+    }
+
+    setup();
+    while (!Serial1.Done() || g_nRingTail != g_nRingHead || g_bBufFull)
+        loop();
+    fprintf(stderr, "sent %lu us, done %lu us, fifo dropped %lu, ring dropped %lu\n",
+        ulEnd, g_simMicros, Serial1.ulDropped, g_ulRingDropped);
+    return 0;
+}
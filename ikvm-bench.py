@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import sys
+from platform import system
+
+if __name__ != '__main__' or system() != 'Linux':
+    sys.exit(1)
+
+import argparse
+
+def _positive(value):
+    if int(value) <= 0:
+        raise argparse.ArgumentTypeError('Value should be greater than 0')
+    return int(value)
+
+parser = argparse.ArgumentParser(description='Benchmark an iKVM server or the protocol code')
+commands = parser.add_subparsers(dest='command', required=True)
+command = commands.add_parser('transport', help='round trip time and throughput of raw TCP against WebSocket')
+command.add_argument('host', nargs='?', default='::1', help='server host, default "::1"')
+command.add_argument('-p', '--port', type=int, default=7130, help='server port, default 7130')
+command.add_argument('-w', '--ws-port', type=int, help='server WebSocket port, default TCP only')
+command.add_argument('-n', '--requests', type=_positive, default=2000, help='requests per measurement, default 2000')
+command.add_argument('--window', type=_positive, default=32, help='requests in flight measuring throughput, default 32')
+command.add_argument('--request', choices=('input-state', 'stats'), default='input-state',
+        help='request sent, stats has a large response, default input-state')
+command.add_argument('--deflate', action='store_true', help='offer permessage-deflate over WebSocket')
+command = commands.add_parser('encode', help='time per message of the protocol encoders')
+command.add_argument('-n', '--number', type=_positive, default=200000, help='messages encoded per measurement, default 200000')
+args = parser.parse_args()
+
+import os, socket, struct, zlib
+from time import perf_counter
+from timeit import repeat
+from statistics import mean, quantiles
+from ikvm._protocol import *
+from ikvm._websocket import frame, OP_BINARY, OP_CLOSE
+from ikvm.client import _parse
+
+class Transport:
+    """ blocking connection speaking the protocol, messages are framed over WebSocket """
+    def __init__(self, host, port, websocket=False, deflate=False):
+        self.sock = socket.create_connection((host, port), timeout=10)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.websocket = websocket
+        self.raw = b'' # received bytes not unframed
+        self.buf = b'' # received protocol bytes not parsed
+        if websocket:
+            self.sock.sendall((f'GET / HTTP/1.1\r\nHost: {host}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                    f'Sec-WebSocket-Key: {os.urandom(16).hex()[:22]}==\r\nSec-WebSocket-Version: 13\r\n'
+                    +('Sec-WebSocket-Extensions: permessage-deflate\r\n' if deflate else '')+'\r\n').encode())
+            while b'\r\n\r\n' not in self.raw:
+                self.raw += self.__read()
+            head, _, self.raw = self.raw.partition(b'\r\n\r\n')
+            if not head.startswith(b'HTTP/1.1 101'):
+                raise ConnectionError(head.split(b'\r\n')[0].decode())
+        self.send(HANDSHAKE_MSG)
+        while self.receive()[0] != TYPE_HANDSHAKE:
+            pass
+
+    def __read(self):
+        data = self.sock.recv(1 << 16)
+        if not data:
+            raise ConnectionError('Connection closed by server')
+        return data
+
+    def send(self, msg):
+        self.sock.sendall(frame(msg, OP_BINARY, os.urandom(4)) if self.websocket else msg)
+
+    def receive(self):
+        """ (type, value) of the next server message """
+        while True:
+            msg = _parse(self.buf)
+            if msg:
+                type, value, end = msg
+                self.buf = self.buf[end:]
+                return type, value
+            if not self.websocket:
+                self.buf += self.__read()
+                continue
+            payload = self.__unframe()
+            while payload is None:
+                self.raw += self.__read()
+                payload = self.__unframe()
+            self.buf += payload
+
+    def __unframe(self): # payload of the next server frame, None while incomplete
+        if len(self.raw) < 2:
+            return None
+        head, size, start = self.raw[0], self.raw[1]&0x7F, 2
+        if size >= 126:
+            start += 2 if size == 126 else 8
+            if len(self.raw) < start:
+                return None
+            size, = struct.unpack_from('!H' if size == 126 else '!Q', self.raw, 2)
+        if len(self.raw) < start+size:
+            return None
+        payload, self.raw = self.raw[start:start+size], self.raw[start+size:]
+        if head&0x0F == OP_CLOSE:
+            raise ConnectionError('WebSocket closed by server')
+        if head&0x40:
+            payload = zlib.decompressobj(wbits=-zlib.MAX_WBITS).decompress(payload+b'\x00\x00\xff\xff')
+        return payload
+
+    def request(self, msg, reply):
+        self.send(msg)
+        while self.receive()[0] != reply:
+            pass
+
+    def close(self):
+        try:
+            self.send(GOODBYE_MSG)
+        except OSError:
+            pass
+        self.sock.close()
+
+def transport(name, conn, msg, reply):
+    for _ in range(min(args.requests, 100)): # warm up
+        conn.request(msg, reply)
+    rtts = []
+    for _ in range(args.requests):
+        start = perf_counter()
+        conn.request(msg, reply)
+        rtts.append(perf_counter()-start)
+    start, sent, received = perf_counter(), 0, 0
+    while received < args.requests:
+        while sent < args.requests and sent-received < args.window:
+            conn.send(msg)
+            sent += 1
+        if conn.receive()[0] == reply:
+            received += 1
+    elapsed = perf_counter()-start
+    q = quantiles(rtts, n=100)
+    print(f'{name:<10} rtt mean {mean(rtts)*1e6:8.1f} us  p50 {q[49]*1e6:8.1f} us  p99 {q[98]*1e6:8.1f} us'
+          f'  throughput {args.requests/elapsed:9.0f} req/s')
+
+def encode():
+    uarts = [(f'/dev/ttyUSB{i}', 0x0483, 0xdf11) for i in range(4)]
+    caps = [(f'/dev/video{i}', [((1920, 1080), [60, 30, 15]), ((1280, 720), [60, 30, 15]), ((640, 480), [30, 15])])
+            for i in range(0, 4, 2)]
+    cases = [
+        ('status constant', lambda: STATUS_CODE_RES(TYPE_SEND_KEY_RES, STATUS_FAILURE, 'Serial Error: Device not opened')),
+        ('status variable', lambda: STATUS_CODE_RES(TYPE_SEND_KEY_RES, STATUS_SUCCESS, 'Send pressed key <04> success')),
+        ('send key', lambda: SEND_KEY_REQ_K(KEY_PRESS, 0x04)),
+        ('send text', lambda: SEND_KEY_REQ_C('The quick brown fox')),
+        ('mouse move', lambda: SEND_MOUSE_REQ_M(-3, 5)),
+        ('list uarts', lambda: LIST_UART_RES(uarts)),
+        ('list captures', lambda: LIST_CAP_RES(caps)),
+    ]
+    for name, func in cases:
+        best = min(repeat(func, number=args.number, repeat=5))
+        print(f'{name:<16} {best/args.number*1e9:8.1f} ns/msg')
+
+if args.command == 'encode':
+    encode()
+elif args.command == 'transport':
+    msg, reply = (INPUT_STATE_REQ, TYPE_INPUT_STATE_RES) if args.request == 'input-state' else (STATS_REQ, TYPE_STATS_RES)
+    conns = [('tcp', Transport(args.host, args.port))]
+    if args.ws_port:
+        conns.append(('websocket', Transport(args.host, args.ws_port, True, args.deflate)))
+    for name, conn in conns:
+        transport(name, conn, msg, reply)
+        conn.close()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import sys
+from platform import system
+
+if __name__ != '__main__' or system() != 'Linux':
+    sys.exit(1)
+
+import argparse, asyncio
+
+def _hosts(path):
+    try:
+        with open(path) as fh:
+            return [line.split('#')[0].strip() for line in fh if line.split('#')[0].strip()]
+    except OSError as e:
+        raise argparse.ArgumentTypeError('Host list "{}" cannot be read: {}'.format(path, e.strerror))
+
+def _positive(value):
+    if int(value) <= 0:
+        raise argparse.ArgumentTypeError('Value should be greater than 0')
+    return int(value)
+
+def _byte(value):
+    if int(value, 0) not in range(0x100):
+        raise argparse.ArgumentTypeError('Value should be between 0 and 255')
+    return int(value, 0)
+
+parser = argparse.ArgumentParser(description='Run an iKVM request on many servers concurrently')
+parser.add_argument('-H', '--host', action='append', dest='hosts', default=[], help='server "host", "host:port" or "[ipv6]:port", repeatable')
+parser.add_argument('-f', '--hosts-file', type=_hosts, default=[], help='file of servers, one per line, "#" comments')
+parser.add_argument('-p', '--port', type=int, default=7130, help='server port when not given with the host, default 7130')
+parser.add_argument('-c', '--concurrency', type=_positive, default=64, help='servers handled at once, default 64')
+parser.add_argument('-t', '--timeout', type=float, default=10, help='second(s) waiting a connection or response, default 10')
+parser.add_argument('--target', type=_byte, help='select the target first on multi-target servers')
+commands = parser.add_subparsers(dest='command', required=True)
+commands.add_parser('list-uarts', help='list serial devices')
+commands.add_parser('list-captures', help='list video captures')
+commands.add_parser('targets', help='list targets')
+commands.add_parser('stats', help='runtime statistics')
+commands.add_parser('lease', help='acquire the input lease')
+commands.add_parser('open-uart', help='open a serial device').add_argument('name')
+command = commands.add_parser('text', help='type a text')
+command.add_argument('text')
+command.add_argument('--layout', help='keyboard layout of the hosts, us/uk/de/fr, allows non-ascii text')
+command = commands.add_parser('key', help='press and release a key')
+command.add_argument('key', type=_byte, help='Arduino key code, e.g. 0xB0 for Enter')
+command = commands.add_parser('atx', help='send an atx signal')
+command.add_argument('signal', choices=['short power', 'reset', 'long power'])
+
+args = parser.parse_args()
+hosts = args.hosts+args.hosts_file
+if not hosts:
+    parser.error('no server given, use -H or -f')
+
+from ikvm._protocol import *
+from ikvm.client import Pool
+
+async def run(kvm):
+    if args.target is not None:
+        await kvm.select(args.target)
+    if args.command == 'list-uarts':
+        return await kvm.list_uarts()
+    if args.command == 'list-captures':
+        return await kvm.list_captures()
+    if args.command == 'targets':
+        return await kvm.targets()
+    if args.command == 'stats':
+        return await kvm.stats()
+    if args.command == 'lease':
+        return await kvm.lease(LEASE_ACQUIRE)
+    if args.command == 'open-uart':
+        return await kvm.open_uart(args.name)
+    if args.command == 'text':
+        return await kvm.text(args.text, args.layout)
+    if args.command == 'key':
+        # pipelined, both are written before the first response
+        return ', '.join(await asyncio.gather(kvm.key(KEY_PRESS, args.key), kvm.key(KEY_RELEASE, args.key)))
+    if args.command == 'atx':
+        return await kvm.atx(ATX_SIGNAL[args.signal])
+
+async def main():
+    async with Pool(hosts, args.port, args.concurrency, args.timeout) as pool:
+        results = await pool.map(run)
+    failed = 0
+    for host, result in results.items():
+        if isinstance(result, Exception):
+            failed += 1
+            print(f'{host}: error: {result or type(result).__name__}', file=sys.stderr)
+        else:
+            print(f'{host}: {result}')
+    return failed
+
+sys.exit(1 if asyncio.run(main()) else 0)
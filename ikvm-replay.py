@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import sys
+from platform import system
+
+if __name__ != '__main__' or system() != 'Linux':
+    sys.exit(1)
+
+import argparse, os
+
+def _journal(path):
+    if not os.path.isfile(path):
+        raise argparse.ArgumentTypeError('Journal file "{}" does not exist'.format(path))
+    return path
+
+def _speed(speed):
+    if float(speed) < 0:
+        raise argparse.ArgumentTypeError('Speed should not be negative')
+    return float(speed)
+
+parser = argparse.ArgumentParser(description='Replay an iKVM input event journal through a serial device')
+parser.add_argument('journal', type=_journal, help='input event journal recorded by iKVM server --journal')
+parser.add_argument('device', help='serial device to replay to (e.g. /dev/ttyUSB0)')
+parser.add_argument('-s', '--speed', type=_speed, default=1.0, help='timing acceleration factor, 0 as fast as possible, default 1')
+parser.add_argument('-t', '--target', type=int, help='target id whose records are replayed, required when the journal holds several targets')
+args = parser.parse_args()
+
+import serial
+from ikvm._uart import BAUDRATE, UART_TIMEOUT, UART_MAX_BUF
+from ikvm._journal import read_journal, replay
+
+try:
+    targets = sorted({record[3] for record in read_journal(args.journal)})
+except ValueError as e:
+    parser.error(str(e))
+if args.target is None and len(targets) > 1:
+    parser.error('the journal holds targets {}, select one with --target'.format(', '.join(map(str, targets))))
+if args.target is not None and args.target not in targets:
+    parser.error('the journal holds no records of target {}'.format(args.target))
+
+uart = serial.Serial(args.device, BAUDRATE, write_timeout=UART_TIMEOUT)
+
+def write(data):
+    while len(data) > 0:
+        sent = uart.write(data[:UART_MAX_BUF])
+        data = data[sent:]
+
+try:
+    replay(read_journal(args.journal), write, args.speed, args.target)
+except (serial.SerialException, ValueError) as e:
+    print(e, file=sys.stderr)
+    sys.exit(1)
+except KeyboardInterrupt:
+    # leave nothing pressed on the controlled host
+    from ikvm._uart import UART_SEND_KEY_CLEAR, UART_SEND_MOUSE_CLEAR
+    write(UART_SEND_KEY_CLEAR+UART_SEND_MOUSE_CLEAR)
+finally:
+    uart.close()
+sys.exit(0)
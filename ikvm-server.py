@@ -8,7 +8,8 @@ if __name__ != '__main__' or system() != 'Linux':
     sys.exit(1)
 
 import argparse, os, shutil
-from ikvm._globals import address_family
+from ikvm._globals import address_family, TARGET_MAX, HEARTBEAT_INTERVAL
+from ikvm._uart import BAUDRATE, BAUDRATES
 
 def _port(port):
     if int(port) not in range(1, 0x10000):
@@ -34,6 +35,31 @@ def _logfile(logfile):
         raise argparse.ArgumentTypeError('Log file "{}" should not be a folder'.format(logfile))
     return logfile
 
+def _record_dir(folder):
+    if os.path.exists(folder) and not os.path.isdir(folder):
+        raise argparse.ArgumentTypeError('Record path "{}" should be a folder'.format(folder))
+    return folder
+
+def _positive(value):
+    if int(value) <= 0:
+        raise argparse.ArgumentTypeError('Value should be greater than 0')
+    return int(value)
+
+def _count(value):
+    if int(value) < 0:
+        raise argparse.ArgumentTypeError('Value should not be negative')
+    return int(value)
+
+def _seconds(value):
+    if float(value) < 0:
+        raise argparse.ArgumentTypeError('Value should not be negative')
+    return float(value)
+
+def _target(name):
+    if not name or len(name.encode('utf-8')) > 0xFF:
+        raise argparse.ArgumentTypeError('Target name should be 1 to 255 bytes')
+    return name
+
 def _log_level(log_level):
     if int(log_level) not in range(6):
         raise argparse.ArgumentTypeError('Log level should be between 0 and 5')
@@ -46,17 +72,49 @@ parser.add_argument('--mjpg-root', type=_mjpg_root, default='', help='MJPG-Strea
 parser.add_argument('--logfile', type=_logfile, help='iKVM server saved log file path, default SYSOUT and SYSERR')
 parser.add_argument('--log-level', type=_log_level, default=3, help='log level used, default 3')
 parser.add_argument('--mjpg-logfile', type=_logfile, help='MJPG-Streamer service saved log file path, default SYSOUT')
+parser.add_argument('--target', type=_target, action='append', dest='targets', help='name of a managed target, repeat for multi-target mode, default one target "default"')
+parser.add_argument('--ws-port', type=_port, help='serve the protocol over WebSocket on the port for browser consoles, default disabled')
+parser.add_argument('--ws-deflate', action='store_true', help='negotiate permessage-deflate with WebSocket clients, compressing only large messages')
+parser.add_argument('--udp-port', type=_port, help='accept pointer moves and wheel as UDP datagrams on the port, default disabled')
+parser.add_argument('--metrics-port', type=_port, help='serve Prometheus metrics on the port, default disabled')
+parser.add_argument('--profile-dir', type=_record_dir, help='folder of profiles and traces triggered by SIGUSR1/SIGUSR2 or request, default system temporary folder')
+parser.add_argument('--abs-mouse', action='store_true', help='firmware built with ABSOLUTE_MOUSE, absolute moves take one frame')
+parser.add_argument('--hid-reports', action='store_true', help='firmware handles keyboard/mouse report frames, a chord or drag takes one frame')
+parser.add_argument('--batch-frames', action='store_true', help='firmware handles batch/text frames, a burst of input is packed into few frames')
+parser.add_argument('--max-baud', type=int, choices=(BAUDRATE,)+BAUDRATES, default=BAUDRATES[0], help=f'highest serial rate negotiated with the firmware, {BAUDRATE} disables, default {BAUDRATES[0]}')
+parser.add_argument('--heartbeat', type=_seconds, default=HEARTBEAT_INTERVAL, help=f'seconds between ask alive of every client, measuring RTT and closing dead clients, 0 disables, default {HEARTBEAT_INTERVAL}')
+parser.add_argument('--handover', type=_logfile, help='Unix socket path a restarted server takes the clients, serial devices and mjpg-streamers over by, SIGHUP starts a successor, default disabled')
+parser.add_argument('--journal', type=_logfile, help='binary input event journal file path, default disabled')
+parser.add_argument('--record-dir', type=_record_dir, help='record video stream segments into the folder, default disabled')
+parser.add_argument('--record-segment-size', type=_positive, default=256, help='recorded segment size in MiB, default 256')
+parser.add_argument('--record-segment-time', type=_positive, default=600, help='recorded segment duration in seconds, default 600')
+parser.add_argument('--record-retention', type=_count, default=144, help='recorded segments kept on disk, 0 keeps all, default 144')
 
 # set input arguments
 args = parser.parse_args()
+if args.targets and len(set(args.targets)) != len(args.targets):
+    parser.error('argument --target: names should be unique')
+if args.targets and len(args.targets) > TARGET_MAX:
+    parser.error(f'argument --target: at most {TARGET_MAX} targets')
 port = args.port
 mjpg_root = args.mjpg_root
 logfile = args.logfile
 log_level = args.log_level
 mjpg_logfile = args.mjpg_logfile
 bind = args.bind
+record = dict(
+    record_dir=args.record_dir,
+    record_segment_size=args.record_segment_size << 20,
+    record_segment_time=args.record_segment_time,
+    record_retention=args.record_retention,
+)
 
 from ikvm.kvm import Kvm
-kvm = Kvm(port, bind, mjpg_root, logfile, log_level, mjpg_logfile)
+kvm = Kvm(port, bind, mjpg_root, logfile, log_level, mjpg_logfile, journal=args.journal,
+    metrics_port=args.metrics_port, profile_dir=args.profile_dir, targets=args.targets,
+    abs_mouse=args.abs_mouse, hid_reports=args.hid_reports,
+    batch_frames=args.batch_frames, max_baud=args.max_baud,
+    heartbeat=args.heartbeat, handover=args.handover,
+    ws_port=args.ws_port, ws_deflate=args.ws_deflate, udp_port=args.udp_port, **record)
 kvm.start()
 sys.exit(0)
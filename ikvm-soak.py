@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import sys
+from platform import system
+
+if __name__ != '__main__' or system() != 'Linux':
+    sys.exit(1)
+
+import argparse
+
+def _positive(value):
+    if float(value) <= 0:
+        raise argparse.ArgumentTypeError('Value should be greater than 0')
+    return float(value)
+
+def _clients(value):
+    if int(value) <= 0:
+        raise argparse.ArgumentTypeError('Value should be greater than 0')
+    return int(value)
+
+parser = argparse.ArgumentParser(description='Churn clients against a local iKVM server for hours, '
+        'tracking its resources and latencies and flagging regressions. Exits 1 when any is flagged')
+parser.add_argument('port', type=int, nargs='?', default=7130, help='server port, default 7130')
+parser.add_argument('-H', '--host', default='::1', help='server host, default "::1"')
+parser.add_argument('--pid', type=int, help='PID of the server already listening, default start one by ikvm-server.py')
+parser.add_argument('--server-args', default='', help='extra arguments of the server started, e.g. "--mjpg-root /opt/mjpg"')
+parser.add_argument('-c', '--clients', type=_clients, default=24, help='clients churning at once, default 24')
+parser.add_argument('-d', '--duration', type=_positive, default=3600, help='second(s) of churn, default 3600')
+parser.add_argument('-i', '--interval', type=_positive, default=10, help='second(s) between samples, default 10')
+parser.add_argument('--warmup', type=_positive, default=30, help='second(s) of churn the baseline is taken from, default 30')
+parser.add_argument('--settle', type=_positive, default=20, help='second(s) after the churn until idle resources are checked, default 20')
+parser.add_argument('--fd-slack', type=int, default=8, help='fds over the baseline flagged as a leak, default 8')
+parser.add_argument('--thread-slack', type=int, default=4, help='threads over the baseline flagged as a leak, default 4')
+parser.add_argument('--rss-growth', type=_positive, default=0.25, help='RSS growth over the baseline flagged, default 0.25')
+parser.add_argument('--max-loop', type=_positive, default=0.1, help='p99 second(s) of a main loop iteration flagged as a stall, default 0.1')
+parser.add_argument('--max-handshake', type=_positive, default=1, help='p99 second(s) from connect to handshake flagged, default 1')
+parser.add_argument('--max-probe', type=_positive, default=2, help='second(s) of a stats request flagged as a stall, default 2')
+parser.add_argument('--report', help='append every sample as a JSON line to the file')
+args = parser.parse_args()
+
+import os, json, random, select, shlex, signal, socket, subprocess, threading
+from time import sleep, time, perf_counter
+from statistics import median, quantiles
+from ikvm._protocol import *
+from ikvm.client import _parse
+
+SCENARIOS = { # behaviour of a churning client and its weight
+    'abandon': 3,  # connect then close, before or halfway through the handshake
+    'brief': 3,    # handshake, a few requests, then goodbye or a reset
+    'hold': 2,     # handshake and stay alive a while, holding or observing the lease
+    'dead': 1,     # handshake then never answer ask alive, its lease is taken over
+    'race': 1,     # several connections handshake and acquire the lease at once
+    'slow': 2,     # a part of the handshake or a request, then quiet longer than --max-loop before the rest
+}
+
+class Client:
+    """ blocking connection answering ask alive while it is pumped """
+    def __init__(self, host, port):
+        self.started = perf_counter()
+        self.sock = socket.create_connection((host, port), timeout=5)
+        self.buf = b''
+        self.handshake = None # second(s) from connect to the handshake reply
+
+    def send(self, msg):
+        self.sock.sendall(msg)
+
+    def pump(self, seconds, answer=True, until=None):
+        """ handle messages for the seconds, True once a message of type until arrives,
+            None when the server closed the connection """
+        deadline = perf_counter()+seconds
+        while True:
+            while True:
+                msg = _parse(self.buf)
+                if not msg:
+                    break
+                type, value, end = msg
+                self.buf = self.buf[end:]
+                if type == TYPE_HANDSHAKE and self.handshake is None:
+                    self.handshake = perf_counter()-self.started
+                if type == TYPE_ASK_ALIVE and answer:
+                    self.send(REPLY_ALIVE_MSG)
+                if type == until:
+                    self.value = value
+                    return True
+            timeout = deadline-perf_counter()
+            if timeout <= 0:
+                return False
+            if not select.select([self.sock], [], [], timeout)[0]:
+                return False
+            data = self.sock.recv(1 << 16)
+            if not data:
+                return None
+            self.buf += data
+
+    def close(self, reset=False):
+        if reset: # RST instead of FIN
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, b'\1\0\0\0\0\0\0\0')
+        self.sock.close()
+
+class Soak:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = True
+        self.open = 0 # client connections open now
+        self.counts = {} # connections per scenario and outcome
+        self.handshakes = [] # client side handshake times of the interval
+        self.errors = {} # client side errors per kind
+
+    def count(self, key, table=None):
+        with self.lock:
+            table = self.counts if table is None else table
+            table[key] = table.get(key, 0)+1
+
+    def connect(self):
+        client = Client(args.host, args.port)
+        with self.lock:
+            self.open += 1
+        return client
+
+    def close(self, client, reset=False):
+        client.close(reset)
+        with self.lock:
+            self.open -= 1
+            if client.handshake is not None:
+                self.handshakes.append(client.handshake)
+
+    def handshake(self, client):
+        client.send(HANDSHAKE_MSG)
+        if not client.pump(5, until=TYPE_HANDSHAKE):
+            raise ConnectionError('handshake')
+
+    def abandon(self):
+        client = self.connect()
+        if random.random() < 0.5:
+            client.send(HANDSHAKE_MSG[:random.randint(1, len(HANDSHAKE_MSG)-1)])
+        self.close(client, random.random() < 0.5)
+
+    def brief(self):
+        client = self.connect()
+        try:
+            self.handshake(client)
+            for _ in range(random.randint(0, 5)):
+                client.send(INPUT_STATE_REQ)
+                client.pump(1, until=TYPE_INPUT_STATE_RES)
+            if random.random() < 0.5:
+                client.send(GOODBYE_MSG)
+        finally:
+            self.close(client, random.random() < 0.5)
+
+    def hold(self):
+        client = self.connect()
+        try:
+            self.handshake(client)
+            if random.random() < 0.5:
+                client.send(LEASE_REQ(LEASE_ACQUIRE))
+            client.pump(random.uniform(1, 10))
+            client.send(GOODBYE_MSG)
+        finally:
+            self.close(client)
+
+    def dead(self):
+        client = self.connect()
+        try:
+            self.handshake(client)
+            client.pump(random.uniform(1, 8), answer=False)
+        finally:
+            self.close(client, True)
+
+    def race(self):
+        clients = []
+        try:
+            for _ in range(random.randint(2, 4)):
+                clients.append(self.connect())
+            for client in clients:
+                client.send(HANDSHAKE_MSG)
+            for i, client in enumerate(clients): # replies arrive at once, waiting in turn adds no time
+                if not client.pump(5, answer=i%2 == 0, until=TYPE_HANDSHAKE):
+                    raise ConnectionError('handshake')
+            for client in clients:
+                client.send(LEASE_REQ(LEASE_ACQUIRE))
+            deadline = perf_counter()+random.uniform(0.5, 4)
+            while perf_counter() < deadline:
+                for i, client in enumerate(clients):
+                    client.pump(0.05, answer=i%2 == 0) # odd ones look dead to a takeover
+        finally:
+            for client in clients:
+                self.close(client, random.random() < 0.5)
+
+    def slow(self):
+        client = self.connect()
+        try:
+            msg, until = HANDSHAKE_MSG, TYPE_HANDSHAKE
+            if random.random() < 0.5: # a request with a body after the handshake
+                self.handshake(client)
+                msg, until = LEASE_REQ(LEASE_QUERY), TYPE_LEASE_RES
+            cut = random.randint(1, len(msg)-1)
+            client.send(msg[:cut])
+            client.pump(random.uniform(args.max_loop*3, args.max_loop*3+2), answer=False) # a reply would split the message
+            client.started = perf_counter() # the handshake is timed from its last byte
+            client.send(msg[cut:])
+            if not client.pump(5, until=until):
+                raise ConnectionError('slow')
+        finally:
+            self.close(client, random.random() < 0.5)
+
+    def churn(self):
+        names, weights = list(SCENARIOS), list(SCENARIOS.values())
+        while self.running:
+            name = random.choices(names, weights)[0]
+            try:
+                getattr(self, name)()
+                self.count(name)
+            except (OSError, ConnectionError) as e: # e.g. rejected as the server has SESSION_MAX sessions
+                self.count(f'{name} {type(e).__name__}', self.errors)
+                sleep(random.uniform(0, 0.1))
+
+    def take(self):
+        with self.lock:
+            handshakes, self.handshakes = self.handshakes, []
+            counts, self.counts = self.counts, {}
+            errors, self.errors = self.errors, {}
+            return handshakes, counts, errors, self.open
+
+def process(pid):
+    """ (open fds, RSS bytes, threads) of the server process """
+    fds = len(os.listdir(f'/proc/{pid}/fd'))
+    status = dict(line.split(':', 1) for line in open(f'/proc/{pid}/status').read().splitlines())
+    return fds, int(status['VmRSS'].split()[0]) << 10, int(status['Threads'])
+
+def histogram_p99(now, before):
+    """ upper bound (second) the 99th percentile of the observations between two snapshots falls in """
+    count = now['count']-(before['count'] if before else 0)
+    if count <= 0:
+        return None
+    for le, n in now['buckets'].items():
+        if n-(before['buckets'][le] if before else 0) >= count*0.99:
+            return float(le)
+    return float('inf')
+
+def percentile(values, p):
+    if len(values) < 2:
+        return values[0] if values else None
+    return quantiles(values, n=100)[p-1]
+
+def ms(value):
+    return '-' if value is None else 'inf' if value == float('inf') else f'{value*1e3:.1f}ms'
+
+def main():
+    server = None
+    if args.pid is None:
+        server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ikvm-server.py'),
+                str(args.port), '-B', args.host, '--log-level', '1', *shlex.split(args.server_args)],
+                stdout=subprocess.DEVNULL, start_new_session=True)
+        sleep(1)
+    pid = args.pid or server.pid
+    soak, flags, report = Soak(), [], open(args.report, 'a') if args.report else None
+
+    def flag(elapsed, kind, detail):
+        flags.append((elapsed, kind, detail))
+        print(f'{elapsed:7.0f}s REGRESSION {kind}: {detail}', flush=True)
+
+    try:
+        probe = Client(args.host, args.port) # stays connected, its stats requests detect stalls
+        soak.handshake(probe)
+        def stats():
+            timer = perf_counter()
+            probe.send(STATS_REQ)
+            if not probe.pump(args.max_probe*5, until=TYPE_STATS_RES):
+                return None, None
+            return probe.value, perf_counter()-timer
+        probe.pump(1)
+        idle = process(pid) # with only the probe connected
+        before, _ = stats()
+        print(f'idle server pid {pid}: {idle[0]} fds, {idle[1]/(1 << 20):.1f} MiB RSS, {idle[2]} threads', flush=True)
+
+        workers = [threading.Thread(target=soak.churn, daemon=True) for _ in range(args.clients)]
+        for worker in workers:
+            worker.start()
+        start, baseline, warmup = time(), None, []
+        while time()-start < args.duration:
+            probe.pump(args.interval)
+            elapsed = time()-start
+            now, rtt = stats()
+            fds, rss, threads = process(pid)
+            handshakes, counts, errors, opened = soak.take()
+            sample = dict(elapsed=round(elapsed, 1), fds=fds, excess_fds=fds-opened, rss=rss, threads=threads,
+                    clients=opened, scenarios=counts, errors=errors, probe=rtt, rejected=now and (
+                        now['ikvm_connections_total'].get('rejected', 0)-before['ikvm_connections_total'].get('rejected', 0)),
+                    handshake_p50=percentile(handshakes, 50), handshake_p99=percentile(handshakes, 99),
+                    server_handshake_p99=now and histogram_p99(now['ikvm_handshake_seconds'], before['ikvm_handshake_seconds']),
+                    loop_p99=now and histogram_p99(now['ikvm_loop_busy_seconds'], before['ikvm_loop_busy_seconds']))
+            print(f'{elapsed:7.0f}s fds {fds:4d} (+{fds-opened:3d} over clients) rss {rss/(1 << 20):6.1f}MiB threads {threads:3d} '
+                    f'conns {sum(counts.values()):5d} errors {sum(errors.values()):3d} rejected {sample["rejected"]} handshake p50 {ms(sample["handshake_p50"])} '
+                    f'p99 {ms(sample["handshake_p99"])} loop p99 {ms(sample["loop_p99"])} probe {ms(rtt)}', flush=True)
+            if report:
+                report.write(json.dumps(sample)+'\n')
+                report.flush()
+            before = now or before
+            if now is None:
+                flag(elapsed, 'stall', f'stats request unanswered in {args.max_probe*5:.0f}s')
+                break
+            if rtt > args.max_probe:
+                flag(elapsed, 'stall', f'stats request took {ms(rtt)}')
+            if sample['loop_p99'] is not None and sample['loop_p99'] > args.max_loop:
+                flag(elapsed, 'loop', f'main loop iteration p99 within {ms(sample["loop_p99"])}')
+            if sample['handshake_p99'] is not None and sample['handshake_p99'] > args.max_handshake:
+                flag(elapsed, 'handshake', f'connect to handshake p99 {ms(sample["handshake_p99"])}')
+            if elapsed < args.warmup or baseline is None and not warmup:
+                warmup.append(sample)
+                continue
+            if baseline is None:
+                baseline = dict(excess_fds=max([s['excess_fds'] for s in warmup]),
+                        threads=max([s['threads'] for s in warmup]), rss=median([s['rss'] for s in warmup]))
+                print(f'baseline: +{baseline["excess_fds"]} fds over clients, {baseline["threads"]} threads, '
+                        f'{baseline["rss"]/(1 << 20):.1f} MiB RSS', flush=True)
+            if sample['excess_fds'] > baseline['excess_fds']+args.fd_slack:
+                flag(elapsed, 'fds', f'{sample["excess_fds"]} fds over clients, baseline {baseline["excess_fds"]}')
+            if threads > baseline['threads']+args.thread_slack:
+                flag(elapsed, 'threads', f'{threads} threads, baseline {baseline["threads"]}')
+            if rss > baseline['rss']*(1+args.rss_growth):
+                flag(elapsed, 'rss', f'{rss/(1 << 20):.1f} MiB RSS, baseline {baseline["rss"]/(1 << 20):.1f} MiB')
+
+        ## stop the churn, every session but the probe must go and take its resources along
+        soak.running = False
+        while any(worker.is_alive() for worker in workers): # the probe answers ask alive meanwhile
+            probe.pump(0.5)
+        probe.pump(args.settle)
+        fds, rss, threads = process(pid)
+        now, rtt = stats()
+        sessions = now and now['ikvm_sessions']
+        print(f'settled: {fds} fds, {rss/(1 << 20):.1f} MiB RSS, {threads} threads, {sessions} session(s)', flush=True)
+        if fds > idle[0]+args.fd_slack:
+            flag(time()-start, 'fds', f'{fds} fds when idle, {idle[0]} before the churn')
+        if sessions != 1:
+            flag(time()-start, 'sessions', f'{sessions} session(s) left, only the probe should be')
+        probe.send(GOODBYE_MSG)
+        probe.close()
+    finally:
+        soak.running = False
+        if server:
+            server.send_signal(signal.SIGTERM)
+            server.wait()
+        if report:
+            report.close()
+    print(f'{len(flags)} regression(s) flagged')
+    return 1 if flags else 0
+
+sys.exit(main())
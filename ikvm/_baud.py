@@ -0,0 +1,79 @@
+# coding: utf-8
+"""
+serial rate negotiation with the firmware
+
+The serial is opened at BAUDRATE, the rate of the firmware at power on. A query frame asks
+the firmware its version, features and highest rate, a firmware without the query does
+not reply and the rate stays. Otherwise the rates both sides support are tried from the
+highest: the firmware replies set baud at the old rate, both sides switch and a query at
+the new rate must come back with a valid checksum. A rate failing it is given up by both
+sides, the firmware falls back to BAUDRATE as no valid frame arrives within BAUD_CONFIRM.
+"""
+from time import sleep, perf_counter
+from ._uart import *
+
+QUERY_TRIES = 3 # a firmware left at another rate falls back on the bad bytes of the first queries
+
+def read_reply(uart, cmd, timeout=BAUD_REPLY_TIMEOUT):
+    """ content of the firmware reply to cmd, None on timeout or a bad checksum """
+    data, deadline = b'', perf_counter()+timeout
+    while perf_counter() < deadline:
+        uart.timeout = max(deadline-perf_counter(), 0)
+        data += uart.read(max(uart.in_waiting, 1))
+        try:
+            reply, content, data = uart_reply(data)
+        except ValueError:
+            return None
+        if reply == cmd:
+            return content
+    return None
+
+def query(uart, tries=1):
+    """ (version, features, highest rate) of the firmware, None if it does not reply """
+    for _ in range(tries):
+        uart.reset_input_buffer()
+        uart.write(UART_QUERY)
+        content = read_reply(uart, CMD_QUERY)
+        if content and len(content) >= 6:
+            return content[0], content[1], int.from_bytes(content[2:6], 'big')
+    return None
+
+def switch(uart, baud):
+    """ move both sides to the rate, False if it failed and both are back at the old rate """
+    old = uart.baudrate
+    uart.reset_input_buffer()
+    uart.write(UART_SET_BAUD(baud))
+    content = read_reply(uart, CMD_SET_BAUD)
+    if content is None or int.from_bytes(content, 'big') != baud:
+        return False # unsupported, the firmware stays
+    uart.baudrate = baud
+    if query(uart) is not None:
+        return True
+    ## heard if the firmware took the new rate, otherwise it falls back by itself
+    restore(uart, old)
+    sleep(BAUD_CONFIRM)
+    uart.reset_input_buffer()
+    return False
+
+def restore(uart, baud=BAUDRATE):
+    """ move both sides back to the rate without waiting the firmware reply """
+    if uart.baudrate == baud:
+        return
+    uart.write(UART_SET_BAUD(baud))
+    uart.flush()
+    uart.baudrate = baud
+
+def negotiate(uart, max_baud=BAUDRATES[0]):
+    """ (rate, firmware (version, features, highest rate) or None) the serial ends up at """
+    firmware = query(uart, QUERY_TRIES)
+    if firmware is None:
+        return uart.baudrate, None
+    for baud in BAUDRATES:
+        if uart.baudrate < baud <= min(firmware[2], max_baud) and switch(uart, baud):
+            break
+    return uart.baudrate, firmware
+
+__all__ = [
+    'negotiate',
+    'restore',
+]
@@ -0,0 +1,69 @@
+# coding: utf-8
+"""
+datagram channel of pointer input, see datagram of _protocol
+
+Moves of datagrams accepted while a write of the target is pending are merged into it: the
+writer takes the newest position and the sum of the relative moves when it runs, so a slow
+serial device writes fewer, later moves instead of a backlog of stale ones.
+"""
+import os, struct, threading
+from ._protocol import *
+
+HEADER = struct.Struct('!3s16sIB') # magic, token, seq, flag
+MOVE = struct.Struct('!bb')
+MOVE_ABS = struct.Struct('!HH')
+DATAGRAM_MAX = 64 # bytes read of one datagram
+
+def parse_datagram(data):
+    """ (token, seq, flag, args) of a datagram, None when it is malformed """
+    if len(data) < HEADER.size or data[:3] != MAGIC:
+        return None
+    _, token, seq, flag = HEADER.unpack_from(data)
+    content = data[HEADER.size:]
+    if flag == MOUSE_MOVE and len(content) == MOVE.size:
+        return token, seq, flag, MOVE.unpack(content)
+    if flag == MOUSE_MOVE_ABS and len(content) == MOVE_ABS.size:
+        return token, seq, flag, MOVE_ABS.unpack(content)
+    if flag in (MOUSE_WHEEL_UP, MOUSE_WHEEL_DOWN) and not content:
+        return token, seq, flag, ()
+    return None
+
+class Datagram:
+    """ datagram channel of a session, accepted by the main thread and taken by the target writer """
+    def __init__(self, token=None, seq=None):
+        self.token = token if token else os.urandom(16)
+        self.seq = seq # last accepted sequence, None before the first datagram
+        self.move = (0, 0) # relative moves not written yet
+        self.position = None # position to move to not written yet
+        self.queued = False # a write of the pending moves is queued to the target writer
+        self.__lock = threading.Lock()
+
+    def accept(self, seq):
+        """ False when seq is not newer than the last accepted one, by serial number arithmetic """
+        if self.seq is not None and not 0 < (seq-self.seq) & 0xFFFFFFFF < 1 << 31:
+            return False
+        self.seq = seq
+        return True
+
+    def add(self, flag, x, y):
+        """ merge a move into the pending ones, True when a write has to be queued """
+        with self.__lock:
+            if flag == MOUSE_MOVE_ABS:
+                self.move, self.position = (0, 0), (x, y) # the moves before are superseded
+            else:
+                self.move = (self.move[0]+x, self.move[1]+y)
+            queue, self.queued = not self.queued, True
+        return queue
+
+    def take(self):
+        """ (position or None, (x, y) relative moves after it) pending, cleared """
+        with self.__lock:
+            pending = self.position, self.move
+            self.position, self.move, self.queued = None, (0, 0), False
+        return pending
+
+__all__ = [
+    'DATAGRAM_MAX',
+    'parse_datagram',
+    'Datagram',
+]
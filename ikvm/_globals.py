@@ -15,7 +15,9 @@ def address_family(ip):
     return 'ipv4'
 
 LOG_LEVEL = ('FATAL', 'ERROR', 'WARN', 'INFO', 'DEBUG', 'TRACE')
-LOG_BUFSIZE = 1
+LOG_BUFSIZE = 1 # mjpg-streamer log file buffering
+LOG_QUEUE_MAX = 10000 # pending log records before new records are dropped
+LOG_FLUSH_INTERVAL = 0.05 # second(s) between log writer batches
 SELECT_TIMEOUT  = 1 # second(s)
 WAIT_START_MJPG = 0.1 # second(s) wait mjpg-streamer killing
 WAIT_STOP_MJPG  = 2.2 # second(s) wait mjpg-streamer killing
@@ -24,16 +26,68 @@ MAX_SHOW        = 20 # replay max batch send keys showed in detail
 BUF = 1024
 TIMEOUT_RT = 10  # used in socket send (real-time)
 ASK_ALIVE_TIMEOUT = 2 # second(s) wait ask alive response
-SOCK_TIMEOUT = 60 # second(s) socket timeout
+HEARTBEAT_INTERVAL = 5 # second(s) between ask alive of every session, measuring its RTT
+HEARTBEAT_MISSES = 3 # unanswered heartbeats in a row before a session is closed as dead
+SESSION_MAX = 64 # concurrent client sessions, further connections are rejected
+SESSION_MAX_QUEUE = 1 << 20 # outbound bytes queued for a session before it is dropped as too slow
+TARGET_MAX = 255 # targets managed by one server
+TARGET_MAX_JOBS = 256 # serial writes queued for a target before further ones are refused
+
+UART_RECONNECT_POLL = 0.1 # second(s) between looking for a lost serial device
+UART_RECONNECT_TIMEOUT = 60 # second(s) a lost serial device is looked for before it is given up
+UART_REPLAY_MAX = 16 # release writes kept for a lost serial device, replayed once it is back
+
+HANDOVER_TIMEOUT = 5 # second(s) wait each step of handing the state over to a successor server
+
+CLIENT_TIMEOUT = 10 # second(s) client waits a connection or response
+CLIENT_CONCURRENCY = 64 # servers a client pool talks to at once
+CLIENT_BUF = 1 << 16 # client socket read size
+CLIENT_NOTIFICATIONS = 256 # server notifications kept by a client
+
+MACRO_MAX = 256 # stored macros
+MACRO_SPIN = 0.002 # second(s) macro scheduler spins before a deadline instead of sleeping
+
+PASTE_RATE = 250 # characters per second typed by a streaming paste, below what serial and HID drain
+PASTE_SLICE = 8 # characters written at once, their frames fit the board serial input buffer
+PASTE_MAX_PENDING = 1 << 16 # characters of a streaming paste queued before it is cancelled
+PASTE_CHUNK = 1024 # characters per chunk sent by the client
+PASTE_WINDOW = 4 # unreplied chunks the client keeps in flight
+
+RECORD_BUFSIZE      = 1 << 20 # bytes buffered before a segment write
+RECORD_INDEX_BATCH  = 64 # index records flushed at once
+RECORD_SEGMENT_SIZE = 256 << 20 # bytes per segment before rotation
+RECORD_SEGMENT_TIME = 600 # second(s) per segment before rotation
+RECORD_RETENTION    = 144 # segments kept on disk, 0 keeps all
+RECORD_RETRY        = 1 # second(s) wait reconnecting mjpg-streamer stream
+
+METRICS_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5) # second(s) histogram upper bounds
+
+PROFILE_SECONDS  = 10 # second(s) profiled when triggered by signal
+PROFILE_INTERVAL = 0.005 # second(s) between stack samples
+TRACE_MAX_EVENTS = 1 << 18 # trace spans kept before later ones are ignored
+
+JOURNAL_GROW = 1 << 16 # records the input journal file grows at once
+
+LATENCY_SAMPLES     = 20 # default stimuli per latency measurement
+LATENCY_BASELINE    = 5 # frames sampled before each stimulus as noise band
+LATENCY_NOISE_SIGMA = 4 # frame size deviation regarded as a change, in standard deviations
+LATENCY_MIN_CHANGE  = 0.002 # minimal relative frame size deviation regarded as a change
+LATENCY_TIMEOUT     = 2 # second(s) wait a stimulus appearing in frames
+LATENCY_WRITE_TIMEOUT = 10 # second(s) wait a stimulus queued behind other writes of the target
 
 class UserDefinedQuit:
     pass
 Quit = UserDefinedQuit() # Used when peer disconnect unexpected
 
+class Incomplete(Exception):
+    """ a request handler needs bytes not received yet, it runs again from the message start on more """
+
 __all__ = [
         'address_family',
         'LOG_LEVEL',
         'LOG_BUFSIZE',
+        'LOG_QUEUE_MAX',
+        'LOG_FLUSH_INTERVAL',
         'SELECT_TIMEOUT',
         'WAIT_START_MJPG',
         'WAIT_STOP_MJPG',
@@ -41,6 +95,44 @@ __all__ = [
         'BUF',
         'TIMEOUT_RT',
         'ASK_ALIVE_TIMEOUT',
-        'SOCK_TIMEOUT',
+        'HEARTBEAT_INTERVAL',
+        'HEARTBEAT_MISSES',
+        'SESSION_MAX',
+        'SESSION_MAX_QUEUE',
+        'TARGET_MAX',
+        'TARGET_MAX_JOBS',
+        'UART_RECONNECT_POLL',
+        'UART_RECONNECT_TIMEOUT',
+        'UART_REPLAY_MAX',
+        'HANDOVER_TIMEOUT',
+        'CLIENT_TIMEOUT',
+        'CLIENT_CONCURRENCY',
+        'CLIENT_BUF',
+        'CLIENT_NOTIFICATIONS',
+        'MACRO_MAX',
+        'MACRO_SPIN',
+        'PASTE_RATE',
+        'PASTE_SLICE',
+        'PASTE_MAX_PENDING',
+        'PASTE_CHUNK',
+        'PASTE_WINDOW',
+        'RECORD_BUFSIZE',
+        'RECORD_INDEX_BATCH',
+        'RECORD_SEGMENT_SIZE',
+        'RECORD_SEGMENT_TIME',
+        'RECORD_RETENTION',
+        'RECORD_RETRY',
+        'METRICS_BUCKETS',
+        'PROFILE_SECONDS',
+        'PROFILE_INTERVAL',
+        'TRACE_MAX_EVENTS',
+        'JOURNAL_GROW',
+        'LATENCY_SAMPLES',
+        'LATENCY_BASELINE',
+        'LATENCY_NOISE_SIGMA',
+        'LATENCY_MIN_CHANGE',
+        'LATENCY_TIMEOUT',
+        'LATENCY_WRITE_TIMEOUT',
         'Quit',
+        'Incomplete',
 ]
@@ -0,0 +1,119 @@
+# coding: utf-8
+"""
+zero-downtime restart: sockets inherited from systemd and state handed over between processes
+
+LISTEN_FDS  systemd socket activation passes the listening sockets from fd 3, the server
+            takes the first one instead of binding its own.
+
+handover    a running server listens on a Unix socket. A new server started with the same
+            path connects to it and the running one sends its state, i.e. the sessions,
+            leases, serial devices and mjpg-streamers of the targets, as JSON with the
+            listening, client and serial fds attached (SCM_RIGHTS), then exits without
+            closing anything. Clients stay connected and the video never restarts.
+
+message     [4B fds]+[4B JSON length] carrying the first fds, [1B] carrying each further
+            SCM_MAX_FD fds, then the JSON, fd fields of which are indexes in the fds. The
+            successor acknowledges with one byte once it holds everything.
+"""
+import os, json, socket, struct, asyncio
+from ._globals import *
+
+SD_LISTEN_FDS_START = 3
+SCM_MAX_FD = 253 # fds one message carries on Linux
+HEADER = struct.Struct('!II') # fds, JSON length
+ACK = b'\1'
+
+def listen_fds():
+    """ listening sockets passed by systemd socket activation, the variables are cleared """
+    fds = int(os.environ.get('LISTEN_FDS', 0)) if os.environ.get('LISTEN_PID') == str(os.getpid()) else 0
+    for name in ('LISTEN_PID', 'LISTEN_FDS', 'LISTEN_FDNAMES'):
+        os.environ.pop(name, None)
+    return [socket.socket(fileno=fd) for fd in range(SD_LISTEN_FDS_START, SD_LISTEN_FDS_START+fds)]
+
+def sd_notify(state):
+    """ notify systemd of a service Type=notify, ignored when not run by it """
+    path = os.environ.get('NOTIFY_SOCKET')
+    if not path:
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        try:
+            sock.connect('\0'+path[1:] if path[0] == '@' else path)
+            sock.sendall(state.encode('utf-8'))
+        except OSError:
+            pass
+
+def handover_listen(path):
+    """ Unix socket a successor connects to, a stale socket file is replaced """
+    if os.path.exists(path):
+        os.unlink(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    os.chmod(path, 0o600) # the state gives full control of the clients and devices
+    sock.listen(1)
+    sock.setblocking(False)
+    return sock
+
+def handover_send(sock, state, fds):
+    """ send the state and fds, True once the successor acknowledged them """
+    data = json.dumps(state, separators=(',', ':')).encode('utf-8')
+    chunks = [fds[i:i+SCM_MAX_FD] for i in range(0, len(fds), SCM_MAX_FD)] or [[]]
+    sock.settimeout(HANDOVER_TIMEOUT)
+    socket.send_fds(sock, [HEADER.pack(len(fds), len(data))], chunks[0])
+    for chunk in chunks[1:]:
+        socket.send_fds(sock, [b'\0'], chunk)
+    sock.sendall(data)
+    return sock.recv(1) == ACK
+
+def handover_recv(path, received=None):
+    """ (state, fds) from the server listening on the path, None when no server is there,
+        received() is called before the server is acknowledged and exits """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(HANDOVER_TIMEOUT)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    with sock:
+        header, fds = _recv_exactly(sock, HEADER.size)
+        count, size = HEADER.unpack(header)
+        while len(fds) < count:
+            fds += _recv_exactly(sock, 1)[1]
+        state = json.loads(_recv_exactly(sock, size)[0])
+        if received:
+            received()
+        sock.sendall(ACK)
+    return state, fds
+
+def _recv_exactly(sock, n): # reads stop at a message carrying fds, so its fds are not lost
+    data, fds = b'', []
+    while len(data) < n:
+        chunk, more, _, _ = socket.recv_fds(sock, n-len(data), SCM_MAX_FD)
+        if not chunk:
+            raise ConnectionError('Handover ended early')
+        data, fds = data+chunk, fds+more
+    return data, fds
+
+class Adopted:
+    """ a process started by the previous server, tracked by PID as it is not a child """
+    def __init__(self, pid):
+        self.pid = pid
+        self.returncode = None
+
+    async def wait(self):
+        while True:
+            try:
+                os.kill(self.pid, 0)
+            except ProcessLookupError:
+                self.returncode = 0
+                return self.returncode
+            await asyncio.sleep(0.1)
+
+__all__ = [
+    'listen_fds',
+    'sd_notify',
+    'handover_listen',
+    'handover_send',
+    'handover_recv',
+    'Adopted',
+]
@@ -0,0 +1,156 @@
+# coding: utf-8
+"""
+input event journal:  [64B header]+[16B record]*count, memory-mapped and append only
+header  [8B magic]+[2B record size]+[6B reserved]+   - magic 'IKVMJNL' followed version 01
+        [8B count]+                                  - number of valid records
+        [8B wall clock]+[8B monotonic ns]            - time when the journal was created
+record  [8B monotonic ns]+[1B type]+[1B flag]+       - type and flag are the request message type and flag (see _protocol)
+        [1B target]+[1B reserved]+[2B a]+[2B b]       - a, b: key/char/button/x-move, y-move or atx signal in flag
+  type  flag               a       b
+   21   00/01              key     -       key release/press
+   21   02                 -       -       release all keys
+   21   80                 char    -       one record per character of a text
+   22   00/01              button  -       mouse button release/press
+   22   02/10/11           -       -       release all buttons, wheel down/up
+   22   80                 x-move  y-move  mouse move
+   22   81                 x       y       mouse absolute move, in absolute pointer units
+   23   sig                -       -       atx signal
+"""
+import os, mmap, struct, threading
+from time import time, monotonic_ns, sleep
+from ._globals import *
+from ._protocol import *
+from ._uart import *
+
+JOURNAL_MAGIC = b'IKVMJNL\x01'
+HEADER = struct.Struct('<8sH6xQdQ')
+HEADER_SIZE = 64
+COUNT_AT = 16 # count offset in header
+COUNT = struct.Struct('<Q')
+RECORD = struct.Struct('<QBBBxhh')
+
+class Journal:
+    def __init__(self, path, grow=JOURNAL_GROW):
+        self.path = path
+        self.grow = grow*RECORD.size
+        self.__lock = threading.Lock() # appended by serial writers of several targets
+        self.__fd = os.open(path, os.O_RDWR|os.O_CREAT, 0o640)
+        size = os.fstat(self.__fd).st_size
+        if size < HEADER_SIZE:
+            size = HEADER_SIZE+self.grow
+            os.ftruncate(self.__fd, size)
+            self.__map = mmap.mmap(self.__fd, size)
+            HEADER.pack_into(self.__map, 0, JOURNAL_MAGIC, RECORD.size, 0, time(), monotonic_ns())
+            self.count = 0
+        else:
+            self.__map = mmap.mmap(self.__fd, size)
+            magic, record_size, self.count, _, _ = HEADER.unpack_from(self.__map)
+            if magic != JOURNAL_MAGIC or record_size != RECORD.size:
+                self.close()
+                raise ValueError(f'"{path}" is not an input journal')
+        self.__end = HEADER_SIZE+self.count*RECORD.size
+        self.__size = size
+
+    def __grow(self):
+        self.__map.close()
+        self.__size += self.grow
+        os.ftruncate(self.__fd, self.__size)
+        self.__map = mmap.mmap(self.__fd, self.__size)
+
+    def append(self, type, flag, a=0, b=0, target=0):
+        with self.__lock:
+            if self.__end+RECORD.size > self.__size:
+                self.__grow()
+            RECORD.pack_into(self.__map, self.__end, monotonic_ns(), type, flag, target, a, b)
+            self.__end += RECORD.size
+            self.count += 1
+            COUNT.pack_into(self.__map, COUNT_AT, self.count) # record is complete before it is counted
+
+    def append_text(self, chars, target=0):
+        with self.__lock:
+            stamp = monotonic_ns()
+            if self.__end+len(chars)*RECORD.size > self.__size:
+                self.grow = max(self.grow, len(chars)*RECORD.size)
+                self.__grow()
+            for char in chars:
+                RECORD.pack_into(self.__map, self.__end, stamp, TYPE_SEND_KEY_REQ, KEY_TEXT_SEND, target, char, 0)
+                self.__end += RECORD.size
+            self.count += len(chars)
+            COUNT.pack_into(self.__map, COUNT_AT, self.count)
+
+    def append_keys(self, events, target=0):
+        """ key press/release records of a text typed through a keyboard layout """
+        with self.__lock:
+            stamp = monotonic_ns()
+            if self.__end+len(events)*RECORD.size > self.__size:
+                self.grow = max(self.grow, len(events)*RECORD.size)
+                self.__grow()
+            for flag, key in events:
+                RECORD.pack_into(self.__map, self.__end, stamp, TYPE_SEND_KEY_REQ, flag, target, key, 0)
+                self.__end += RECORD.size
+            self.count += len(events)
+            COUNT.pack_into(self.__map, COUNT_AT, self.count)
+
+    def close(self):
+        if self.__map:
+            self.__map.close()
+            self.__map = None
+        os.close(self.__fd)
+
+def read_journal(path):
+    """ yield records (monotonic ns, type, flag, target, a, b) """
+    with open(path, 'rb') as fh:
+        header = fh.read(HEADER_SIZE)
+        magic, record_size, count, _, _ = HEADER.unpack_from(header)
+        if magic != JOURNAL_MAGIC or record_size != RECORD.size:
+            raise ValueError(f'"{path}" is not an input journal')
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for i in range(count):
+                yield RECORD.unpack_from(data, HEADER_SIZE+i*RECORD.size)
+
+def uart_frame(record):
+    """ serial bytes of a journal record """
+    _, type, flag, _, a, b = record
+    if type == TYPE_SEND_KEY_REQ:
+        if flag == KEY_TEXT_SEND:
+            return UART_SEND_CHAR(a)
+        return UART_SEND_KEY_CLEAR if flag == KEY_CLEAR else UART_SEND_KEY(flag, a)
+    if type == TYPE_SEND_MOUSE_REQ:
+        if flag == MOUSE_MOVE:
+            return UART_SEND_MOUSE_MOVE(a, b)
+        if flag == MOUSE_MOVE_ABS:
+            return UART_SEND_MOUSE_ABS(a, b)
+        if flag in (MOUSE_WHEEL_UP, MOUSE_WHEEL_DOWN):
+            return UART_SEND_MOUSE_WHEEL(flag&0x0F)
+        return UART_SEND_MOUSE_CLEAR if flag == MOUSE_CLEAR else UART_SEND_MOUSE_CLICK(flag, a)
+    if type == TYPE_SEND_ATX_REQ:
+        return UART_SEND_ATX(flag)
+    return b''
+
+def replay(records, write, speed=1.0, target=None):
+    """ write serial bytes of records at original timing divided by speed, speed 0 as fast as possible,
+        only the records of the target id when it is given """
+    start, base, stamp, batch = None, 0, None, b''
+    for record in records:
+        if target is not None and record[3] != target:
+            continue
+        if record[0] != stamp and batch:
+            write(batch)
+            batch = b''
+        if record[0] != stamp and speed:
+            if start is None:
+                start, base = monotonic_ns(), record[0]
+            delay = (record[0]-base)/speed - (monotonic_ns()-start)
+            if delay > 0:
+                sleep(delay/1e9)
+        stamp = record[0]
+        batch += uart_frame(record)
+    if batch:
+        write(batch)
+
+__all__ = [
+    'Journal',
+    'read_journal',
+    'uart_frame',
+    'replay',
+]
@@ -0,0 +1,92 @@
+# coding: utf-8
+"""
+glass-to-glass latency measurement
+
+  capture-to-delivery  frame received time - frame capture time (X-Timestamp of mjpg-streamer)
+  input-to-photon      capture time of the first changed frame - time the stimulus left the serial port
+
+A frame is regarded as changed when its JPEG size leaves the noise band of the
+frames captured just before the stimulus, hence the stimulus must make a visible
+difference on the controlled host screen, e.g. a far cursor jump or a caps lock
+on-screen indicator.
+"""
+from statistics import mean, pstdev
+from time import time
+from ._globals import *
+from ._uart import *
+
+STIMULUS_MOUSE = 0x00
+STIMULUS_CAPS  = 0x01
+
+KEY_CAPS_LOCK = 0xC1 # Arduino Keyboard.h code
+MOUSE_JUMP = 127 # mouse move each axis for mouse stimulus
+
+STIMULUS = {
+    STIMULUS_MOUSE: (UART_SEND_MOUSE_MOVE(MOUSE_JUMP, MOUSE_JUMP), UART_SEND_MOUSE_MOVE(-MOUSE_JUMP, -MOUSE_JUMP)),
+    STIMULUS_CAPS: (UART_SEND_KEY(1, KEY_CAPS_LOCK)+UART_SEND_KEY(0, KEY_CAPS_LOCK),)*2,
+}
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values)-1, int(round(p/100*(len(values)-1))))]
+
+def summary(values):
+    ms = [v*1000 for v in values]
+    return 'p50 %.1f p90 %.1f p99 %.1f max %.1f' %(
+        percentile(ms, 50), percentile(ms, 90), percentile(ms, 99), max(ms) if ms else 0.0)
+
+class LatencyProbe:
+    """ frames yields (received time, capture time, jpeg) as mjpeg_frames does,
+        inject writes the given serial bytes to the controlled host and may return
+        the time they left the serial port, else the midpoint of the call is taken """
+    def __init__(self, frames, inject, stimulus=STIMULUS_MOUSE, samples=LATENCY_SAMPLES):
+        self.frames = iter(frames)
+        self.inject = inject
+        self.stimulus = STIMULUS[stimulus]
+        self.samples = samples
+        self.delivery = [] # capture-to-delivery of every frame seen
+        self.photon = [] # input-to-photon of every detected stimulus
+        self.missed = 0
+
+    def __next_frame(self):
+        recv, stamp, frame = next(self.frames)
+        self.delivery.append(recv-stamp)
+        return recv, stamp, len(frame)
+
+    def __baseline(self):
+        sizes = [self.__next_frame()[2] for _ in range(LATENCY_BASELINE)]
+        band = max(LATENCY_NOISE_SIGMA*pstdev(sizes), LATENCY_MIN_CHANGE*mean(sizes))
+        return mean(sizes), band
+
+    def run(self):
+        for i in range(self.samples):
+            size, band = self.__baseline()
+            sent = time()
+            written = self.inject(self.stimulus[i%2])
+            sent = written if written else (sent+time())/2 # midpoint of the serial write
+            while True:
+                recv, stamp, length = self.__next_frame()
+                if stamp < sent: # captured before the stimulus
+                    continue
+                if abs(length-size) > band:
+                    self.photon.append(stamp-sent)
+                    break
+                if stamp-sent > LATENCY_TIMEOUT:
+                    self.missed += 1
+                    break
+        if self.samples%2: # restore the controlled host
+            self.inject(self.stimulus[1])
+        return self
+
+    def report(self):
+        return 'input-to-photon ms %s; capture-to-delivery ms %s; %d/%d detected' %(
+            summary(self.photon), summary(self.delivery), len(self.photon), self.samples)
+
+__all__ = [
+    'STIMULUS_MOUSE',
+    'STIMULUS_CAPS',
+    'STIMULUS',
+    'LatencyProbe',
+]
@@ -0,0 +1,100 @@
+# coding: utf-8
+"""
+keyboard layouts of the controlled host: unicode text to key strokes typed by raw HID usages
+
+A character is one or more strokes (level, usage), level 0: no modifier, 1: <Shift>,
+2: <AltGr>. Accented characters missing from a layout are composed with its dead keys.
+The table of a layout is built once, strokes are written as Arduino key codes, i.e. the
+HID usage + 136, so the firmware types them regardless of its own US-ASCII map.
+"""
+import unicodedata
+from functools import lru_cache
+from ._uart import *
+
+KEY_SHIFT = 0x81 # Arduino KEY_LEFT_SHIFT
+KEY_ALTGR = 0x86 # Arduino KEY_RIGHT_ALT
+RAW_KEY = 136 # Arduino key code of HID usage 0
+MODIFIERS = ((), (KEY_SHIFT,), (KEY_ALTGR,))
+
+# HID usages of the table columns: letters a-z, digits 1-0, punctuation 2D-38 and the ISO key 64
+USAGES = tuple(range(0x04, 0x1E))+tuple(range(0x1E, 0x28))+tuple(range(0x2D, 0x39))+(0x64,)
+ENTER, TAB, SPACE = 0x28, 0x2B, 0x2C
+SPACING = {'´': '\u0301', '`': '\u0300', '^': '\u0302', '¨': '\u0308', '~': '\u0303'} # dead key alone
+
+# characters of every level in USAGES order, \0 for none (dead keys are listed in dead)
+LAYOUTS = {
+    'us': {
+        'levels': (
+            'abcdefghijklmnopqrstuvwxyz' '1234567890' "-=[]\\\0;'`,./" '\0',
+            'ABCDEFGHIJKLMNOPQRSTUVWXYZ' '!@#$%^&*()' '_+{}|\0:"~<>?' '\0'),
+        'dead': {},
+    },
+    'uk': {
+        'levels': (
+            'abcdefghijklmnopqrstuvwxyz' '1234567890' "-=[]\0#;'`,./" '\\',
+            'ABCDEFGHIJKLMNOPQRSTUVWXYZ' '!"£$%^&*()' '_+{}\0~:@¬<>?' '|',
+            '\0'*29 + '€' + '\0'*19),
+        'dead': {},
+    },
+    'de': {
+        'levels': (
+            'abcdefghijklmnopqrstuvwxzy' '1234567890' 'ß\0ü+\0#öä\0,.-' '<',
+            'ABCDEFGHIJKLMNOPQRSTUVWXZY' '!"§$%&/()=' '?\0Ü*\0\'ÖÄ°;:_' '>',
+            '\0\0\0\0€\0\0\0\0\0\0\0µ\0\0\0@\0\0\0\0\0\0\0\0\0' '\0²³\0\0\0{[]}' '\\\0\0~\0\0\0\0\0\0\0\0' '|'),
+        'dead': {'\u0301': (0, 0x2E), '\u0300': (1, 0x2E), '\u0302': (0, 0x35)},
+    },
+    'fr': {
+        'levels': (
+            'qbcdefghijkl,noparstuvzxyw' '&é"\'(-è_çà' ')=\0$\0*mù²;:!' '<',
+            'QBCDEFGHIJKL?NOPARSTUVZXYW' '1234567890' '°+\0£\0µM%\0./§' '>',
+            '\0\0\0\0€\0\0\0\0\0\0\0\0\0\0\0\0\0\0\0\0\0\0\0\0\0' '\0\0#{[|\0\\^@' ']}\0¤\0\0\0\0\0\0\0\0' '\0'),
+        'dead': {'\u0302': (0, 0x2F), '\u0308': (1, 0x2F), '\u0303': (2, 0x1F), '\u0300': (2, 0x24)},
+    },
+}
+
+@lru_cache(maxsize=None)
+def keymap(layout):
+    """ {character: strokes} of the layout, KeyError if the layout is unknown """
+    table, dead = LAYOUTS[layout]['levels'], LAYOUTS[layout]['dead']
+    strokes = {'\n': ((0, ENTER),), '\t': ((0, TAB),), ' ': ((0, SPACE),)}
+    for level, chars in enumerate(table):
+        for usage, char in zip(USAGES, chars):
+            if char != '\0':
+                strokes.setdefault(char, ((level, usage),))
+    for char, mark in SPACING.items():
+        if mark in dead:
+            strokes.setdefault(char, (dead[mark], (0, SPACE)))
+    for base, stroke in list(strokes.items()):
+        if len(stroke) > 1 or not base.isalpha():
+            continue
+        for mark, key in dead.items():
+            char = unicodedata.normalize('NFC', base+mark)
+            if len(char) == 1:
+                strokes.setdefault(char, (key,)+stroke)
+    return strokes
+
+def compile_text(layout, text):
+    """ (serial frames, key events [(flag, key),]) typing the text, modifiers are held across
+        characters of the same level, ValueError listing characters missing from the layout """
+    strokes = keymap(layout)
+    text = unicodedata.normalize('NFC', text)
+    missing = sorted({char for char in text if char not in strokes})
+    if missing:
+        raise ValueError(''.join(missing))
+    events, level = [], 0
+    for char in text:
+        for next_level, usage in strokes[char]:
+            if next_level != level:
+                events += [(0, key) for key in MODIFIERS[level]]+[(1, key) for key in MODIFIERS[next_level]]
+                level = next_level
+            events += [(1, usage+RAW_KEY), (0, usage+RAW_KEY)]
+    events += [(0, key) for key in MODIFIERS[level]]
+    return b''.join([_frame(*event) for event in events]), events
+
+_frame = lru_cache(maxsize=None)(UART_SEND_KEY)
+
+__all__ = [
+    'LAYOUTS',
+    'keymap',
+    'compile_text',
+]
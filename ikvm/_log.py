@@ -0,0 +1,84 @@
+# coding: utf-8
+import threading
+from collections import deque
+from datetime import datetime
+from sys import stdout, stderr
+from time import time
+from ._globals import *
+
+class lazy:
+    """ log argument evaluated only when the record is formatted, e.g. lazy(base64, msg) """
+    __slots__ = ('func', 'args')
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def __str__(self):
+        return str(self.func(*self.args))
+
+class Logger:
+    """ records are appended to a deque (atomic without any lock) and formatted,
+        batched and written by a background writer thread, only a drop takes a lock """
+    def __init__(self, fh=stdout, level=3, queue_max=LOG_QUEUE_MAX, interval=LOG_FLUSH_INTERVAL):
+        self.fh = fh
+        self.level = level
+        self.queue_max = queue_max
+        self.interval = interval
+        self.dropped = 0 # records dropped since the queue was full
+        self.__dropped_lock = threading.Lock() # drops are counted by every writing thread
+        self.__queue = deque()
+        self.__reported = 0
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def write(self, level, txt, args=()):
+        if self.level < level:
+            return
+        if len(self.__queue) >= self.queue_max:
+            with self.__dropped_lock:
+                self.dropped += 1
+            return
+        self.__queue.append((time(), level, txt, args))
+
+    def close(self):
+        self.__stop.set()
+        self.__thread.join()
+        if self.fh is not stdout:
+            self.fh.close()
+
+    def __format(self, stamp, level, txt, args):
+        if args:
+            try:
+                txt = txt % args
+            except (TypeError, ValueError) as e:
+                txt = f'{txt!r} % {args!r} ({e})'
+        return '{} [{}]: {}\n'.format(datetime.fromtimestamp(stamp).isoformat(), LOG_LEVEL[level], txt)
+
+    def __drain(self):
+        out, err = [], []
+        queue = self.__queue
+        while queue:
+            record = queue.popleft()
+            line = self.__format(*record)
+            (err if self.fh is stdout and record[1] < 2 else out).append(line)
+        dropped = self.dropped
+        if dropped != self.__reported:
+            out.append(self.__format(time(), 2, 'Log queue full, dropped %d records in total', (dropped,)))
+            self.__reported = dropped
+        if err:
+            stderr.write(''.join(err))
+            stderr.flush()
+        if out:
+            self.fh.write(''.join(out))
+            self.fh.flush()
+
+    def __run(self):
+        while not self.__stop.wait(self.interval):
+            self.__drain()
+        self.__drain()
+
+__all__ = [
+    'lazy',
+    'Logger',
+]
@@ -0,0 +1,124 @@
+# coding: utf-8
+"""
+stored macros: steps uploaded once are compiled to serial frame buffers with a timing schedule
+
+steps  [1B type]+[content] ...          - type 21/22/23 followed by its content as the request message
+       [1B type=00]+[2B ms]             - delay before the next step
+"""
+import struct, threading
+from heapq import heappush, heappop
+from itertools import count
+from time import perf_counter
+from ._globals import *
+from ._protocol import *
+from ._uart import *
+from ._journal import uart_frame
+
+class Macro:
+    def __init__(self, name, schedule):
+        self.name = name
+        self.schedule = schedule # [(offset second(s), frame bytes, journal records (type, flag, a, b)),]
+        self.duration = schedule[-1][0] if schedule else 0
+
+class Playback:
+    """ a macro playing on a target """
+    def __init__(self, macro, session):
+        self.macro = macro
+        self.session = session # replied when the playback ends
+        self.cancelled = False
+        self.start = None
+
+def compile_macro(name, steps):
+    """ Macro of the steps, ValueError with the reason when a step is invalid """
+    schedule, frame, records, offset, i = [], b'', [], 0, 0
+    try:
+        while i < len(steps):
+            type = steps[i]
+            if type == MACRO_DELAY:
+                ms, = struct.unpack_from('!H', steps, i+1)
+                i += 3
+                if frame:
+                    schedule.append((offset, frame, records))
+                    frame, records = b'', []
+                offset += ms/1000
+                continue
+            flag, a, b, i = steps[i+1], 0, 0, i+2
+            if type == TYPE_SEND_KEY_REQ and flag in (KEY_PRESS, KEY_RELEASE):
+                a, i = steps[i], i+1
+            elif type == TYPE_SEND_KEY_REQ and flag == KEY_TEXT_SEND:
+                size, = struct.unpack_from('!H', steps, i)
+                chars, i = steps[i+2:i+2+size], i+2+size
+                if len(chars) < size:
+                    raise IndexError
+                frame += b''.join([UART_SEND_CHAR(char) for char in chars])
+                records += [(type, flag, char, 0) for char in chars]
+                continue
+            elif type == TYPE_SEND_KEY_REQ and flag != KEY_CLEAR:
+                raise ValueError('Protocol Error: Received flag <{:02X}> is invalid'.format(flag))
+            elif type == TYPE_SEND_MOUSE_REQ and flag in (MOUSE_PRESS, MOUSE_RELEASE):
+                a, i = steps[i], i+1
+                if a not in (MOUSE_LEFT, MOUSE_RIGHT, MOUSE_MIDDLE):
+                    raise ValueError('Invalid mouse button <{:02X}>'.format(a))
+            elif type == TYPE_SEND_MOUSE_REQ and flag == MOUSE_MOVE:
+                a, b = struct.unpack_from('!bb', steps, i)
+                i += 2
+            elif type == TYPE_SEND_MOUSE_REQ and flag not in (MOUSE_CLEAR, MOUSE_WHEEL_UP, MOUSE_WHEEL_DOWN):
+                raise ValueError('Protocol Error: Received flag <{:02X}> is invalid'.format(flag))
+            elif type == TYPE_SEND_ATX_REQ and flag not in ATX_SIGNAL.values():
+                raise ValueError('Protocol Error: Received invalid signal <{:02X}>'.format(flag))
+            elif type not in (TYPE_SEND_KEY_REQ, TYPE_SEND_MOUSE_REQ, TYPE_SEND_ATX_REQ):
+                raise ValueError('Protocol Error: Received step type <{:02X}> is invalid'.format(type))
+            frame += uart_frame((0, type, flag, 0, a, b))
+            records.append((type, flag, a, b))
+    except (IndexError, struct.error):
+        raise ValueError('Protocol Error: Macro step truncated')
+    if frame:
+        schedule.append((offset, frame, records))
+    return Macro(name, schedule)
+
+class Scheduler:
+    """ runs func(*args) at perf_counter() deadlines in one thread, it sleeps until
+        MACRO_SPIN before a deadline then spins, keeping the error well below a millisecond """
+    def __init__(self, log=None):
+        self.__log = log if log else (lambda level, txt, *args: None)
+        self.__heap = []
+        self.__seq = count() # keeps deadlines of the same time in order
+        self.__cond = threading.Condition()
+        self.__thread = None
+        self.__stop = False
+
+    def at(self, due, func, *args):
+        with self.__cond:
+            heappush(self.__heap, (due, next(self.__seq), func, args))
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run, daemon=True)
+                self.__thread.start()
+            self.__cond.notify()
+
+    def stop(self):
+        with self.__cond:
+            self.__stop = True
+            self.__cond.notify()
+
+    def __run(self):
+        heap = self.__heap
+        while True:
+            with self.__cond:
+                while not self.__stop and (not heap or heap[0][0]-perf_counter() > MACRO_SPIN):
+                    self.__cond.wait(heap[0][0]-perf_counter()-MACRO_SPIN if heap else None)
+                if self.__stop:
+                    return
+                due, _, func, args = heappop(heap)
+            while perf_counter() < due:
+                pass
+            try:
+                func(*args)
+            except Exception as e:
+                self.__log(1, 'Scheduled job failed: %r', e)
+
+__all__ = [
+    'Macro',
+    'Playback',
+    'compile_macro',
+    'Scheduler',
+]
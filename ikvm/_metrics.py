@@ -0,0 +1,171 @@
+# coding: utf-8
+"""
+in-process metrics, rendered as JSON (stats request) or Prometheus text format
+
+Metrics take no lock: they are updated by plain attribute arithmetic under the
+GIL, a concurrent update from another thread may rarely be lost which is an
+accepted trade-off for keeping the request path lock free.
+"""
+import json, socket, threading
+from bisect import bisect_left
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from ._globals import *
+
+class Counter:
+    kind = 'counter'
+    def __init__(self, name, help, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values = {} if label else None
+        self.value = 0
+
+    def inc(self, label=None, n=1):
+        if self.label:
+            self.values[label] = self.values.get(label, 0)+n
+        else:
+            self.value += n
+
+    def snapshot(self):
+        return dict(self.values) if self.label else self.value
+
+    def samples(self):
+        if not self.label:
+            return [(self.name, '', self.value)]
+        return [(self.name, '{%s="%s"}' %(self.label, key), value) for key, value in list(self.values.items())]
+
+class Gauge(Counter):
+    kind = 'gauge'
+    def set(self, value):
+        self.value = value
+
+class Histogram:
+    kind = 'histogram'
+    def __init__(self, name, help, buckets=METRICS_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.counts = [0]*(len(self.buckets)+1) # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def __cumulative(self):
+        total, cumulative = 0, []
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+    def snapshot(self):
+        cumulative = self.__cumulative()
+        return {
+            'count': self.count, 'sum': round(self.sum, 6),
+            'buckets': {str(le): n for le, n in zip(self.buckets, cumulative)}}
+
+    def samples(self):
+        cumulative = self.__cumulative()
+        les = [str(le) for le in self.buckets]+['+Inf']
+        return [(self.name+'_bucket', '{le="%s"}' %le, n) for le, n in zip(les, cumulative)]+[
+                (self.name+'_sum', '', self.sum), (self.name+'_count', '', self.count)]
+
+class Metrics:
+    def __init__(self):
+        self.__metrics = []
+
+    def __add(self, metric):
+        self.__metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, label=None):
+        return self.__add(Counter(name, help, label))
+
+    def gauge(self, name, help, label=None):
+        return self.__add(Gauge(name, help, label))
+
+    def histogram(self, name, help, buckets=METRICS_BUCKETS):
+        return self.__add(Histogram(name, help, buckets))
+
+    def snapshot(self):
+        return {metric.name: metric.snapshot() for metric in self.__metrics}
+
+    def json(self):
+        return json.dumps(self.snapshot(), separators=(',', ':'))
+
+    def prometheus(self):
+        lines = []
+        for metric in self.__metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(f'{name}{labels} {value}' for name, labels, value in metric.samples())
+        return '\n'.join(lines)+'\n'
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.metrics.prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class _Server(ThreadingHTTPServer):
+    address_family = socket.AF_INET6
+    daemon_threads = True
+
+    def server_bind(self):
+        self.socket.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0) # enable ipv4/ipv6 dual-stack
+        super().server_bind()
+
+def serve_prometheus(metrics, bind, port):
+    """ serve metrics in Prometheus text format at http://{bind}:{port}/metrics in a subthread """
+    server = _Server((bind, port), _Handler)
+    server.metrics = metrics
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def server_metrics():
+    m = Metrics()
+    m.requests = m.counter('ikvm_requests_total', 'Requests received per message type', 'type')
+    m.request_seconds = m.histogram('ikvm_request_handle_seconds', 'Time parsing and handling a request')
+    m.uart_write_seconds = m.histogram('ikvm_uart_write_seconds', 'Time writing a command to the serial device')
+    m.uart_errors = m.counter('ikvm_uart_write_errors_total', 'Failed serial writes per reason', 'reason')
+    m.uart_lost = m.counter('ikvm_uart_lost_total', 'Serial devices lost on a write error')
+    m.uart_recovery_seconds = m.histogram('ikvm_uart_recovery_seconds', 'Time from losing a serial device to reopening it',
+            (0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60))
+    m.send_queue = m.gauge('ikvm_send_queue_bytes', 'Bytes waiting in the last written outbound queue')
+    m.send_queue_peak = m.gauge('ikvm_send_queue_peak_bytes', 'Largest outbound queue of any session seen')
+    m.connections = m.counter('ikvm_connections_total', 'Client connections per outcome', 'outcome')
+    m.sessions = m.gauge('ikvm_sessions', 'Connected client sessions')
+    m.handshake_seconds = m.histogram('ikvm_handshake_seconds', 'Time from accepting a connection to its handshake')
+    m.loop_seconds = m.histogram('ikvm_loop_busy_seconds', 'Time the main loop spends on ready sockets between two selects')
+    m.websocket_upgrades = m.counter('ikvm_websocket_upgrades_total', 'WebSocket upgrade requests per outcome', 'outcome')
+    m.datagrams = m.counter('ikvm_datagrams_total', 'Pointer datagrams received per outcome', 'outcome')
+    m.lease_changes = m.counter('ikvm_lease_changes_total', 'Input lease holder changes')
+    m.client_rtt_seconds = m.histogram('ikvm_client_rtt_seconds', 'Round trip time of ask alive to a client')
+    m.heartbeat_misses = m.counter('ikvm_heartbeat_misses_total', 'Heartbeats a client did not answer in time')
+    m.input_dropped = m.counter('ikvm_input_dropped_total', 'Redundant presses and releases not written per kind', 'kind')
+    m.input_released = m.counter('ikvm_input_auto_releases_total', 'Release all written as the lease holder changed')
+    m.mjpg_starts = m.counter('ikvm_mjpg_starts_total', 'mjpg-streamer starts per kind', 'kind')
+    m.enumerate_uart_seconds = m.histogram('ikvm_enumerate_uart_seconds', 'Time listing serial devices')
+    m.enumerate_cap_seconds = m.histogram('ikvm_enumerate_cap_seconds', 'Time listing video captures')
+    return m
+
+__all__ = [
+    'Counter',
+    'Gauge',
+    'Histogram',
+    'Metrics',
+    'server_metrics',
+    'serve_prometheus',
+]
@@ -0,0 +1,59 @@
+# coding: utf-8
+"""
+mjpg-streamer output_http stream:  GET /?action=stream
+    --boundarydonotcross
+    Content-Type: image/jpeg
+    Content-Length: {len}
+    X-Timestamp: {sec}.{usec}                capture time of the frame
+                                             (blank line)
+    [{len}B jpeg]
+"""
+import socket
+from time import time
+
+MJPG_HOST = 'localhost'
+MJPG_STREAM_REQ = b'GET /?action=stream HTTP/1.0\r\n\r\n'
+MJPG_READ_BUFSIZE = 1 << 16
+
+def mjpeg_connect(port, host=MJPG_HOST, timeout=None):
+    sock = socket.create_connection((host, port), timeout=timeout)
+    sock.sendall(MJPG_STREAM_REQ)
+    return sock
+
+def mjpeg_frames(sock):
+    """ yield (received time, capture time, jpeg bytes) until the stream ends """
+    fp = sock.makefile('rb', MJPG_READ_BUFSIZE)
+    try:
+        # skip HTTP response head
+        while fp.readline() not in (b'\r\n', b'\n', b''):
+            pass
+        length, stamp = None, None
+        while True:
+            line = fp.readline()
+            if line == b'':
+                return
+            line = line.strip()
+            if line:
+                name, _, value = line.partition(b':')
+                name = name.strip().lower()
+                if name == b'content-length':
+                    length = int(value)
+                elif name == b'x-timestamp':
+                    stamp = float(value)
+                continue
+            if length is None: # blank line between boundaries
+                continue
+            frame = fp.read(length)
+            if len(frame) < length:
+                return
+            recv = time()
+            yield recv, stamp if stamp else recv, frame
+            length, stamp = None, None
+    finally:
+        fp.close()
+
+__all__ = [
+    'MJPG_HOST',
+    'mjpeg_connect',
+    'mjpeg_frames',
+]
@@ -0,0 +1,61 @@
+# coding: utf-8
+import threading
+from collections import deque
+from time import perf_counter
+from ._globals import *
+
+class Paste:
+    """ streaming text paste on a target: chunks are queued as they are received
+        and taken in slices of PASTE_SLICE characters, paced at PASTE_RATE """
+    def __init__(self, session):
+        self.session = session # the only session may send chunks, replied per chunk
+        self.start = perf_counter()
+        self.due = self.start # time the next slice may be written
+        self.written = 0
+        self.pending = 0 # characters queued
+        self.unreplied = 0 # chunks received but not replied
+        self.pumping = False # a slice is scheduled
+        self.cancelled = False
+        self.lock = threading.Lock()
+        self.__chunks = deque() # [chars, offset, last chunk]
+
+    def add(self, chars, last):
+        """ queue a chunk, False if too many characters are pending """
+        with self.lock:
+            if self.pending+len(chars) > PASTE_MAX_PENDING:
+                return False
+            self.__chunks.append([chars, 0, last])
+            self.pending += len(chars)
+            self.unreplied += 1
+            return True
+
+    def pump(self):
+        """ True if the caller should schedule taking slices as nobody does """
+        with self.lock:
+            pumping, self.pumping = self.pumping, True
+            return not pumping
+
+    def take(self):
+        """ (chars, chunk ended, paste ended) of the next slice, None and stop pumping when nothing is queued """
+        with self.lock:
+            if not self.__chunks or self.cancelled:
+                self.pumping = False
+                return None
+            chunk = self.__chunks[0]
+            chars, offset, last = chunk
+            piece = chars[offset:offset+PASTE_SLICE]
+            chunk[1] += len(piece)
+            self.pending -= len(piece)
+            if chunk[1] < len(chars):
+                return piece, False, False
+            self.__chunks.popleft()
+            return piece, True, last
+
+    def clear(self):
+        with self.lock:
+            self.__chunks.clear()
+            self.pending = 0
+
+__all__ = [
+    'Paste',
+]
@@ -0,0 +1,49 @@
+# coding: utf-8
+from math import ceil
+from ._protocol import *
+from ._uart import *
+
+MOVE_MAX = 127 # largest relative move of one frame
+
+class Pointer:
+    """ cursor position on the target screen, known once calibrated with the screen size
+
+        moves are planned as journal records (flag, a, b) of MOUSE_MOVE deltas, or a single
+        MOUSE_MOVE_ABS in absolute pointer units when the firmware has the absolute pointer.
+        Relative moves are dead reckoned, host pointer acceleration makes the position drift
+        until the next calibration homes the cursor again """
+    def __init__(self, absolute=False):
+        self.absolute = absolute
+        self.screen = None # (width, height)
+        self.position = None # (x, y), None when unknown
+
+    def calibrate(self, width, height):
+        self.screen, self.position = (width, height), None
+        return self.move_to(0, 0)
+
+    def move_to(self, x, y):
+        width, height = self.screen
+        x, y = min(max(x, 0), width-1), min(max(y, 0), height-1)
+        if self.absolute:
+            self.position = x, y
+            return [(MOUSE_MOVE_ABS, x*MOUSE_ABS_MAX//max(width-1, 1), y*MOUSE_ABS_MAX//max(height-1, 1))]
+        records = []
+        if self.position is None:
+            ## home to the top-left corner, one more frame than the screen needs absorbs rounding
+            records = [(MOUSE_MOVE, -MOVE_MAX, -MOVE_MAX)]*(ceil(max(width, height)/MOVE_MAX)+1)
+            self.position = 0, 0
+        dx, dy = x-self.position[0], y-self.position[1]
+        steps = max(ceil(abs(dx)/MOVE_MAX), ceil(abs(dy)/MOVE_MAX))
+        for i in range(steps): # fewest frames, deltas spread evenly
+            records.append((MOUSE_MOVE, dx*(i+1)//steps-dx*i//steps, dy*(i+1)//steps-dy*i//steps))
+        self.position = x, y
+        return records
+
+    def shift(self, dx, dy):
+        if self.position and self.screen:
+            self.position = (min(max(self.position[0]+dx, 0), self.screen[0]-1),
+                             min(max(self.position[1]+dy, 0), self.screen[1]-1))
+
+__all__ = [
+    'Pointer',
+]
@@ -0,0 +1,85 @@
+# coding: utf-8
+"""
+on-demand instrumentation
+  Profiler  sampling profiler of all threads, dumps collapsed stacks (flamegraph.pl input)
+            one line per distinct stack: "thread;outer (file:line);...;inner (file:line) {count}"
+  Tracer    trace spans written in Chrome trace event format (chrome://tracing, Perfetto)
+            spans of one request share the same "req" argument
+"""
+import os, sys, json, threading
+from collections import Counter
+from time import time, perf_counter, sleep
+from ._globals import *
+
+class Profiler:
+    def __init__(self, folder, interval=PROFILE_INTERVAL, log=None):
+        self.folder = folder
+        self.interval = interval
+        self.__log = log if log else (lambda level, txt, *args: None)
+        self.__thread = None
+
+    @property
+    def running(self):
+        return self.__thread is not None and self.__thread.is_alive()
+
+    def start(self, seconds):
+        if self.running:
+            return False
+        self.__thread = threading.Thread(target=self.__run, args=(seconds,), daemon=True)
+        self.__thread.start()
+        return True
+
+    def __run(self, seconds):
+        self.__log(3, 'Sampling profiler started for %d second(s)', seconds)
+        stacks, me = Counter(), threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        end = perf_counter()+seconds
+        while perf_counter() < end:
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                stacks[';'.join(reversed(stack))] += 1
+            sleep(self.interval)
+        path = os.path.join(self.folder, 'ikvm-profile-%d.folded' %int(time()))
+        with open(path, 'w') as fh:
+            fh.writelines(f'{stack} {count}\n' for stack, count in stacks.most_common())
+        self.__log(3, 'Sampling profiler wrote %d samples to %s', sum(stacks.values()), path)
+
+class Tracer:
+    """ spans are kept in memory (bounded by TRACE_MAX_EVENTS) and written when tracing stops """
+    def __init__(self, path, log=None):
+        self.path = path
+        self.__log = log if log else (lambda level, txt, *args: None)
+        self.__events = []
+        self.__epoch = perf_counter()
+        self.__pid = os.getpid()
+        self.__req = 0
+
+    def request(self):
+        """ id correlating all spans of one request """
+        self.__req += 1
+        return self.__req
+
+    def add(self, name, req, start, end):
+        if len(self.__events) >= TRACE_MAX_EVENTS:
+            return
+        self.__events.append({
+            'name': name, 'ph': 'X', 'pid': self.__pid, 'tid': threading.get_ident(),
+            'ts': round((start-self.__epoch)*1e6, 1), 'dur': round((end-start)*1e6, 1),
+            'args': {'req': req}})
+
+    def close(self):
+        with open(self.path, 'w') as fh:
+            json.dump({'traceEvents': self.__events, 'displayTimeUnit': 'ms'}, fh)
+        self.__log(3, 'Wrote %d trace spans to %s', len(self.__events), self.path)
+
+__all__ = [
+    'Profiler',
+    'Tracer',
+]
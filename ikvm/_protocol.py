@@ -7,6 +7,19 @@ type  content                              comment
                                             e.g. [('/dev/ttyUSB0', 0x0483, 0xdf11),]
  01   n/a                                  list all available uvc with resolution and frame rate
                                             e.g. [('/dev/video0', [((1920, 1080), [30, 15,]), ((1280, 960), [30, 15,]),]),]
+ 02   n/a                                  query server runtime statistics
+ 03                                        input lease request of the selected target, only its holder may send 1X/2X/3X
+      1. [1B flag=00]                       - release the lease
+      2. [1B flag=01]                       - acquire the lease, granted if free or the holder fails ask alive
+      3. [1B flag=02]                       - query the lease holder
+      4. [1B flag=03]+[2B session]          - hand the lease off to another session
+ 04   n/a                                  list all managed targets
+ 05   [1B target]                          select the target which later message type 03/1X/2X/3X are routed to
+ 06                                        broadcast an input command to targets, written by their serial writers in parallel
+      [1B num]+[{num}B target]+             - target ids, num=0 for all targets, the lease of each target must be free or held
+      [1B type]+[content]                   - message type 21/22/23 followed by its content as above
+ 07   n/a                                  query keys and mouse buttons held pressed on the selected target
+ 08   n/a                                  open the datagram channel of the session, see datagram below
  10                                        start/restart mjpg-streamer
       [1B {len}]+[{len}B cap]+              - video capture name (e.g. /dev/video0)
       [2B width]+[2B hight]+                - resolution (e.g. 07 80 04 38 meaning 1920x1080)
@@ -17,17 +30,43 @@ type  content                              comment
          [{len}B char]
       2. [1B flag=00/01]+[1B key]           - press/release a keyboard key, flag=01 press key, flag=00 release key
       3. [1B flag=02]                       - release all pressed keys
+      4. [1B flag=81]+[1B more]+            - streaming paste chunk, more=01 further chunks follow, 00 the last one
+         [2B {len}]+[{len}B char]             each chunk is replied when it was typed, keep the unreplied chunks small
+      5. [1B flag=82]                       - cancel the streaming paste, release all pressed keys
+      6. [1B flag=83]+[1B {len}]+           - type a unicode text through a keyboard layout of the controlled host
+         [{len}B layout]+[2B {size}]+         layout us/uk/de/fr, empty for us, text is utf-8 encoded
+         [{size}B text]
+      7. [1B flag=84]+[1B modifiers]+       - whole keyboard state, modifiers bit i is key 128+i (Arduino), keys are
+         [6B keys]                            HID usages (00 for none), written only when it changed
  22                                        send mouse command
       1. [1B flag=80]+[1B x-move]+          - move the mouse cursor
          [1B y-move]
       2. [1B flag=00/01]+[1B button]        - press/release a mouse button, flag=01 press button, flag=00 release key
       3. [1B flag=10/11]                    - mouse scroll wheel, flag=10 scroll down, floag=11 scroll up
       4. [1B flag=02]                       - release all mouse pressed buttons
+      5. [1B flag=81]+[2B x]+[2B y]         - move the mouse cursor to a position on the target screen, in pixels
+                                              from the top-left corner, the screen should be calibrated first
+      6. [1B flag=82]+[2B width]+           - calibrate: set the target screen size and home the cursor to the
+         [2B height]                          top-left corner, again whenever host pointer acceleration drifted it
+      7. [1B flag=83]+[1B buttons]+         - whole mouse state, held buttons with a move and a scroll, written
+         [1B x-move]+[1B y-move]+[1B wheel]   only when buttons changed or it moves, moves and wheel are signed char
 
  23   [1B sig]                             send atx command
                                             - 1. FD: Short Power
                                             - 2. FE: Reset
                                             - 3. FF: Long Power
+ 24                                        stored macro command, steps are compiled once and played back by the server
+      1. [1B flag=00]+[1B {len}]+[{len}B name]+ - define (or replace) a macro
+         [2B {size}]+[{size}B steps]          steps: [1B type 21/22/23]+[content as above] or [1B type=00]+[2B ms delay]
+      2. [1B flag=01]+[1B {len}]+[{len}B name]  - play a macro on the selected target, replied when it finished
+      3. [1B flag=02]+[1B {len}]+[{len}B name]  - delete a macro
+      4. [1B flag=03]                          - list macro names
+      5. [1B flag=04]                          - cancel the macro playing on the selected target, release keys and buttons
+ 30   [1B stimulus]+[1B samples]           measure glass-to-glass latency, requires opened uart and running mjpg-streamer
+                                            - stimulus 00: mouse cursor jump, 01: caps lock toggle
+                                            - samples 0 for default
+ 31   [1B action]+[2B seconds]             run instrumentation for seconds, output written in server profile folder
+                                            - action 00: sampling profiler (collapsed stacks), 01: request trace spans
  80                                        response of message type 00
       [1B num]+                             - number of available uart devices
       [1B {len}]+[{len}B dev]+              - uart device name
@@ -39,13 +78,42 @@ type  content                              comment
       [2B width]+[2B hight]+                - no.y resolution (e.g. 07 80 04 38 meaning 1920x1080)
       [1B fpsnum]                           - number of available frame rates in no.y resolution
       [1B fps]+...                          - no.z frame rate
-9X/AX [1B code] [1B {len}]+[{len}B detail] response of message type 1X/2X
+ 83   [1B code] [1B {len}]+[{len}B detail] response of message type 03
+ 84                                        response of message type 04
+      [1B num]+                             - number of targets
+      [1B target]+[1B state]+               - target id, state bit 0: serial device opened, bit 1: mjpg-streamer running
+      [1B {len}]+[{len}B name]+...          - target name
+ 85   [1B code] [1B {len}]+[{len}B detail] response of message type 05
+ 86                                        response of message type 06, sent when every target finished
+      [1B num]+                             - number of targets
+      [1B target]+[1B code]+                - target id and status code
+      [1B {len}]+[{len}B detail]+...        - detail of the target
+ 87   [1B buttons]+[32B keys]              response of message type 07, held by the lease holder, zero when free
+                                            - buttons: mouse button bits, keys: bit k%8 of byte k//8 is Arduino key k
+ 88   [2B port]+[16B token]                response of message type 08, UDP port and token of the session
+                                            - port 0 when the server has no datagram channel
+9X-BX [1B code] [1B {len}]+[{len}B detail] response of message type 1X/2X/3X
                                             - 0x00 success; 0x01 failure
                                             - length allowed be 0
+ E0   [1B event] [1B {len}]+[{len}B detail] server pushed notification to every handshaked session
+                                            - 00: this session, sent after handshake, e.g. "session 3 [::1]:50312"
+                                            - 01: lease holder changed, detail is the holder or empty when free
+                                            - 02: serial device changed
+                                            - 03: mjpg-streamer changed
  FF   n/a                                  handshake message
  EE   n/a                                  goodbye message
  F0   n/a                                  ask alive message, check if peer is alive
  F1   n/a                                  reply alive message
+
+datagram: magic    token    seq         flag content         pointer input sent to the UDP port, newest wins
+          FF 31 D5 16B ...  -- -- -- -- --   -- ...
+flag  content
+ 80   [1B x-move]+[1B y-move]              move the mouse cursor, signed char
+ 81   [2B x]+[2B y]                        move the mouse cursor to a position, the screen should be calibrated
+ 10/11 n/a                                 mouse scroll wheel down/up
+      token is the one of response 88, valid while its session is connected and holds the input lease.
+      seq increases by one per datagram, a datagram not newer than the last one accepted is dropped.
+      Keys, buttons and ATX stay on the connection where no input is lost.
 """
 import struct
 
@@ -55,25 +123,50 @@ TYPE_HANDSHAKE      = 0xFF
 TYPE_GOODBYE        = 0xEE
 TYPE_ASK_ALIVE      = 0xF0
 TYPE_REPLY_ALIVE    = 0xF1
+TYPE_NOTIFY         = 0xE0
 TYPE_LIST_UART_REQ  = 0x00
 TYPE_LIST_CAP_REQ   = 0x01
+TYPE_STATS_REQ      = 0x02
+TYPE_LEASE_REQ      = 0x03
+TYPE_LIST_TARGET_REQ   = 0x04
+TYPE_SELECT_TARGET_REQ = 0x05
+TYPE_BROADCAST_REQ     = 0x06
+TYPE_INPUT_STATE_REQ   = 0x07
+TYPE_DATAGRAM_REQ      = 0x08
 TYPE_RUN_MJPG_REQ   = 0x10
 TYPE_OPEN_UART_REQ  = 0x20
 TYPE_SEND_KEY_REQ   = 0x21
 TYPE_SEND_MOUSE_REQ = 0x22
 TYPE_SEND_ATX_REQ   = 0x23
+TYPE_MACRO_REQ      = 0x24
+TYPE_LATENCY_REQ    = 0x30
+TYPE_PROFILE_REQ    = 0x31
 TYPE_LIST_UART_RES  = 0x80
 TYPE_LIST_CAP_RES   = 0x81
+TYPE_STATS_RES      = 0x82
+TYPE_LEASE_RES      = 0x83
+TYPE_LIST_TARGET_RES   = 0x84
+TYPE_SELECT_TARGET_RES = 0x85
+TYPE_BROADCAST_RES     = 0x86
+TYPE_INPUT_STATE_RES   = 0x87
+TYPE_DATAGRAM_RES      = 0x88
 TYPE_RUN_MJPG_RES   = 0x90
 TYPE_OPEN_UART_RES  = 0xA0
 TYPE_SEND_KEY_RES   = 0xA1
 TYPE_SEND_MOUSE_RES = 0xA2
 TYPE_SEND_ATX_RES   = 0xA3
+TYPE_MACRO_RES      = 0xA4
+TYPE_LATENCY_RES    = 0xB0
+TYPE_PROFILE_RES    = 0xB1
 
 KEY_RELEASE   = 0x00
 KEY_PRESS     = 0x01
 KEY_CLEAR     = 0x02
 KEY_TEXT_SEND = 0x80
+KEY_TEXT_CHUNK  = 0x81
+KEY_TEXT_CANCEL = 0x82
+KEY_TEXT_LAYOUT = 0x83
+KEY_REPORT      = 0x84
 
 MOUSE_RELEASE    = 0x00
 MOUSE_PRESS      = 0x01
@@ -81,6 +174,33 @@ MOUSE_CLEAR      = 0x02
 MOUSE_WHEEL_UP   = 0x10
 MOUSE_WHEEL_DOWN = 0x11
 MOUSE_MOVE       = 0x80
+MOUSE_MOVE_ABS   = 0x81
+MOUSE_CALIBRATE  = 0x82
+MOUSE_REPORT     = 0x83
+
+LEASE_RELEASE = 0x00
+LEASE_ACQUIRE = 0x01
+LEASE_QUERY   = 0x02
+LEASE_HANDOFF = 0x03
+LEASE_TYPES   = (0x1, 0x2, 0x3) # high nibble of message types requiring the lease
+
+MACRO_DEFINE = 0x00
+MACRO_RUN    = 0x01
+MACRO_DELETE = 0x02
+MACRO_LIST   = 0x03
+MACRO_CANCEL = 0x04
+MACRO_DELAY  = 0x00 # step type of a delay
+
+TARGET_UART = 0x01
+TARGET_MJPG = 0x02
+
+NOTIFY_SESSION = 0x00
+NOTIFY_LEASE   = 0x01
+NOTIFY_UART    = 0x02
+NOTIFY_MJPG    = 0x03
+
+PROFILE_SAMPLE = 0x00
+PROFILE_TRACE  = 0x01
 
 STATUS_SUCCESS = 0x00
 STATUS_FAILURE = 0x01
@@ -88,49 +208,121 @@ STATUS_FAILURE = 0x01
 ATX_SIGNAL  = {'short power': 0xFD, 'reset': 0xFE, 'long power': 0xFF}
 STATUS_CODE = {STATUS_SUCCESS: 'success', STATUS_FAILURE: 'failure'}
 
-HANDSHAKE_MSG    = struct.pack('!3sB', MAGIC, TYPE_HANDSHAKE)
-GOODBYE_MSG      = struct.pack('!3sB', MAGIC, TYPE_GOODBYE)
-ASK_ALIVE_MSG    = struct.pack('!3sB', MAGIC, TYPE_ASK_ALIVE)
-REPLY_ALIVE_MSG  = struct.pack('!3sB', MAGIC, TYPE_REPLY_ALIVE)
-LIST_UART_REQ    = struct.pack('!3sB', MAGIC, TYPE_LIST_UART_REQ)
-LIST_CAP_REQ     = struct.pack('!3sB', MAGIC, TYPE_LIST_CAP_REQ)
+## encoders are precompiled once, messages are packed without building a format per call.
+## Texts are counted in utf-8 bytes, details are cut at 255 bytes.
+_HEAD      = struct.Struct('!3sB')      # magic, type
+_BYTE      = struct.Struct('!3sBB')     # magic, type, flag or count
+_BYTE2     = struct.Struct('!3sBBB')    # magic, type, flag, value
+_SHORT     = struct.Struct('!3sBBH')    # magic, type, flag, 2B value
+_MOVE      = struct.Struct('!3sBBbb')
+_POSITION  = struct.Struct('!3sBBHH')
+_CHUNK     = struct.Struct('!3sBBBH')
+_KEY_REPORT   = struct.Struct('!3sBBB6s')
+_MOUSE_REPORT = struct.Struct('!3sBBBbbb')
+_MJPG      = struct.Struct('!HHBH')     # width, height, fps, port after the capture name
+_MACRO     = struct.Struct('!3sBBB')    # magic, type, flag, name length
+_STATUS    = struct.Struct('!3sBBB')    # magic, type, code, detail length
+_INPUT_STATE = struct.Struct('!3sBB32s')
+_STATS     = struct.Struct('!3sBH')
+_DATAGRAM  = struct.Struct('!3sBH16s')
+_DATAGRAM_MOVE     = struct.Struct('!3s16sIBbb')
+_DATAGRAM_POSITION = struct.Struct('!3s16sIBHH')
+_DATAGRAM_WHEEL    = struct.Struct('!3s16sIB')
+_VIDPID    = struct.Struct('!HH')
+_RES       = struct.Struct('!HHB')      # width, height, frame rates
+_U16       = struct.Struct('!H')
+
+def _text(text, limit=None): # utf-8 bytes of a text, cut at limit bytes without splitting a character
+    data = text.encode('utf-8')
+    return data[:limit].decode('utf-8', 'ignore').encode('utf-8') if limit and len(data) > limit else data
+
+def _named(head, items): # response [head]+[1B num]+([1B a]+[1B b]+[1B len]+[name])...
+    parts = [_BYTE.pack(MAGIC, head, len(items))]
+    for a, b, name in items:
+        name = _text(name)
+        parts += (bytes((a, b, len(name))), name)
+    return b''.join(parts)
+
+def _list_uart_res(devs):
+    parts = [_BYTE.pack(MAGIC, TYPE_LIST_UART_RES, len(devs))]
+    for name, vid, pid in devs:
+        name = _text(name)
+        parts += (bytes((len(name),)), name, _VIDPID.pack(vid, pid))
+    return b''.join(parts)
+
+def _list_cap_res(devs):
+    parts = [_BYTE.pack(MAGIC, TYPE_LIST_CAP_RES, len(devs))]
+    for name, attrs in devs:
+        name = _text(name)
+        parts += (bytes((len(name),)), name, bytes((len(attrs),)))
+        for (width, height), fps in attrs:
+            parts += (_RES.pack(width, height, len(fps)), bytes(fps))
+    return b''.join(parts)
+
+def _status(type, code, detail):
+    detail = _text(detail, 255)
+    return _STATUS.pack(MAGIC, type, code, len(detail)) + detail
+
+HANDSHAKE_MSG    = _HEAD.pack(MAGIC, TYPE_HANDSHAKE)
+GOODBYE_MSG      = _HEAD.pack(MAGIC, TYPE_GOODBYE)
+ASK_ALIVE_MSG    = _HEAD.pack(MAGIC, TYPE_ASK_ALIVE)
+REPLY_ALIVE_MSG  = _HEAD.pack(MAGIC, TYPE_REPLY_ALIVE)
+LIST_UART_REQ    = _HEAD.pack(MAGIC, TYPE_LIST_UART_REQ)
+LIST_CAP_REQ     = _HEAD.pack(MAGIC, TYPE_LIST_CAP_REQ)
+STATS_REQ        = _HEAD.pack(MAGIC, TYPE_STATS_REQ)
+LEASE_REQ        = lambda flag: _BYTE.pack(MAGIC, TYPE_LEASE_REQ, flag)
+LEASE_REQ_H      = lambda session: _SHORT.pack(MAGIC, TYPE_LEASE_REQ, LEASE_HANDOFF, session)
+LIST_TARGET_REQ  = _HEAD.pack(MAGIC, TYPE_LIST_TARGET_REQ)
+SELECT_TARGET_REQ = lambda target: _BYTE.pack(MAGIC, TYPE_SELECT_TARGET_REQ, target)
+BROADCAST_REQ    = lambda targets, msg:( # msg is a send key/mouse/atx request, e.g. SEND_ATX_REQ(ATX_SIGNAL['reset'])
+        _BYTE.pack(MAGIC, TYPE_BROADCAST_REQ, len(targets)) + bytes(targets) + msg[len(MAGIC):])
+INPUT_STATE_REQ  = _HEAD.pack(MAGIC, TYPE_INPUT_STATE_REQ)
+DATAGRAM_REQ     = _HEAD.pack(MAGIC, TYPE_DATAGRAM_REQ)
 RUN_MJPG_REQ     = lambda cap, res, fps, port:(
-    struct.pack(
-        '!3sBB%dsHHBH' %len(cap), MAGIC, TYPE_RUN_MJPG_REQ,
-        len(cap), cap.encode('utf-8'),
-        res[0], res[1], fps, port))
-OPEN_UART_REQ    = lambda port:(
-            struct.pack('!3sBB%ds' %len(port), MAGIC, TYPE_OPEN_UART_REQ, len(port), port.encode('utf-8'))
-        )
-SEND_KEY_REQ_K   = lambda act, key: struct.pack('!3sBBB', MAGIC, TYPE_SEND_KEY_REQ, act, key)
-SEND_KEY_REQ_C   = lambda txt:(
-        struct.pack('!3sBBH'+'B'*len(txt), MAGIC, TYPE_SEND_KEY_REQ, KEY_TEXT_SEND, len(txt), *[ord(char) for char in txt]))
-SEND_KEY_REQ_R   = struct.pack('!3sBB', MAGIC, TYPE_SEND_KEY_REQ, KEY_CLEAR)
-SEND_MOUSE_REQ_K = lambda act, btn: struct.pack('!3sBBB', MAGIC, TYPE_SEND_MOUSE_REQ, act, btn)
-SEND_MOUSE_REQ_M = lambda x, y: struct.pack('!3sBBbb', MAGIC, TYPE_SEND_MOUSE_REQ, MOUSE_MOVE, x, y)
-SEND_MOUSE_REQ_S = lambda flag: struct.pack('!3sBB', MAGIC, TYPE_SEND_MOUSE_REQ, flag) # both wheel and release all buttons
-SEND_ATX_REQ     = lambda sig: struct.pack('!3sBB', MAGIC, TYPE_SEND_ATX_REQ, sig)
-LIST_UART_RES    = lambda devs:( # e.g. devs = [('/dev/ttyUSB0', 0x0483, 0xdf11), ('/dev/ttyUSB1', 0x0483, 0xdf11),]
-        struct.pack('!3sBB', MAGIC, TYPE_LIST_UART_RES, len(devs)) +
-        b''.join([
-            struct.pack(
-                '!B%dsHH' %len(dev[0]), len(dev[0]), dev[0].encode('utf-8'),
-                dev[1], dev[2]
-            ) for dev in devs]
-        ))
-LIST_CAP_RES     = lambda devs:( # e.g. devs = [('/dev/video0', [((1920, 1080), [30, 15,]), ((1280, 960), [30, 15,]),]),]
-        struct.pack('!3sBB', MAGIC, TYPE_LIST_CAP_RES, len(devs)) +
-        b''.join([
-            struct.pack('!B%dsB' %len(dev[0]), len(dev[0]), dev[0].encode('utf-8'), len(dev[1])) + 
-            b''.join([
-                struct.pack('!HHB', attr[0][0], attr[0][1], len(attr[1])) +
-                b''.join([struct.pack('!B', fps) for fps in attr[1]]) for attr in dev[1]]
-            ) for dev in devs]
-        ))
-STATUS_CODE_RES  = lambda TYPE, code, detail:(
-        struct.pack(
-            '!3sBBB%ds' %len(detail), MAGIC, TYPE,
-            code, len(detail), detail.encode('utf-8')))
+        (lambda cap: _BYTE.pack(MAGIC, TYPE_RUN_MJPG_REQ, len(cap)) + cap + _MJPG.pack(res[0], res[1], fps, port))(
+        _text(cap)))
+OPEN_UART_REQ    = lambda port: (lambda port: _BYTE.pack(MAGIC, TYPE_OPEN_UART_REQ, len(port)) + port)(_text(port))
+SEND_KEY_REQ_K   = lambda act, key: _BYTE2.pack(MAGIC, TYPE_SEND_KEY_REQ, act, key)
+SEND_KEY_REQ_C   = lambda txt:( # ascii text, one byte per character
+        _SHORT.pack(MAGIC, TYPE_SEND_KEY_REQ, KEY_TEXT_SEND, len(txt)) + bytes(map(ord, txt)))
+SEND_KEY_REQ_R   = _BYTE.pack(MAGIC, TYPE_SEND_KEY_REQ, KEY_CLEAR)
+SEND_KEY_REQ_P   = lambda chunk, more:(
+        _CHUNK.pack(MAGIC, TYPE_SEND_KEY_REQ, KEY_TEXT_CHUNK, more, len(chunk)) + chunk)
+SEND_KEY_REQ_X   = _BYTE.pack(MAGIC, TYPE_SEND_KEY_REQ, KEY_TEXT_CANCEL)
+SEND_KEY_REQ_U   = lambda layout, txt:(
+        (lambda layout, txt: _BYTE2.pack(MAGIC, TYPE_SEND_KEY_REQ, KEY_TEXT_LAYOUT, len(layout)) + layout +
+        _U16.pack(len(txt)) + txt)(_text(layout), _text(txt)))
+SEND_KEY_REQ_REPORT = lambda mods, keys: _KEY_REPORT.pack(MAGIC, TYPE_SEND_KEY_REQ, KEY_REPORT, mods, bytes(keys))
+SEND_MOUSE_REQ_K = lambda act, btn: _BYTE2.pack(MAGIC, TYPE_SEND_MOUSE_REQ, act, btn)
+SEND_MOUSE_REQ_M = lambda x, y: _MOVE.pack(MAGIC, TYPE_SEND_MOUSE_REQ, MOUSE_MOVE, x, y)
+SEND_MOUSE_REQ_A = lambda x, y: _POSITION.pack(MAGIC, TYPE_SEND_MOUSE_REQ, MOUSE_MOVE_ABS, x, y)
+SEND_MOUSE_REQ_CAL = lambda width, height: _POSITION.pack(MAGIC, TYPE_SEND_MOUSE_REQ, MOUSE_CALIBRATE, width, height)
+SEND_MOUSE_REQ_REPORT = lambda btns, x, y, wheel: _MOUSE_REPORT.pack(MAGIC, TYPE_SEND_MOUSE_REQ, MOUSE_REPORT, btns, x, y, wheel)
+SEND_MOUSE_REQ_S = lambda flag: _BYTE.pack(MAGIC, TYPE_SEND_MOUSE_REQ, flag) # both wheel and release all buttons
+SEND_ATX_REQ     = lambda sig: _BYTE.pack(MAGIC, TYPE_SEND_ATX_REQ, sig)
+MACRO_STEP_DELAY = lambda ms: bytes((MACRO_DELAY,)) + _U16.pack(ms)
+MACRO_REQ_D      = lambda name, steps:( # steps are send key/mouse/atx requests or MACRO_STEP_DELAY
+        (lambda name, steps: _MACRO.pack(MAGIC, TYPE_MACRO_REQ, MACRO_DEFINE, len(name)) + name +
+            _U16.pack(len(steps)) + steps)(
+        _text(name), b''.join([step[len(MAGIC):] if step.startswith(MAGIC) else step for step in steps])))
+MACRO_REQ        = lambda flag, name='':( # run, delete, list or cancel
+        _BYTE.pack(MAGIC, TYPE_MACRO_REQ, flag) + (
+        bytes((len(_text(name)),)) + _text(name) if flag in (MACRO_RUN, MACRO_DELETE) else b''))
+LATENCY_REQ      = lambda stimulus, samples: _BYTE2.pack(MAGIC, TYPE_LATENCY_REQ, stimulus, samples)
+PROFILE_REQ      = lambda action, seconds: _SHORT.pack(MAGIC, TYPE_PROFILE_REQ, action, seconds)
+LIST_UART_RES    = _list_uart_res # e.g. devs = [('/dev/ttyUSB0', 0x0483, 0xdf11), ('/dev/ttyUSB1', 0x0483, 0xdf11),]
+LIST_CAP_RES     = _list_cap_res # e.g. devs = [('/dev/video0', [((1920, 1080), [30, 15,]), ((1280, 960), [30, 15,]),]),]
+LIST_TARGET_RES  = lambda targets: _named(TYPE_LIST_TARGET_RES, targets) # e.g. targets = [(0, TARGET_UART, 'rack1'), (1, 0, 'rack2'),]
+BROADCAST_RES    = lambda results: _named(TYPE_BROADCAST_RES, results) # e.g. results = [(0, STATUS_SUCCESS, 'Signal <FE> sent'),]
+INPUT_STATE_RES  = lambda buttons, keys: _INPUT_STATE.pack(MAGIC, TYPE_INPUT_STATE_RES, buttons, keys)
+DATAGRAM_RES     = lambda port, token: _DATAGRAM.pack(MAGIC, TYPE_DATAGRAM_RES, port, token)
+DATAGRAM_MOVE    = lambda token, seq, x, y: _DATAGRAM_MOVE.pack(MAGIC, token, seq, MOUSE_MOVE, x, y)
+DATAGRAM_MOVE_ABS = lambda token, seq, x, y: _DATAGRAM_POSITION.pack(MAGIC, token, seq, MOUSE_MOVE_ABS, x, y)
+DATAGRAM_WHEEL   = lambda token, seq, flag: _DATAGRAM_WHEEL.pack(MAGIC, token, seq, flag)
+STATS_RES        = lambda stats: (lambda stats: _STATS.pack(MAGIC, TYPE_STATS_RES, len(stats)) + stats)(_text(stats))
+
+STATUS_CODE_RES  = _status # detail is cut at 255 bytes
+NOTIFY           = lambda event, detail: STATUS_CODE_RES(TYPE_NOTIFY, event, detail)
 
 __all__ = [
         'MAGIC',
@@ -138,30 +330,77 @@ __all__ = [
         'TYPE_GOODBYE',
         'TYPE_ASK_ALIVE',
         'TYPE_REPLY_ALIVE',
+        'TYPE_NOTIFY',
         'TYPE_LIST_UART_REQ',
         'TYPE_LIST_CAP_REQ',
+        'TYPE_STATS_REQ',
+        'TYPE_LEASE_REQ',
+        'TYPE_LIST_TARGET_REQ',
+        'TYPE_SELECT_TARGET_REQ',
+        'TYPE_BROADCAST_REQ',
+        'TYPE_INPUT_STATE_REQ',
+        'TYPE_DATAGRAM_REQ',
         'TYPE_RUN_MJPG_REQ',
         'TYPE_OPEN_UART_REQ',
         'TYPE_SEND_KEY_REQ',
         'TYPE_SEND_MOUSE_REQ',
         'TYPE_SEND_ATX_REQ',
+        'TYPE_MACRO_REQ',
+        'TYPE_LATENCY_REQ',
+        'TYPE_PROFILE_REQ',
         'TYPE_LIST_UART_RES',
         'TYPE_LIST_CAP_RES',
+        'TYPE_STATS_RES',
+        'TYPE_LEASE_RES',
+        'TYPE_LIST_TARGET_RES',
+        'TYPE_SELECT_TARGET_RES',
+        'TYPE_BROADCAST_RES',
+        'TYPE_INPUT_STATE_RES',
+        'TYPE_DATAGRAM_RES',
         'TYPE_RUN_MJPG_RES',
         'TYPE_OPEN_UART_RES',
         'TYPE_SEND_KEY_RES',
         'TYPE_SEND_MOUSE_RES',
         'TYPE_SEND_ATX_RES',
+        'TYPE_MACRO_RES',
+        'TYPE_LATENCY_RES',
+        'TYPE_PROFILE_RES',
         'KEY_RELEASE',
         'KEY_PRESS',
         'KEY_CLEAR',
         'KEY_TEXT_SEND',
+        'KEY_TEXT_CHUNK',
+        'KEY_TEXT_CANCEL',
+        'KEY_TEXT_LAYOUT',
+        'KEY_REPORT',
         'MOUSE_RELEASE',
         'MOUSE_PRESS',
         'MOUSE_CLEAR',
         'MOUSE_WHEEL_UP',
         'MOUSE_WHEEL_DOWN',
         'MOUSE_MOVE',
+        'MOUSE_MOVE_ABS',
+        'MOUSE_CALIBRATE',
+        'MOUSE_REPORT',
+        'LEASE_RELEASE',
+        'LEASE_ACQUIRE',
+        'LEASE_QUERY',
+        'LEASE_HANDOFF',
+        'LEASE_TYPES',
+        'MACRO_DEFINE',
+        'MACRO_RUN',
+        'MACRO_DELETE',
+        'MACRO_LIST',
+        'MACRO_CANCEL',
+        'MACRO_DELAY',
+        'TARGET_UART',
+        'TARGET_MJPG',
+        'NOTIFY_SESSION',
+        'NOTIFY_LEASE',
+        'NOTIFY_UART',
+        'NOTIFY_MJPG',
+        'PROFILE_SAMPLE',
+        'PROFILE_TRACE',
         'STATUS_SUCCESS',
         'STATUS_FAILURE',
         'ATX_SIGNAL',
@@ -172,16 +411,45 @@ __all__ = [
         'REPLY_ALIVE_MSG',
         'LIST_UART_REQ',
         'LIST_CAP_REQ',
+        'STATS_REQ',
+        'LEASE_REQ',
+        'LEASE_REQ_H',
+        'LIST_TARGET_REQ',
+        'SELECT_TARGET_REQ',
+        'BROADCAST_REQ',
+        'INPUT_STATE_REQ',
+        'DATAGRAM_REQ',
         'RUN_MJPG_REQ',
         'OPEN_UART_REQ',
         'SEND_KEY_REQ_K',
         'SEND_KEY_REQ_C',
         'SEND_KEY_REQ_R',
+        'SEND_KEY_REQ_P',
+        'SEND_KEY_REQ_X',
+        'SEND_KEY_REQ_U',
+        'SEND_KEY_REQ_REPORT',
         'SEND_MOUSE_REQ_K',
         'SEND_MOUSE_REQ_M',
+        'SEND_MOUSE_REQ_A',
+        'SEND_MOUSE_REQ_CAL',
+        'SEND_MOUSE_REQ_REPORT',
         'SEND_MOUSE_REQ_S',
         'SEND_ATX_REQ',
+        'MACRO_STEP_DELAY',
+        'MACRO_REQ_D',
+        'MACRO_REQ',
+        'LATENCY_REQ',
+        'PROFILE_REQ',
         'LIST_UART_RES',
         'LIST_CAP_RES',
+        'LIST_TARGET_RES',
+        'BROADCAST_RES',
+        'INPUT_STATE_RES',
+        'DATAGRAM_RES',
+        'DATAGRAM_MOVE',
+        'DATAGRAM_MOVE_ABS',
+        'DATAGRAM_WHEEL',
+        'STATS_RES',
         'STATUS_CODE_RES',
+        'NOTIFY',
 ]
@@ -0,0 +1,41 @@
+# coding: utf-8
+from collections import deque
+from time import perf_counter
+from ._globals import *
+
+class Reconnect:
+    """ serial device a target lost on a write error, looked for until it is back
+
+        a USB device is matched by VID/PID/serial number as it may come back under another
+        node, others by the node. Releases written meanwhile are kept to be replayed, when
+        more than UART_REPLAY_MAX are kept the replay starts with release all """
+    def __init__(self, port):
+        self.device = port.device
+        self.identity = (port.vid, port.pid, port.serial_number) if port.vid is not None else None
+        self.since = perf_counter()
+        self.replay = deque(maxlen=UART_REPLAY_MAX)
+        self.overflow = False
+        self.opening = False # a reopen is queued to the target writer
+
+    def __str__(self):
+        return self.device
+
+    @property
+    def elapsed(self):
+        return perf_counter()-self.since
+
+    def keep(self, data):
+        self.overflow = self.overflow or len(self.replay) == self.replay.maxlen
+        self.replay.append(data)
+
+    def find(self, ports):
+        """ port of the device among the listed ones, the same node first, None if still gone """
+        if self.identity is None:
+            return next((port for port in ports if port.device == self.device), None)
+        found = [port for port in ports if (port.vid, port.pid, port.serial_number) == self.identity]
+        found.sort(key=lambda port: port.device != self.device)
+        return found[0] if found else None
+
+__all__ = [
+    'Reconnect',
+]
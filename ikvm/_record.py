@@ -0,0 +1,187 @@
+# coding: utf-8
+"""
+session recording:  {folder}/{start}.mjpg + {folder}/{start}.idx
+  {start}   16 digits milliseconds since epoch when the segment was opened
+  .mjpg     concatenated JPEG frames received from the running mjpg-streamer
+  .idx      one fixed size record per frame, appended along with the frame
+            [8B timestamp]+[8B offset]  - capture time (double, seconds since epoch)
+                                          and frame start offset in .mjpg
+"""
+import os, struct, threading, mmap, socket
+from bisect import bisect_right
+from ._globals import *
+from ._mjpeg import *
+
+INDEX = struct.Struct('!dQ')
+SEGMENT_EXT = '.mjpg'
+INDEX_EXT = '.idx'
+
+def segments(folder):
+    """ sorted segment names (without extension) in folder """
+    try:
+        names = os.listdir(folder)
+    except FileNotFoundError:
+        return []
+    return sorted(name[:-len(SEGMENT_EXT)] for name in names if name.endswith(SEGMENT_EXT))
+
+class Index:
+    """ read only sequence of (timestamp, offset) over an index file """
+    def __init__(self, path):
+        with open(path, 'rb') as fh:
+            size = os.fstat(fh.fileno()).st_size
+            size -= size % INDEX.size # ignore the torn record of an unclosed segment
+            self.__map = mmap.mmap(fh.fileno(), size, access=mmap.ACCESS_READ) if size else b''
+        self.__len = size // INDEX.size
+
+    def __len__(self):
+        return self.__len
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.__len
+        if i not in range(self.__len):
+            raise IndexError(i)
+        return INDEX.unpack_from(self.__map, i*INDEX.size)
+
+    def timestamps(self):
+        return _Timestamps(self)
+
+    def close(self):
+        if isinstance(self.__map, mmap.mmap):
+            self.__map.close()
+
+class _Timestamps:
+    def __init__(self, index):
+        self.__index = index
+
+    def __len__(self):
+        return len(self.__index)
+
+    def __getitem__(self, i):
+        return self.__index[i][0]
+
+def seek(folder, timestamp):
+    """ (segment path, offset, frame timestamp) of the last frame captured at or before timestamp """
+    names = segments(folder)
+    # segment names are the open time, so only the candidate segment's index is read
+    pos = bisect_right([int(name) for name in names], int(timestamp*1000))
+    for name in reversed(names[:max(pos, 1)]):
+        index = Index(os.path.join(folder, name+INDEX_EXT))
+        try:
+            i = bisect_right(index.timestamps(), timestamp)
+            if i > 0:
+                stamp, offset = index[i-1]
+                return os.path.join(folder, name+SEGMENT_EXT), offset, stamp
+        finally:
+            index.close()
+    return None
+
+class Recorder:
+    def __init__(self, folder, segment_size=RECORD_SEGMENT_SIZE, segment_time=RECORD_SEGMENT_TIME,
+            retention=RECORD_RETENTION, log=None):
+        self.folder = folder
+        self.segment_size = segment_size
+        self.segment_time = segment_time
+        self.retention = retention
+        self.__log = log if log else (lambda level, txt, *args: None)
+        self.__thread = None
+        self.__stop = None
+        self.__stream = None
+        self.__seg = None
+        self.__idx = None
+        self.__idx_pending = bytearray()
+        self.__seg_start = 0
+        self.__seg_written = 0
+        os.makedirs(folder, exist_ok=True)
+
+    def start(self, port):
+        self.stop()
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, args=(port, self.__stop), daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        if not self.__thread:
+            return
+        self.__stop.set()
+        stream = self.__stream
+        if stream:
+            try:
+                stream.shutdown(socket.SHUT_RDWR) # wake up the blocking stream read
+            except OSError:
+                pass
+        self.__thread.join()
+        self.__thread = None
+
+    def __run(self, port, stop):
+        self.__log(3, 'Session recorder started on mjpg-streamer port %d', port)
+        while not stop.is_set():
+            try:
+                self.__stream = mjpeg_connect(port)
+                for recv, stamp, frame in mjpeg_frames(self.__stream):
+                    if stop.is_set():
+                        break
+                    self.__append(stamp, frame)
+            except OSError as e:
+                if not stop.is_set():
+                    self.__log(4, 'Session recorder stream unavailable as %s', e)
+            finally:
+                if self.__stream:
+                    self.__stream.close()
+                    self.__stream = None
+            stop.wait(RECORD_RETRY)
+        self.__close_segment()
+        self.__log(3, 'Session recorder stopped')
+
+    def __append(self, stamp, frame):
+        if self.__seg and (self.__seg_written >= self.segment_size or stamp-self.__seg_start >= self.segment_time):
+            self.__close_segment()
+        if not self.__seg:
+            self.__open_segment(stamp)
+        self.__seg.write(frame)
+        self.__idx_pending += INDEX.pack(stamp, self.__seg_written)
+        self.__seg_written += len(frame)
+        if len(self.__idx_pending) >= RECORD_INDEX_BATCH*INDEX.size:
+            self.__flush_index()
+
+    def __flush_index(self):
+        # frames are flushed before their index records, readers never see an offset past the data
+        self.__seg.flush()
+        self.__idx.write(self.__idx_pending)
+        self.__idx_pending.clear()
+
+    def __open_segment(self, stamp):
+        name = os.path.join(self.folder, '%016d' %int(stamp*1000))
+        self.__seg = open(name+SEGMENT_EXT, 'ab', RECORD_BUFSIZE)
+        self.__idx = open(name+INDEX_EXT, 'ab', 0)
+        self.__seg_start = stamp
+        self.__seg_written = self.__seg.tell()
+        self.__log(4, 'Session recorder opened segment %s', name+SEGMENT_EXT)
+        self.__apply_retention()
+
+    def __close_segment(self):
+        if not self.__seg:
+            return
+        self.__flush_index()
+        self.__seg.close()
+        self.__idx.close()
+        self.__seg, self.__idx = None, None
+
+    def __apply_retention(self):
+        if self.retention <= 0: # keeps all
+            return
+        for name in segments(self.folder)[:-self.retention]:
+            for ext in (SEGMENT_EXT, INDEX_EXT):
+                try:
+                    os.remove(os.path.join(self.folder, name+ext))
+                except FileNotFoundError:
+                    pass
+            self.__log(4, 'Session recorder removed expired segment %s', name)
+
+__all__ = [
+    'INDEX',
+    'Index',
+    'Recorder',
+    'segments',
+    'seek',
+]
@@ -0,0 +1,138 @@
+# coding: utf-8
+"""
+keyboard and mouse state of a target as boot protocol style HID reports
+
+keyboard report  [1B modifiers]+[6B keys]            modifiers bit i is Arduino key code 128+i, keys are HID usages
+mouse report     [1B buttons]+[1B x]+[1B y]+[1B wheel] x, y and wheel are signed
+
+In report mode every change is written as one report frame carrying the whole state,
+otherwise as the Arduino press/release frames of the change. Unchanged states write nothing.
+"""
+from ._protocol import *
+from ._uart import *
+from ._layout import keymap
+from ._journal import uart_frame
+
+RAW_KEY = 136 # Arduino key code of HID usage 0
+ROLLOVER = 6 # keys of a keyboard report
+
+class HidReport:
+    """ last reports written to a target, used by its serial writer only """
+    def __init__(self, enabled=False):
+        self.enabled = enabled # firmware handles report frames
+        self.modifiers = 0
+        self.held = 0 # modifiers pressed on their own, typed characters add <Shift> on top of them
+        self.keys = () # HID usages in press order
+        self.buttons = 0
+
+    def key(self, act, code, implicit=False):
+        """ frames of an Arduino key code press or release, an implicit modifier is one a typed
+            character needs, its release leaves the modifier down when it is held on its own """
+        modifiers, usage = 0, None
+        if code >= RAW_KEY:
+            usage = code-RAW_KEY
+        elif code >= 0x80:
+            modifiers = 1<<(code-0x80)
+            if not implicit:
+                self.held = self.held|modifiers if act == KEY_PRESS else self.held&~modifiers
+        elif chr(code) in keymap('us'): # ascii as the firmware types it, shifted characters hold <Shift>
+            level, usage = keymap('us')[chr(code)][0]
+            modifiers = 0x02 if level else 0
+        if not self.enabled:
+            self.__keyboard(*self.__change(act, modifiers, usage))
+            return UART_SEND_KEY(act, code)
+        return self.__report(*self.__change(act, modifiers, usage))[0]
+
+    def __change(self, act, modifiers, usage):
+        keys = [key for key in self.keys if key != usage]
+        if act == KEY_PRESS:
+            return self.modifiers|modifiers, keys+[usage] if usage is not None else keys
+        return self.modifiers&~(modifiers&~self.held), keys
+
+    def keyboard(self, modifiers, keys):
+        """ (frames, journal records [(type, flag, a, b),]) changing the keyboard to the report """
+        self.held = modifiers
+        return self.__report(modifiers, keys)
+
+    def __report(self, modifiers, keys):
+        keys = tuple([key for key in keys if key][:ROLLOVER])
+        records = [(TYPE_SEND_KEY_REQ, KEY_PRESS if modifiers>>i&1 else KEY_RELEASE, 0x80+i, 0)
+                for i in range(8) if (modifiers^self.modifiers)>>i&1]
+        records += [(TYPE_SEND_KEY_REQ, KEY_RELEASE, key+RAW_KEY, 0) for key in self.keys if key not in keys]
+        records += [(TYPE_SEND_KEY_REQ, KEY_PRESS, key+RAW_KEY, 0) for key in keys if key not in self.keys]
+        if not records:
+            return b'', records
+        self.__keyboard(modifiers, keys)
+        if self.enabled:
+            return UART_SEND_KEY_REPORT(modifiers, keys), records
+        return b''.join([uart_frame((0, type, flag, 0, a, b)) for type, flag, a, b in records]), records
+
+    def __keyboard(self, modifiers, keys):
+        self.modifiers, self.keys = modifiers, tuple(keys[:ROLLOVER])
+
+    def clear_keys(self):
+        self.held = 0
+        self.__keyboard(0, ())
+        return UART_SEND_KEY_REPORT(0, ()) if self.enabled else UART_SEND_KEY_CLEAR
+
+    def button(self, act, button):
+        buttons = self.buttons|button if act == MOUSE_PRESS else self.buttons&~button
+        if not self.enabled:
+            self.buttons = buttons
+            return UART_SEND_MOUSE_CLICK(act, button)
+        return self.mouse(buttons)[0]
+
+    def move(self, x, y):
+        return UART_SEND_MOUSE_REPORT(self.buttons, x, y, 0) if self.enabled else UART_SEND_MOUSE_MOVE(x, y)
+
+    def wheel(self, flag):
+        if not self.enabled:
+            return UART_SEND_MOUSE_WHEEL(flag&0x0F)
+        return UART_SEND_MOUSE_REPORT(self.buttons, 0, 0, 1 if flag == MOUSE_WHEEL_UP else -1)
+
+    def mouse(self, buttons, x=0, y=0, wheel=0):
+        """ (frames, journal records [(type, flag, a, b),]) of buttons to hold and a move """
+        records = [(TYPE_SEND_MOUSE_REQ, MOUSE_PRESS if buttons&button else MOUSE_RELEASE, button, 0)
+                for button in (MOUSE_LEFT, MOUSE_RIGHT, MOUSE_MIDDLE) if (buttons^self.buttons)&button]
+        if x or y:
+            records.append((TYPE_SEND_MOUSE_REQ, MOUSE_MOVE, x, y))
+        records += [(TYPE_SEND_MOUSE_REQ, MOUSE_WHEEL_UP if wheel > 0 else MOUSE_WHEEL_DOWN, 0, 0)]*abs(wheel)
+        if not records:
+            return b'', records
+        self.buttons = buttons
+        if self.enabled:
+            return UART_SEND_MOUSE_REPORT(buttons, x, y, wheel), records
+        return b''.join([uart_frame((0, type, flag, 0, a, b)) for type, flag, a, b in records]), records
+
+    def clear_buttons(self):
+        self.buttons = 0
+        return UART_SEND_MOUSE_REPORT(0, 0, 0, 0) if self.enabled else UART_SEND_MOUSE_CLEAR
+
+    def text(self, chars):
+        """ frames typing the ascii characters, in report mode each is a press and a release
+            report on top of the held modifiers and keys """
+        if not self.enabled:
+            return b''.join([UART_SEND_CHAR(char) for char in chars])
+        return b''.join([self.key(KEY_PRESS, char)+self.key(KEY_RELEASE, char) for char in chars])
+
+    def command(self, type, flag, a=0, b=0):
+        """ frames of a journal record (type, flag, a, b) as the current mode writes it """
+        if type == TYPE_SEND_KEY_REQ and flag in (KEY_PRESS, KEY_RELEASE):
+            return self.key(flag, a)
+        if type == TYPE_SEND_KEY_REQ and flag == KEY_TEXT_SEND:
+            return self.text(bytes([a]))
+        if type == TYPE_SEND_KEY_REQ and flag == KEY_CLEAR:
+            return self.clear_keys()
+        if type == TYPE_SEND_MOUSE_REQ and flag in (MOUSE_PRESS, MOUSE_RELEASE):
+            return self.button(flag, a)
+        if type == TYPE_SEND_MOUSE_REQ and flag == MOUSE_MOVE:
+            return self.move(a, b)
+        if type == TYPE_SEND_MOUSE_REQ and flag in (MOUSE_WHEEL_UP, MOUSE_WHEEL_DOWN):
+            return self.wheel(flag)
+        if type == TYPE_SEND_MOUSE_REQ and flag == MOUSE_CLEAR:
+            return self.clear_buttons()
+        return uart_frame((0, type, flag, 0, a, b)) # absolute moves and atx signals have no report
+
+__all__ = [
+    'HidReport',
+]
@@ -0,0 +1,32 @@
+# coding: utf-8
+
+class Rtt:
+    """ round trip time of a session measured by ask alive, smoothed as TCP does (RFC 6298)
+
+        srtt is the smoothed RTT and rttvar its mean deviation, i.e. the jitter """
+    ALPHA = 1/8
+    BETA = 1/4
+
+    def __init__(self):
+        self.last = None
+        self.srtt = None
+        self.rttvar = None
+        self.samples = 0
+
+    def update(self, rtt):
+        if self.srtt is None:
+            self.srtt, self.rttvar = rtt, rtt/2
+        else:
+            self.rttvar += self.BETA*(abs(self.srtt-rtt)-self.rttvar)
+            self.srtt += self.ALPHA*(rtt-self.srtt)
+        self.last = rtt
+        self.samples += 1
+
+    def snapshot(self):
+        """ milliseconds, None before the first sample """
+        ms = lambda value: None if value is None else round(value*1000, 3)
+        return {'last': ms(self.last), 'srtt': ms(self.srtt), 'jitter': ms(self.rttvar), 'samples': self.samples}
+
+__all__ = [
+    'Rtt',
+]
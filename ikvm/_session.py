@@ -0,0 +1,50 @@
+# coding: utf-8
+import threading
+from collections import deque
+from itertools import count
+from time import perf_counter
+from ._state import InputState
+from ._rtt import Rtt
+
+_ids = count(1)
+
+class Session:
+    """ state of one client connection, buffers are only touched by the main thread
+        except out which is guarded by out_lock """
+    def __init__(self, sock, ipport, id=None):
+        self.id = next(_ids) & 0xFFFF if id is None else id # id is given to a session handed over
+        self.sock = sock
+        self.ipport = ipport
+        self.buf = b'' # received bytes not handled yet
+        self.accepted = perf_counter() # time the connection was accepted, or taken over
+        self.accept = False # set to True when handshake success
+        self.alive = None # future of the ask alive in flight, resolved with the RTT by the event loop
+        self.alive_sent = 0 # perf_counter() the ask alive in flight was queued
+        self.rtt = Rtt()
+        self.missed = 0 # heartbeats unanswered in a row
+        self.target = None # target requests are routed to
+        self.input = InputState() # pressed on the target while holding its lease
+        self.out = b'' # outbound queue, flushed when the socket is writable
+        self.out_lock = threading.Lock()
+        self.queued = 0 # bytes ever queued to out
+        self.flushed = 0 # bytes ever sent from out
+        self.traced = deque() # (queued at the end of a message, traced request id) while tracing
+        self.ws = None # WebSocket of a session connected by the WebSocket port
+        self.datagram = None # Datagram channel of pointer input, opened by request
+
+    def __str__(self):
+        return f'session {self.id} {self.ipport}'
+
+def next_session_id():
+    return next(_ids)
+
+def resume_session_ids(start):
+    """ continue the ids of the server this one took over from """
+    global _ids
+    _ids = count(start)
+
+__all__ = [
+    'Session',
+    'next_session_id',
+    'resume_session_ids',
+]
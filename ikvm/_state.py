@@ -0,0 +1,70 @@
+# coding: utf-8
+import threading
+from ._protocol import *
+
+class InputState:
+    """ keys and mouse buttons a session holds pressed on the controlled host,
+        bit k of keys is the Arduino key code k, buttons are MOUSE_LEFT/RIGHT/MIDDLE bits
+
+        updated by the main thread when a request is accepted and reverted by the serial
+        writer when its write failed, so the state follows what reached the device. Broadcast
+        and macro input is followed by the serial writer as it writes the commands """
+    def __init__(self):
+        self.keys = 0
+        self.buttons = 0
+        self.__lock = threading.Lock()
+
+    def __bool__(self):
+        return bool(self.keys or self.buttons)
+
+    def key(self, key, press):
+        """ set the key pressed or released, False if it already was """
+        with self.__lock:
+            keys = self.keys|(1<<key) if press else self.keys&~(1<<key)
+            changed, self.keys = keys != self.keys, keys
+        return changed
+
+    def button(self, button, press):
+        """ set the button pressed or released, False if it already was """
+        with self.__lock:
+            buttons = self.buttons|button if press else self.buttons&~button
+            changed, self.buttons = buttons != self.buttons, buttons
+        return changed
+
+    def clear(self, keys=True, buttons=True):
+        """ forget pressed keys and/or buttons, returns the state before as (keys, buttons) """
+        with self.__lock:
+            state = self.keys, self.buttons
+            if keys:
+                self.keys = 0
+            if buttons:
+                self.buttons = 0
+        return state
+
+    def set(self, keys=None, buttons=None):
+        """ replace pressed keys (iterable of key codes) and/or buttons as a whole report changes them """
+        with self.__lock:
+            if keys is not None:
+                self.keys = sum([1<<key for key in set(keys)])
+            if buttons is not None:
+                self.buttons = buttons
+
+    def follow(self, type, flag, a, revert=False):
+        """ apply a press, release or clear of a journal record (type, flag, a), revert
+            undoes a press or release the device did not get """
+        if type == TYPE_SEND_KEY_REQ and flag in (KEY_PRESS, KEY_RELEASE):
+            self.key(a, (flag == KEY_PRESS) != revert)
+        elif type == TYPE_SEND_MOUSE_REQ and flag in (MOUSE_PRESS, MOUSE_RELEASE):
+            self.button(a, (flag == MOUSE_PRESS) != revert)
+        elif type == TYPE_SEND_KEY_REQ and flag == KEY_CLEAR and not revert:
+            self.clear(buttons=False)
+        elif type == TYPE_SEND_MOUSE_REQ and flag == MOUSE_CLEAR and not revert:
+            self.clear(keys=False)
+
+    def bitset(self):
+        """ 32 bytes, bit k%8 of byte k//8 is set when key code k is pressed """
+        return self.keys.to_bytes(32, 'little')
+
+__all__ = [
+    'InputState',
+]
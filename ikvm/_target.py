@@ -0,0 +1,98 @@
+# coding: utf-8
+import threading
+from collections import deque
+from ._globals import *
+
+class Target:
+    """ one managed machine: serial device, mjpg-streamer and input lease of its own
+
+        serial writes are run in submission order by the target's writer, a thread of its own
+        started by the first write, so a stalled device never delays the writes of another """
+    def __init__(self, id, name, log=None):
+        self.id = id
+        self.name = name
+        self.uart = None
+        self.port = None # ListPortInfo of the opened serial device
+        self.link = None # Reconnect while the serial device is lost
+        self.mjpg = None
+        self.mjpg_cap_name = None
+        self.mjpg_resolution = None
+        self.mjpg_fps = None
+        self.mjpg_port = None
+        self.recorder = None
+        self.probe = None # running latency measurement thread
+        self.macro = None # playing macro
+        self.paste = None # streaming paste in progress
+        self.controller = None # session holding the input lease
+        self.pointer = None # Pointer tracking the cursor position
+        self.report = None # HidReport last written to the device
+        self.batch = False # serial writes are packed into batch/text frames
+        self.firmware = None # (version, features, highest rate) the firmware replied to the query
+        self.__log = log if log else (lambda level, txt, *args: None)
+        self.__jobs = deque()
+        self.__cond = threading.Condition()
+        self.__writer = None
+        self.__closed = False
+
+    def __str__(self):
+        return f'target {self.id} "{self.name}"'
+
+    @property
+    def pending(self):
+        return len(self.__jobs)
+
+    def submit(self, func, *args):
+        """ queue a job, False if too many jobs are pending or the writer is closed """
+        with self.__cond:
+            if self.__closed or len(self.__jobs) >= TARGET_MAX_JOBS:
+                return False
+            self.__jobs.append((func, args))
+            if self.__writer is None:
+                self.__writer = threading.Thread(target=self.__drain, name=f'uart-{self.id}', daemon=True)
+                self.__writer.start()
+            self.__cond.notify()
+        return True
+
+    def close(self):
+        """ stop the writer once the jobs queued are run """
+        with self.__cond:
+            self.__closed = True
+            self.__cond.notify()
+            writer = self.__writer
+        if writer and writer is not threading.current_thread():
+            writer.join()
+
+    def __drain(self):
+        while True:
+            with self.__cond:
+                while not self.__jobs and not self.__closed:
+                    self.__cond.wait()
+                if not self.__jobs:
+                    return
+                func, args = self.__jobs.popleft()
+            try:
+                func(*args)
+            except Exception as e:
+                self.__log(1, '%s writer job failed: %r', self, e)
+
+class Fanout:
+    """ results of one command run on several targets, done(results) is called once
+        by whichever thread reports the last result """
+    def __init__(self, targets, done):
+        self.__results = []
+        self.__pending = targets
+        self.__done = done
+        self.__lock = threading.Lock()
+
+    def result(self, target, code, detail):
+        with self.__lock:
+            self.__results.append((target, code, detail))
+            self.__pending -= 1
+            if self.__pending:
+                return
+        self.__done(sorted(self.__results))
+
+__all__ = [
+    'Target',
+    'Fanout',
+]
@@ -6,38 +6,72 @@ from operator import xor
 # IMPORTANT: BAUDRATE must be same as baud of serial device
 #  otherwise the hardware will reboot whenever server open the serial
 #  hence controled host atx f-panel will get HIGH digital set
+# the serial is always opened at BAUDRATE, a higher rate is negotiated with the firmware, see _baud
 BAUDRATE = 19200
+BAUDRATES = (1000000, 500000, 250000, 115200, 57600, 38400) # negotiated rates, highest first
+BAUD_REPLY_TIMEOUT = 0.2 # second(s) waiting a firmware reply
+BAUD_CONFIRM = 1 # second(s) the firmware waits a valid frame at a new rate before it falls back to BAUDRATE
 UART_TIMEOUT = 1 # second(s) timeout of serial write
 UART_MAX_BUF = UART_TIMEOUT*BAUDRATE//10 # heuristic value prevent timeout, related to the board serial input buffer
+UART_FRAME_MAX = 64 # largest frame the firmware parses, magic+command+size+content+checksum
+UART_RING = 256 # firmware receive ring buffer in bytes
+UART_EVENT_RATE = 400 # keyboard and mouse events per second the firmware sends to the host
 
 ## Arduino mouse button code
 MOUSE_LEFT = 1
 MOUSE_RIGHT = 2
 MOUSE_MIDDLE = 4
+MOUSE_ABS_MAX = 32767 # absolute pointer logical maximum
+
+## features bits of the firmware query reply
+FEATURE_ABS_MOUSE = 0x01 # built with ABSOLUTE_MOUSE
+FEATURE_REPORTS   = 0x02 # keyboard/mouse report frames
+FEATURE_BATCH     = 0x04 # receive ring, batch and text frames
 
 """ protocol: magic command size content   checksum
               0F E0 --      --   -- -- ... --
+a frame is at most UART_FRAME_MAX bytes, the firmware queues received bytes in a ring of UART_RING bytes
 command content                       comment
+ 01     [1B cmd] [1B len] [content]   send batch command, sub-commands are run in order, each is the command
+        ...                            and content of a frame below, len is the content length, i.e. its size-1
+ 02     n/a                           query firmware command, replied with a 02 frame of
+                                       [1B version] [1B features] [4B highest baud rate]
+ 03     [4B baud rate]                set baud command, replied with a 03 frame of the rate at the old rate,
+                                       then the firmware switches to it, the current rate is replied if unsupported
  10     [1B flag=00/01]+[1B key]      send click a single keyboard command, flag=01 press key, flag=00 release key
  11     [1B char]                     send enter a printable(and <Tab>/<LF>) character command
  12     n/a                           send release all pressed keys command
+ 13     [1B modifiers] [6B keys]      send keyboard report command, the whole keyboard state in one frame,
+                                       modifiers bit i is key 128+i, keys are HID usages, 00 for none
+ 14     [n B chars]                   send enter printable characters command, as many 11 commands in one frame
  20     [1B flag=00/01]+[1B button]   send click a mouse button command, flag=01 press button, flag=00 release button
  21     [1B x-move] [1B y-move]       send mouse move command, x- and y-move is signed char, i.e. between -128 and 127
  22     [1B orient=00/01]             send mouse scroll wheel command, orient=00 wheel down, orient=01 wheel up
  23     n/a                           send release all pressed mouse buttons command
+ 24     [2B x] [2B y]                 send mouse absolute move command, x and y between 0 and 32767 across the screen,
+                                       only handled by firmware built with ABSOLUTE_MOUSE
+ 25     [1B buttons] [1B x-move]      send mouse report command, held buttons with a move and a scroll in one frame,
+        [1B y-move] [1B wheel]         moves and wheel are signed char
  31     n/a                           send short power atx command
  32     n/a                           send reset atx command
  33     n/a                           send long power atx command
 """
 MAGIC = b'\x0F\xE0'
 
+CMD_BATCH       = 0x01
+CMD_QUERY       = 0x02
+CMD_SET_BAUD    = 0x03
 CMD_KEY_CLICK   = 0x10
 CMD_TEXT_ENTER  = 0x11
 CMD_KEY_CLEAR   = 0x12
+CMD_KEY_REPORT  = 0x13
+CMD_TEXT        = 0x14
 CMD_MOUSE_CLICK = 0x20
 CMD_MOUSE_MOVE  = 0x21
 CMD_MOUSE_WHEEL = 0x22
 CMD_MOUSE_CLEAR = 0x23
+CMD_MOUSE_ABS   = 0x24
+CMD_MOUSE_REPORT = 0x25
 CMD_SHORT_POWER = 0x31
 CMD_RESET       = 0x32
 CMD_LONG_POWER  = 0x33
@@ -50,15 +84,74 @@ _kclr = struct.pack('!2sBB', MAGIC, CMD_KEY_CLEAR, 1)
 UART_SEND_KEY = lambda act, key: _key(act, key)+checksum(_key(act, key))
 UART_SEND_CHAR = lambda char: _char(char)+checksum(_char(char))
 UART_SEND_KEY_CLEAR = _kclr + checksum(_kclr)
+_krpt = lambda mods, keys: struct.pack('!2sBBB6s', MAGIC, CMD_KEY_REPORT, 8, mods, bytes(keys))
+UART_SEND_KEY_REPORT = lambda mods, keys: _krpt(mods, keys) + checksum(_krpt(mods, keys))
 
 _mouse = lambda act, btn: struct.pack('!2sBBBB', MAGIC, CMD_MOUSE_CLICK, 3, act, btn)
 _mv = lambda x, y:  struct.pack('!2sBBbb', MAGIC, CMD_MOUSE_MOVE, 3, x, y)
 _scr = lambda flag: struct.pack('!2sBBB', MAGIC, CMD_MOUSE_WHEEL, 2, flag)
 _mclr = struct.pack('!2sBB', MAGIC, CMD_MOUSE_CLEAR, 1)
+_abs = lambda x, y: struct.pack('!2sBBHH', MAGIC, CMD_MOUSE_ABS, 5, x, y)
 UART_SEND_MOUSE_CLICK = lambda act, btn: _mouse(act, btn) + checksum(_mouse(act, btn))
 UART_SEND_MOUSE_MOVE = lambda x, y: _mv(x, y) + checksum(_mv(x, y))
 UART_SEND_MOUSE_WHEEL = lambda flag: _scr(flag)+checksum(_scr(flag))
 UART_SEND_MOUSE_CLEAR = _mclr + checksum(_mclr)
+UART_SEND_MOUSE_ABS = lambda x, y: _abs(x, y) + checksum(_abs(x, y))
+_mrpt = lambda btns, x, y, wheel: struct.pack('!2sBBBbbb', MAGIC, CMD_MOUSE_REPORT, 5, btns, x, y, wheel)
+UART_SEND_MOUSE_REPORT = lambda btns, x, y, wheel: _mrpt(btns, x, y, wheel) + checksum(_mrpt(btns, x, y, wheel))
+
+_content_max = UART_FRAME_MAX-len(MAGIC)-3 # command, size and checksum
+_frame = lambda cmd, content: struct.pack('!2sBB', MAGIC, cmd, len(content)+1) + content
+UART_FRAME = lambda cmd, content: _frame(cmd, content) + checksum(_frame(cmd, content))
+UART_SEND_TEXT = lambda chars: b''.join([UART_FRAME(CMD_TEXT, chars[i:i+_content_max])
+        for i in range(0, len(chars), _content_max)])
+
+def uart_pack(data):
+    """ [(frame, events),] of the same commands as the concatenated legacy frames in data,
+        characters are packed into text frames and other commands into batch frames, a
+        command alone stays a legacy frame. Data not made of whole frames is left as is """
+    frames, chars, batch, events = [], b'', b'', 0
+    def flush_chars():
+        frames.extend([(UART_SEND_TEXT(chars[i:i+_content_max]), len(chars[i:i+_content_max]))
+                for i in range(0, len(chars), _content_max)])
+        return b''
+    def flush_batch():
+        if events == 1:
+            frames.append((UART_FRAME(batch[0], batch[2:]), 1))
+        elif events:
+            frames.append((UART_FRAME(CMD_BATCH, batch), events))
+        return b'', 0
+    i = 0
+    while i < len(data):
+        if data[i:i+len(MAGIC)] != MAGIC or i+4 > len(data) or i+4+data[i+3] > len(data):
+            return [(data, 0)]
+        cmd, content = data[i+2], data[i+4:i+3+data[i+3]]
+        i += 4+data[i+3]
+        if cmd == CMD_TEXT_ENTER:
+            batch, events = flush_batch()
+            chars += content
+            continue
+        chars = flush_chars()
+        if len(batch)+2+len(content) > _content_max:
+            batch, events = flush_batch()
+        batch, events = batch+bytes([cmd, len(content)])+content, events+1
+    flush_chars()
+    flush_batch()
+    return frames
+
+UART_QUERY = UART_FRAME(CMD_QUERY, b'')
+UART_SET_BAUD = lambda baud: UART_FRAME(CMD_SET_BAUD, struct.pack('!I', baud))
+
+def uart_reply(data):
+    """ (command, content, bytes after the frame) of the first frame the firmware replied in data,
+        command is None until a whole frame arrived, ValueError on a bad checksum """
+    start = data.find(MAGIC)
+    if start < 0 or len(data) < start+4 or len(data) < start+4+data[start+3]:
+        return None, b'', data
+    frame, rest = data[start:start+4+data[start+3]], data[start+4+data[start+3]:]
+    if reduce(xor, frame) != 0:
+        raise ValueError('bad checksum')
+    return frame[2], frame[4:-1], rest
 
 _atx_convert = {0xFD: CMD_SHORT_POWER, 0xFE: CMD_RESET, 0xFF: CMD_LONG_POWER}
 _atx = lambda sig: struct.pack('!2sBB', MAGIC, _atx_convert[sig], 1)
@@ -66,17 +159,38 @@ UART_SEND_ATX = lambda sig: _atx(sig) + checksum(_atx(sig))
 
 __all__ = [
     'BAUDRATE',
+    'BAUDRATES',
+    'BAUD_REPLY_TIMEOUT',
+    'BAUD_CONFIRM',
     'UART_TIMEOUT',
     'UART_MAX_BUF',
+    'UART_FRAME_MAX',
+    'UART_RING',
+    'UART_EVENT_RATE',
     'MOUSE_LEFT',
     'MOUSE_RIGHT',
     'MOUSE_MIDDLE',
+    'MOUSE_ABS_MAX',
+    'FEATURE_ABS_MOUSE',
+    'FEATURE_REPORTS',
+    'FEATURE_BATCH',
+    'CMD_QUERY',
+    'CMD_SET_BAUD',
     'UART_SEND_KEY',
     'UART_SEND_CHAR',
     'UART_SEND_KEY_CLEAR',
+    'UART_SEND_KEY_REPORT',
     'UART_SEND_MOUSE_CLICK',
     'UART_SEND_MOUSE_MOVE',
     'UART_SEND_MOUSE_WHEEL',
     'UART_SEND_MOUSE_CLEAR',
+    'UART_SEND_MOUSE_ABS',
+    'UART_SEND_MOUSE_REPORT',
     'UART_SEND_ATX',
+    'UART_FRAME',
+    'UART_SEND_TEXT',
+    'uart_pack',
+    'UART_QUERY',
+    'UART_SET_BAUD',
+    'uart_reply',
 ]
@@ -0,0 +1,167 @@
+# coding: utf-8
+"""
+WebSocket transport (RFC 6455) of the binary protocol for browser consoles
+
+upgrade   a client of the WebSocket port sends an HTTP/1.1 GET upgrade first, it gets
+          101 Switching Protocols or an HTTP error and the connection is closed
+client    the payloads of its binary messages form the byte stream a TCP client sends,
+          a message normally carries one request. Text messages are refused
+server    every server message is sent as one binary message, ping is answered by pong
+
+permessage-deflate is negotiated only when enabled, and without context takeover so each
+message is compressed on its own and a session can be handed over. Messages shorter than
+WS_DEFLATE_MIN are never compressed, a keystroke reply only grows and waits for zlib.
+"""
+import struct, zlib
+from base64 import b64encode
+from hashlib import sha1
+
+GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+SUBPROTOCOL = 'ikvm' # echoed when the client offers it
+OP_CONT, OP_TEXT, OP_BINARY, OP_CLOSE, OP_PING, OP_PONG = 0x0, 0x1, 0x2, 0x8, 0x9, 0xA
+CLOSE_NORMAL, CLOSE_GOING_AWAY, CLOSE_PROTOCOL, CLOSE_UNSUPPORTED, CLOSE_TOO_BIG = 1000, 1001, 1002, 1003, 1009
+WS_HTTP_MAX = 8192 # bytes of an upgrade request
+WS_MESSAGE_MAX = 1 << 20 # bytes of a client message, inflated
+WS_DEFLATE_MIN = 256 # bytes of a server message before it is compressed
+DEFLATE_TAIL = b'\x00\x00\xff\xff'
+
+def accept_key(key):
+    return b64encode(sha1(key.encode('latin-1')+GUID).digest()).decode()
+
+def refusal(status):
+    """ HTTP response refusing an upgrade """
+    return (f'HTTP/1.1 {status}\r\nSec-WebSocket-Version: 13\r\n'
+            'Connection: close\r\nContent-Length: 0\r\n\r\n').encode('latin-1')
+
+def mask(payload, key):
+    """ payload masked (or unmasked) by the 4 bytes key """
+    size = len(payload)
+    key = int.from_bytes((key*(size//4+1))[:size], 'big')
+    return (int.from_bytes(payload, 'big')^key).to_bytes(size, 'big')
+
+def frame(payload, opcode=OP_BINARY, key=None, deflate=False):
+    """ one final frame, masked by key as a client sends it """
+    head = 0x80|opcode
+    if deflate:
+        compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        payload = (compressor.compress(payload)+compressor.flush(zlib.Z_SYNC_FLUSH))[:-len(DEFLATE_TAIL)]
+        head |= 0x40
+    size, bit = len(payload), 0x80 if key else 0
+    if size < 126:
+        header = struct.pack('!BB', head, bit|size)
+    elif size < 1 << 16:
+        header = struct.pack('!BBH', head, bit|126, size)
+    else:
+        header = struct.pack('!BBQ', head, bit|127, size)
+    return header+key+mask(payload, key) if key else header+payload
+
+def close_frame(code, key=None):
+    return frame(struct.pack('!H', code), OP_CLOSE, key)
+
+class WebSocket:
+    """ WebSocket state of a session, used by the main thread only except frame() """
+    def __init__(self, deflate=False):
+        self.open = False # upgraded
+        self.deflate = deflate # permessage-deflate offered before, negotiated after the upgrade
+        self.pending = b'' # received bytes not decoded yet
+        self.fragments = [] # payloads of the message in progress
+        self.compressed = False # the message in progress is compressed
+
+    def upgrade(self, data):
+        """ HTTP response once the upgrade request is complete, else None. The bytes after
+            the request are left pending, ValueError with the HTTP status refuses it """
+        data = self.pending+data
+        end = data.find(b'\r\n\r\n')
+        if end == -1:
+            if len(data) > WS_HTTP_MAX:
+                raise ValueError('431 Request Header Fields Too Large')
+            self.pending = data
+            return None
+        lines = data[:end].decode('latin-1').split('\r\n')
+        request, headers = lines[0].split(' '), {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if len(request) != 3 or request[0] != 'GET':
+            raise ValueError('405 Method Not Allowed')
+        if ('websocket' not in headers.get('upgrade', '').lower() or
+                'upgrade' not in headers.get('connection', '').lower() or
+                headers.get('sec-websocket-version') != '13' or 'sec-websocket-key' not in headers):
+            raise ValueError('426 Upgrade Required')
+        extensions = [ext.split(';')[0].strip() for ext in headers.get('sec-websocket-extensions', '').split(',')]
+        protocols = [protocol.strip() for protocol in headers.get('sec-websocket-protocol', '').split(',')]
+        self.deflate = self.deflate and 'permessage-deflate' in extensions
+        response = ['HTTP/1.1 101 Switching Protocols', 'Upgrade: websocket', 'Connection: Upgrade',
+                'Sec-WebSocket-Accept: '+accept_key(headers['sec-websocket-key'])]
+        if SUBPROTOCOL in protocols:
+            response.append('Sec-WebSocket-Protocol: '+SUBPROTOCOL)
+        if self.deflate:
+            response.append('Sec-WebSocket-Extensions: permessage-deflate; '
+                    'server_no_context_takeover; client_no_context_takeover')
+        self.pending, self.open = data[end+4:], True
+        return ('\r\n'.join(response)+'\r\n\r\n').encode('latin-1')
+
+    def feed(self, data):
+        """ (payloads of the complete binary messages, control frames [(opcode, payload),]),
+            ValueError with the close code when the client breaks the protocol """
+        data, payloads, controls, i = self.pending+data, [], [], 0
+        while len(data)-i >= 2:
+            head, size = data[i], data[i+1]&0x7F
+            start = i+2+{126: 2, 127: 8}.get(size, 0)+4
+            if len(data) < start:
+                break
+            if not data[i+1]&0x80:
+                raise ValueError(CLOSE_PROTOCOL) # clients mask every frame
+            if size >= 126:
+                size, = struct.unpack_from('!H' if size == 126 else '!Q', data, i+2)
+            if size > WS_MESSAGE_MAX:
+                raise ValueError(CLOSE_TOO_BIG)
+            if len(data) < start+size:
+                break
+            payload, opcode = mask(data[start:start+size], data[start-4:start]), head&0x0F
+            i = start+size
+            if opcode >= OP_CLOSE:
+                controls.append((opcode, payload))
+                continue
+            if opcode == OP_TEXT:
+                raise ValueError(CLOSE_UNSUPPORTED)
+            if (opcode == OP_CONT) != bool(self.fragments) or opcode not in (OP_CONT, OP_BINARY):
+                raise ValueError(CLOSE_PROTOCOL)
+            if opcode == OP_BINARY:
+                self.compressed = bool(head&0x40) and self.deflate
+            self.fragments.append(payload)
+            if sum(map(len, self.fragments)) > WS_MESSAGE_MAX:
+                raise ValueError(CLOSE_TOO_BIG)
+            if head&0x80: # final fragment
+                payloads.append(self.__message(b''.join(self.fragments)))
+                self.fragments = []
+        self.pending = data[i:]
+        return b''.join(payloads), controls
+
+    def __message(self, payload):
+        if not self.compressed:
+            return payload
+        inflater = zlib.decompressobj(wbits=-zlib.MAX_WBITS)
+        try:
+            payload = inflater.decompress(payload+DEFLATE_TAIL, WS_MESSAGE_MAX)
+        except zlib.error:
+            raise ValueError(CLOSE_PROTOCOL)
+        if inflater.unconsumed_tail:
+            raise ValueError(CLOSE_TOO_BIG)
+        return payload
+
+    def frame(self, msg):
+        return frame(msg, deflate=self.deflate and len(msg) >= WS_DEFLATE_MIN)
+
+__all__ = [
+    'OP_BINARY',
+    'OP_CLOSE',
+    'OP_PING',
+    'OP_PONG',
+    'CLOSE_NORMAL',
+    'CLOSE_GOING_AWAY',
+    'WebSocket',
+    'frame',
+    'close_frame',
+    'refusal',
+]
@@ -0,0 +1,414 @@
+# coding: utf-8
+"""
+asyncio client of the iKVM server
+
+  async with Client('kvm1', 7130) as kvm:
+      await kvm.open_uart('ttyUSB0')
+      await asyncio.gather(*[kvm.key(KEY_PRESS, key) for key in keys]) # pipelined, one round trip
+
+Responses are matched to requests by message type, the server answers requests of the
+same type in order. Ask alive messages are answered automatically and notifications
+(type E0) are kept in Client.notifications or passed to Client.on_notify.
+
+  pointer = await kvm.pointer() # moves and wheel as datagrams, None when the server has no UDP port
+  pointer.move(30, -5)
+
+  async with Pool(hosts, 7130, limit=64) as pool:
+      results = await pool.map(lambda kvm: kvm.atx(ATX_SIGNAL['reset']))
+"""
+import asyncio, json, struct
+from collections import deque
+from ._globals import *
+from ._protocol import *
+
+class ResponseError(Exception):
+    """ failure status code replied by the server """
+    def __init__(self, type, detail):
+        super().__init__(detail)
+        self.type = type
+        self.detail = detail
+
+def _address(host, port):
+    """ "host", "host:port", "[ipv6]:port" or bare ipv6 to (host, port) """
+    if host.startswith('['):
+        host, _, rest = host[1:].partition(']')
+        return host, int(rest[1:]) if rest.startswith(':') else port
+    if host.count(':') == 1:
+        host, _, rest = host.partition(':')
+        return host, int(rest)
+    return host, port
+
+def _parse(buf, start=0):
+    """ decode the message at buf[start:], returns (type, value, end) or None if incomplete """
+    if len(buf)-start < 4:
+        return None
+    type, i = buf[start+3], start+4
+    try:
+        if type in (TYPE_HANDSHAKE, TYPE_GOODBYE, TYPE_ASK_ALIVE, TYPE_REPLY_ALIVE):
+            return type, None, i
+        if type == TYPE_LIST_UART_RES:
+            devs = []
+            for _ in range(buf[i]):
+                size = buf[i+1]
+                name = buf[i+2:i+2+size].decode('utf-8', 'replace')
+                vid, pid = struct.unpack_from('!HH', buf, i+2+size)
+                devs.append((name, vid, pid))
+                i += 1+size+4
+            return (type, devs, i+1) if i+1 <= len(buf) else None
+        if type == TYPE_LIST_CAP_RES:
+            devs, i = [], i+1
+            for _ in range(buf[i-1]):
+                size = buf[i]
+                name, i = buf[i+1:i+1+size].decode('utf-8', 'replace'), i+1+size
+                attrs, i = [], i+1
+                for _ in range(buf[i-1]):
+                    width, height, num = struct.unpack_from('!HHB', buf, i)
+                    attrs.append(((width, height), list(buf[i+5:i+5+num])))
+                    i += 5+num
+                devs.append((name, attrs))
+            return (type, devs, i) if i <= len(buf) else None
+        if type == TYPE_STATS_RES:
+            size, = struct.unpack_from('!H', buf, i)
+            if i+2+size > len(buf):
+                return None
+            return type, json.loads(buf[i+2:i+2+size]), i+2+size
+        if type in (TYPE_LIST_TARGET_RES, TYPE_BROADCAST_RES):
+            items, i = [], i+1
+            for _ in range(buf[i-1]):
+                a, b, size = buf[i], buf[i+1], buf[i+2]
+                if i+3+size > len(buf):
+                    return None
+                items.append((a, b, buf[i+3:i+3+size].decode('utf-8', 'replace')))
+                i += 3+size
+            return type, items, i
+        if type == TYPE_DATAGRAM_RES:
+            if i+18 > len(buf):
+                return None
+            return (type, struct.unpack_from('!H16s', buf, i), i+18)
+        if type == TYPE_INPUT_STATE_RES:
+            if i+33 > len(buf):
+                return None
+            keys = int.from_bytes(buf[i+1:i+33], 'little')
+            return type, (buf[i], [key for key in range(256) if keys>>key&1]), i+33
+        # status code response and notification
+        code, size = buf[i], buf[i+1]
+        if i+2+size > len(buf):
+            return None
+        return type, (code, buf[i+2:i+2+size].decode('utf-8', 'replace')), i+2+size
+    except (IndexError, struct.error):
+        return None
+
+class Client:
+    def __init__(self, host, port=7130, timeout=CLIENT_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.session = None # "session {id} {ip}:{port}" told by the server
+        self.notifications = deque(maxlen=CLIENT_NOTIFICATIONS) # (event, detail) when on_notify is not set
+        self.on_notify = None
+        self.__reader = None
+        self.__writer = None
+        self.__task = None
+        self.__handshake = None
+        self.__pending = {} # response type: deque of futures
+        self.__closed = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    @property
+    def connected(self):
+        return self.__writer is not None and self.__closed is None
+
+    async def connect(self):
+        self.__reader, self.__writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout)
+        self.__closed = None
+        self.__handshake = asyncio.get_running_loop().create_future()
+        self.__task = asyncio.create_task(self.__read_loop())
+        self.__writer.write(HANDSHAKE_MSG)
+        await asyncio.wait_for(asyncio.shield(self.__handshake), self.timeout)
+
+    async def close(self):
+        if self.__writer is None:
+            return
+        if self.__closed is None:
+            try:
+                self.__writer.write(GOODBYE_MSG)
+                await self.__writer.drain()
+            except OSError:
+                pass
+        self.__shutdown(ConnectionError('Connection closed'))
+        self.__task.cancel()
+        self.__writer.close()
+        try:
+            await self.__writer.wait_closed()
+        except OSError:
+            pass
+        self.__writer = None
+
+    def send(self, msg):
+        """ write a request without waiting, returns the future of its response """
+        if self.__closed is not None:
+            raise self.__closed
+        future = asyncio.get_running_loop().create_future()
+        self.__pending.setdefault(msg[len(MAGIC)]|0x80, deque()).append(future)
+        self.__writer.write(msg)
+        return future
+
+    async def request(self, msg):
+        future = self.send(msg)
+        await self.__writer.drain()
+        return await asyncio.wait_for(future, self.timeout)
+
+    def __shutdown(self, exc):
+        if self.__closed is None:
+            self.__closed = exc
+        for futures in self.__pending.values():
+            for future in futures:
+                if not future.done():
+                    future.set_exception(exc)
+        self.__pending = {}
+        if self.__handshake and not self.__handshake.done():
+            self.__handshake.set_exception(exc)
+
+    async def __read_loop(self):
+        buf = b''
+        try:
+            while True:
+                data = await self.__reader.read(CLIENT_BUF)
+                if not data:
+                    raise ConnectionError('Connection closed by server')
+                buf += data
+                start = 0
+                while True:
+                    loc = buf.find(MAGIC, start)
+                    msg = _parse(buf, loc) if loc != -1 else None
+                    if msg is None: # keep the incomplete message, or a tail which may begin the magic
+                        buf = buf[loc:] if loc != -1 else buf[max(start, len(buf)-len(MAGIC)+1):]
+                        break
+                    type, value, start = msg
+                    self.__dispatch(type, value)
+        except (ConnectionError, OSError) as e:
+            self.__shutdown(e)
+
+    def __dispatch(self, type, value):
+        if type == TYPE_ASK_ALIVE:
+            self.__writer.write(REPLY_ALIVE_MSG)
+        elif type == TYPE_HANDSHAKE:
+            if not self.__handshake.done():
+                self.__handshake.set_result(True)
+        elif type == TYPE_GOODBYE:
+            raise ConnectionError('Server said goodbye')
+        elif type == TYPE_NOTIFY:
+            event, detail = value
+            if event == NOTIFY_SESSION:
+                self.session = detail
+            if self.on_notify:
+                self.on_notify(event, detail)
+            else:
+                self.notifications.append((event, detail))
+        else:
+            futures = self.__pending.get(type)
+            future = futures.popleft() if futures else None
+            if future is None or future.done():
+                return
+            if type in (TYPE_LIST_UART_RES, TYPE_LIST_CAP_RES, TYPE_STATS_RES,
+                    TYPE_LIST_TARGET_RES, TYPE_BROADCAST_RES, TYPE_INPUT_STATE_RES, TYPE_DATAGRAM_RES):
+                future.set_result(value)
+            elif value[0] == STATUS_SUCCESS:
+                future.set_result(value[1])
+            else:
+                future.set_exception(ResponseError(type, value[1]))
+
+    ## requests, pipelined when not awaited one by one
+    async def list_uarts(self):
+        return await self.request(LIST_UART_REQ)
+
+    async def list_captures(self):
+        return await self.request(LIST_CAP_REQ)
+
+    async def stats(self):
+        return await self.request(STATS_REQ)
+
+    async def lease(self, flag=LEASE_QUERY, session=None):
+        return await self.request(LEASE_REQ_H(session) if flag == LEASE_HANDOFF else LEASE_REQ(flag))
+
+    async def targets(self):
+        return await self.request(LIST_TARGET_REQ)
+
+    async def select(self, target):
+        return await self.request(SELECT_TARGET_REQ(target))
+
+    async def input_state(self):
+        """ (mouse buttons, [Arduino key codes]) held pressed on the selected target """
+        return await self.request(INPUT_STATE_REQ)
+
+    async def datagram(self):
+        """ (UDP port, token) of the datagram channel, port 0 when the server has none """
+        return await self.request(DATAGRAM_REQ)
+
+    async def pointer(self):
+        """ PointerChannel of the datagram channel, None when the server has none """
+        port, token = await self.datagram()
+        if not port:
+            return None
+        transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+                asyncio.DatagramProtocol, remote_addr=(self.host, port))
+        return PointerChannel(transport, token)
+
+    async def run_mjpg(self, cap, resolution, fps, port):
+        return await self.request(RUN_MJPG_REQ(cap, resolution, fps, port))
+
+    async def open_uart(self, name):
+        return await self.request(OPEN_UART_REQ(name))
+
+    async def key(self, act, key):
+        return await self.request(SEND_KEY_REQ_K(act, key))
+
+    async def release_keys(self):
+        return await self.request(SEND_KEY_REQ_R)
+
+    async def text(self, txt, layout=None):
+        """ ascii text typed by the firmware, any unicode text when the layout of the host is given """
+        return await self.request(SEND_KEY_REQ_U(layout, txt) if layout else SEND_KEY_REQ_C(txt))
+
+    async def paste(self, text, chunk=PASTE_CHUNK, window=PASTE_WINDOW, progress=None):
+        """ streaming paste of any length, at most window chunks unreplied,
+            progress(detail) is called whenever a chunk was typed """
+        data = text.encode('utf-8') if isinstance(text, str) else text
+        pending, detail = deque(), ''
+        timeout = self.timeout+window*chunk/PASTE_RATE # a reply waits the chunks typed before
+        try:
+            for offset in range(0, max(len(data), 1), chunk):
+                piece = data[offset:offset+chunk]
+                pending.append(self.send(SEND_KEY_REQ_P(piece, int(offset+chunk < len(data)))))
+                if len(pending) >= window:
+                    detail = await asyncio.wait_for(pending.popleft(), timeout)
+                    if progress:
+                        progress(detail)
+                await self.__writer.drain()
+            while pending:
+                detail = await asyncio.wait_for(pending.popleft(), timeout)
+                if progress:
+                    progress(detail)
+        finally:
+            for future in pending: # replies of a failed paste are dropped
+                future.cancel()
+        return detail
+
+    async def cancel_paste(self):
+        return await self.request(SEND_KEY_REQ_X)
+
+    async def key_report(self, modifiers, keys=()):
+        """ hold exactly the modifiers and up to 6 keys (HID usages) """
+        return await self.request(SEND_KEY_REQ_REPORT(modifiers, list(keys)[:6]+[0]*(6-len(keys[:6]))))
+
+    async def mouse_report(self, buttons, x=0, y=0, wheel=0):
+        return await self.request(SEND_MOUSE_REQ_REPORT(buttons, x, y, wheel))
+
+    async def mouse(self, act, button):
+        return await self.request(SEND_MOUSE_REQ_K(act, button))
+
+    async def move(self, x, y):
+        return await self.request(SEND_MOUSE_REQ_M(x, y))
+
+    async def move_to(self, x, y):
+        return await self.request(SEND_MOUSE_REQ_A(x, y))
+
+    async def calibrate(self, width, height):
+        return await self.request(SEND_MOUSE_REQ_CAL(width, height))
+
+    async def wheel(self, flag):
+        return await self.request(SEND_MOUSE_REQ_S(flag))
+
+    async def atx(self, sig):
+        return await self.request(SEND_ATX_REQ(sig))
+
+    async def broadcast(self, targets, msg):
+        return await self.request(BROADCAST_REQ(targets, msg))
+
+    async def define_macro(self, name, steps):
+        return await self.request(MACRO_REQ_D(name, steps))
+
+    async def macro(self, flag, name=''):
+        return await self.request(MACRO_REQ(flag, name))
+
+    async def latency(self, stimulus=0, samples=0):
+        return await self.request(LATENCY_REQ(stimulus, samples))
+
+class PointerChannel:
+    """ pointer input sent as datagrams without replies, a lost one is not sent again """
+    def __init__(self, transport, token):
+        self.__transport = transport
+        self.__token = token
+        self.__seq = 0
+
+    def __send(self, build, *args):
+        self.__seq = (self.__seq+1) & 0xFFFFFFFF
+        self.__transport.sendto(build(self.__token, self.__seq, *args))
+
+    def move(self, x, y):
+        while x or y: # frames of signed char
+            dx, dy = max(min(x, 127), -127), max(min(y, 127), -127)
+            self.__send(DATAGRAM_MOVE, dx, dy)
+            x, y = x-dx, y-dy
+
+    def move_to(self, x, y):
+        self.__send(DATAGRAM_MOVE_ABS, x, y)
+
+    def wheel(self, flag):
+        self.__send(DATAGRAM_WHEEL, flag)
+
+    def close(self):
+        self.__transport.close()
+
+class Pool:
+    """ clients of many servers, at most limit of them connecting or running at once """
+    def __init__(self, hosts, port=7130, limit=CLIENT_CONCURRENCY, timeout=CLIENT_TIMEOUT):
+        self.hosts = list(hosts)
+        self.port = port
+        self.timeout = timeout
+        self.__limit = asyncio.Semaphore(limit)
+        self.__clients = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def client(self, host):
+        """ connected client of the host, reconnected when the connection was lost """
+        client = self.__clients.get(host)
+        if client is None or not client.connected:
+            client = self.__clients[host] = Client(*_address(host, self.port), self.timeout)
+            await client.connect()
+        return client
+
+    async def __run(self, host, func):
+        async with self.__limit:
+            try:
+                return await func(await self.client(host))
+            except (OSError, asyncio.TimeoutError, ResponseError) as e:
+                return e
+
+    async def map(self, func):
+        """ await func(client) for every host, returns {host: result or exception} """
+        results = await asyncio.gather(*[self.__run(host, func) for host in self.hosts])
+        return dict(zip(self.hosts, results))
+
+    async def close(self):
+        await asyncio.gather(*[client.close() for client in self.__clients.values()], return_exceptions=True)
+        self.__clients = {}
+
+__all__ = [
+    'ResponseError',
+    'Client',
+    'PointerChannel',
+    'Pool',
+]
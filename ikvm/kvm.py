@@ -2,17 +2,37 @@
 if __name__ != 'ikvm.kvm':
     exit()
 import socket, select, struct, serial, signal, subprocess, sys
-import threading, asyncio, errno, os
+import threading, asyncio, errno, os, tempfile, json
 import serial.tools.list_ports as list_ports
-from sys import stdout, stderr
+from sys import stdout
 from copy import deepcopy as copy
-from time import sleep, time
+from time import sleep, time, perf_counter
 from functools import partial
-from datetime import datetime
-from base64 import b64encode
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from base64 import b64encode, b64decode
 from ._globals import *
 from ._protocol import *
 from ._uart import *
+from ._log import *
+from ._record import Recorder
+from ._journal import Journal
+from ._metrics import *
+from ._profile import *
+from ._session import *
+from ._state import InputState
+from ._target import *
+from ._macro import *
+from ._paste import Paste
+from ._pointer import Pointer
+from ._report import HidReport
+from ._baud import *
+from ._reconnect import Reconnect
+from ._layout import *
+from ._mjpeg import *
+from ._latency import *
+from ._handover import *
+from ._websocket import *
+from ._datagram import *
 
 get_start_mjpg_cmd = lambda root, cap_name, width, height, fps, mjpg_port: ' '.join((
     os.path.join(root, 'mjpg_streamer'),
@@ -43,180 +63,450 @@ class TermSigHandler:
         self.run = False
         self.term = sig
 
+class ReloadSigHandler:
+    def __init__(self, reload):
+        self.__reload = reload
+        signal.signal(signal.SIGHUP, self.__handle)
+
+    def __handle(self, sig, frame):
+        self.__reload()
+
+class DebugSigHandler:
+    def __init__(self, profile, trace):
+        self.__profile = profile
+        self.__trace = trace
+        signal.signal(signal.SIGUSR1, self.__handle)
+        signal.signal(signal.SIGUSR2, self.__handle)
+
+    def __handle(self, sig, frame):
+        if sig == signal.SIGUSR1:
+            self.__profile()
+        else:
+            self.__trace()
+
 class Kvm:
-    def __init__(self, port, bind='0.0.0.0', mjpg_root='', logfile=None, log_level=3, mjpg_logfile=None):
+    def __init__(self, port, bind='0.0.0.0', mjpg_root='', logfile=None, log_level=3, mjpg_logfile=None,
+            record_dir=None, record_segment_size=RECORD_SEGMENT_SIZE, record_segment_time=RECORD_SEGMENT_TIME,
+            record_retention=RECORD_RETENTION, journal=None, metrics_port=None, profile_dir=None, targets=None,
+            abs_mouse=False, hid_reports=False, batch_frames=False, max_baud=BAUDRATES[0],
+            heartbeat=HEARTBEAT_INTERVAL, handover=None, ws_port=None, ws_deflate=False,
+            udp_port=None):
         self.port = port
         self.bind = bind
         self.logfile = logfile
         self.log_level = log_level
         self.mjpg_root = mjpg_root
         self.mjpg_logfile = mjpg_logfile
-        self.__sock = None
-        self.__accept = False # set to True when handshake success
-        self.__uart = None
-        self.__mjpg = None
+        self.record_dir = record_dir
+        self.record_segment_size = record_segment_size
+        self.record_segment_time = record_segment_time
+        self.record_retention = record_retention
+        self.journal = journal
+        self.metrics_port = metrics_port
+        self.metrics = server_metrics() # runtime counters and histograms, see _metrics
+        self.profile_dir = profile_dir if profile_dir else tempfile.gettempdir()
+        self.targets = targets if targets else ['default'] # target names, ids follow the order
+        self.abs_mouse = abs_mouse # firmware built with ABSOLUTE_MOUSE
+        self.hid_reports = hid_reports # firmware handles keyboard/mouse report frames
+        self.batch_frames = batch_frames # firmware queues input in a ring and handles batch/text frames
+        self.max_baud = max_baud # highest serial rate negotiated with the firmware
+        self.heartbeat = heartbeat # second(s) between ask alive of every session, 0 disables
+        self.handover = handover # Unix socket path the state is handed over between restarts, see _handover
+        self.ws_port = ws_port # WebSocket port of browser consoles, see _websocket
+        self.ws_deflate = ws_deflate # negotiate permessage-deflate with WebSocket clients
+        self.udp_port = udp_port # UDP port of the datagram channel of pointer input, see _datagram
+        self.__local = threading.local() # session and target served by this thread, see properties __session and __target
+        self.__sessions = {} # all client sessions keyed by socket
+        self.__targets = [] # Target of each target id
         self.__mjpg_log = None
-        self.__mjpg_cap_name = None
-        self.__mjpg_resolution = None
-        self.__mjpg_fps = None
-        self.__mjpg_port = None
+        self.__journal = None
+        self.__macros = {} # stored Macro of each name
+        self.__scheduler = None
+        self.__tracer = None # set only while tracing, hot paths check it before any trace work
         self.__loop = None
-        self.__alive_answer = False
+        self.__handover = None # Unix socket a successor server connects to
+        self.__successor = None # successor server started by SIGHUP
+        self.__tokens = {} # session of each datagram channel token, used by the main thread
+        self.__inventory = {} # (/dev mtime, response) of the last list uarts/captures, keyed by request type
 
     def start(self):
         # Open logfile
-        self.__log_fh = open(self.logfile, 'a', LOG_BUFSIZE) if self.logfile else stdout
-        self.__log_lock = threading.Lock() # used when thread write text into LOG
-        # Socket settings
-        server = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
-        server.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) # disable Nagle Delay
-        server.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0) # enable ipv4/ipv6 dual-stack
-        try:
-            server.bind((self.bind, self.port))
-        except socket.error as e:
-            sys.exit(48)
-        server.listen()
-        server.setblocking(False)
-        server.settimeout(SOCK_TIMEOUT)
+        self.__log_fh = open(self.logfile, 'a') if self.logfile else stdout
+        self.__logger = Logger(self.__log_fh, self.log_level) # written in batches by a subthread
+        # Take the state over from a running server, it releases journal and metrics port first
+        state, fds = None, []
+        if self.handover:
+            try:
+                state, fds = handover_recv(self.handover, lambda: sd_notify(f'MAINPID={os.getpid()}')) or (None, [])
+            except (OSError, ValueError) as e:
+                self.__log_write(1, 'Take over from the server at %s failed: %s', self.handover, e)
+                sys.exit(48)
+            if state:
+                self.__log_write(3, 'Took over %d session(s) from the server at %s',
+                        len(state['sessions']), self.handover)
+        # Binary journal of every decoded input event
+        if self.journal:
+            self.__journal = Journal(self.journal)
+            self.__log_write(4, 'Input journal opened with %d records', self.__journal.count)
+        # Prometheus text format endpoint
+        if self.metrics_port:
+            self.__metrics_server = serve_prometheus(self.metrics, self.bind, self.metrics_port)
+            self.__log_write(3, 'Metrics endpoint listening on port %d', self.metrics_port)
+        # Socket settings, sockets handed over or passed by systemd are used as is, of the ones
+        # systemd passes the second stream is the WebSocket port and the datagram one the UDP port
+        inherited = listen_fds()
+        streams = [sock for sock in inherited if sock.type == socket.SOCK_STREAM]
+        datagrams = [sock for sock in inherited if sock.type == socket.SOCK_DGRAM]
+        handed = lambda name: socket.socket(fileno=fds[state[name]]) if state.get(name) is not None else None
+        if state:
+            server, ws_server, udp = handed('server'), handed('ws_server'), handed('udp')
+        elif streams:
+            server, ws_server = streams[0], streams[1] if len(streams) > 1 else None
+            udp = datagrams[0] if datagrams else None
+            for sock in streams[2:]+datagrams[1:]:
+                sock.close()
+            self.__log_write(3, 'Listening socket passed by systemd, bind address and port are ignored')
+        else:
+            server, ws_server, udp = self.__listen(self.port), None, None
+        if not self.ws_port and ws_server:
+            ws_server.close()
+            ws_server = None
+        elif self.ws_port and not ws_server:
+            ws_server = self.__listen(self.ws_port)
+        for sock in (server, ws_server) if ws_server else (server,):
+            sock.setblocking(False)
+        if not self.udp_port and udp:
+            udp.close()
+            udp = None
+        elif self.udp_port and not udp:
+            udp = self.__listen(self.udp_port, socket.SOCK_DGRAM)
+        if udp:
+            udp.setblocking(False)
+        self.__udp = udp
         self.__log_write(4, 'Server socket is now listening')
-        # Select settings
-        self.__sockets = [server,] # only two members: ikvm server and client
-        self.__w_queue = [] # whenever server want send message to client, the queue will be put client
         # Thread and Asynchronous settings
-        self.__sockets_lock = threading.Lock() # used when thread modify self.__sockets and self.__sock
-        self.__send_msg = b'' # put message in __send_async wait for sending
-        self.__send_msg_lock = threading.Lock() # used when thread put msg in self.__send_msg
+        self.__sockets_lock = threading.Lock() # used when thread modify self.__sessions
+        self.__main_thread = threading.get_ident()
+        self.__wakeup_r, self.__wakeup_w = socket.socketpair() # wake up select() when subthreads queue messages
+        self.__wakeup_r.setblocking(False)
+        self.__wakeup_w.setblocking(False)
         # Start an event loop in a subthread for main thread put an I/O bound task
         self.__loop = asyncio.new_event_loop()
         threading.Thread(target=self.__loop.run_forever).start()
         self.__log_write(4, 'Event loop subthread started')
+        if self.heartbeat:
+            self.__loop.call_soon_threadsafe(self.__loop.call_later, self.heartbeat, self.__heartbeat)
+        # Targets, each with a serial writer thread of its own
+        self.__targets = [Target(i, name, self.__log_write) for i, name in enumerate(self.targets)]
+        for target in self.__targets:
+            target.pointer = Pointer(self.abs_mouse)
+            target.report = HidReport(self.hid_reports)
+            target.batch = self.batch_frames
+        self.__log_write(4, 'Managing %d target(s): %s', len(self.__targets), ', '.join(self.targets))
+        # Macro playback timing
+        self.__scheduler = Scheduler(self.__log_write)
+        # Session recorder follows the running mjpg-streamer in its own thread, one subfolder per target
+        if self.record_dir:
+            for target in self.__targets:
+                target.recorder = Recorder(
+                    os.path.join(self.record_dir, target.name) if len(self.__targets) > 1 else self.record_dir,
+                    self.record_segment_size, self.record_segment_time, self.record_retention, self.__log_write)
+        # Sessions, serial devices and mjpg-streamers of the previous server
+        if state:
+            self.__resume(state, fds)
+        if self.handover:
+            self.__handover = handover_listen(self.handover)
+            ReloadSigHandler(self.__start_successor)
+            self.__log_write(4, 'Handover socket is now listening at %s', self.handover)
         # Setup terminal signal handler
         will = TermSigHandler()
-
-        ip = self.bind[7:] if '.' in self.bind else self.bind # ip addr representation convert
-        self.__log_write(3, f'Server bind with address {ip} started on port {self.port}')
-
-        self.__buf = b''
-        while will.run: # exit when server received SIGINT or SIGTERM signal
+        # Setup on-demand instrumentation: SIGUSR1 profiles, SIGUSR2 toggles tracing
+        self.__profiler = Profiler(self.profile_dir, log=self.__log_write)
+        DebugSigHandler(lambda: self.__profiler.start(PROFILE_SECONDS), self.__toggle_trace)
+
+        bind, port = server.getsockname()[:2]
+        ip = bind[7:] if '.' in bind else bind # ip addr representation convert
+        self.__log_write(3, 'Server bind with address %s started on port %d', ip, port)
+        if ws_server:
+            self.__log_write(3, 'WebSocket listening on port %d', ws_server.getsockname()[1])
+        if udp:
+            self.__log_write(3, 'Datagram channel listening on UDP port %d', udp.getsockname()[1])
+        sd_notify('READY=1')
+
+        handed_over = False
+        while will.run and not handed_over: # exit when server received SIGINT or SIGTERM signal or handed over
+            if self.__successor and self.__successor.poll() is not None:
+                self.__log_write(1, 'Successor server exited with status %d before taking over', self.__successor.returncode)
+                self.__successor = None
             with self.__sockets_lock:
-                if len(self.__sockets) > 1 and self.__sockets[1].fileno() == -1:
-                    # Clear invalid socket
-                    with self.__send_msg_lock: # clear anything related with writting
-                        self.__w_queue = []
-                        self.__send_msg = b''
-                    self.__sockets.pop()
-                    self.__sock = None
-                    self.__log_write(4, 'Clear the invalid socket in read and write queue')
-                    continue
-            r_sockets, w_sockets, _ = select.select(self.__sockets, self.__w_queue, [], SELECT_TIMEOUT)
+                for sock in [sock for sock in self.__sessions if sock.fileno() == -1]:
+                    # Clear closed session
+                    session = self.__sessions.pop(sock)
+                    if session.datagram:
+                        self.__tokens.pop(session.datagram.token, None)
+                    self.__log_write(4, 'Clear the closed socket in read and write queue')
+                sessions = list(self.__sessions.values())
+                self.metrics.sessions.set(len(sessions))
+            r_sockets = [server, self.__wakeup_r]+[session.sock for session in sessions]
+            if ws_server:
+                r_sockets.append(ws_server)
+            if udp:
+                r_sockets.append(udp)
+            if self.__handover:
+                r_sockets.append(self.__handover)
+            w_sockets = [session.sock for session in sessions if session.out]
+            try:
+                r_sockets, w_sockets, _ = select.select(r_sockets, w_sockets, [], SELECT_TIMEOUT)
+            except (ValueError, OSError): # a socket was closed by a subthread meanwhile
+                continue
+            busy = perf_counter()
             for sock in w_sockets:
-                if sock is not self.__sock:
-                    self.__w_queue.remove(sock)
-                    self.__log_write(4, 'Got an unkown writer socket, removed')
+                session = self.__sessions.get(sock)
+                if session is None or sock.fileno() == -1:
                     continue
-                elif sock.fileno() == -1:
-                    self.__w_queue.remove(sock)
-                    self.__log_write(4, 'Got an invalid writer socket, removed')
-                    continue
-                with self.__send_msg_lock:
-                    msg = self.__send_msg
-                    self.__send_msg = b'' # Clear __send_msg whatever
-                    self.__w_queue = [] # Clear __w_queue
-                if msg == b'': # Skip as no message for sending
-                    break
-                self.__send(msg)
-                self.__log_write(4, 'Sent a message %s to client' %base64(msg)) # may not secure
-                break
+                self.__flush(session)
 
             for sock in r_sockets:
                 ## Handle an incoming connection
-                if sock is server:
-                    self.__handle_incoming_connection(sock)
+                if sock is server or sock is ws_server:
+                    self.__handle_incoming_connection(sock, sock is ws_server)
+                    continue
+                ## Feed pointer datagrams to the serial writers
+                if sock is udp:
+                    self.__handle_datagrams(sock)
+                    continue
+                ## Hand the state over to a successor server, then quit
+                if sock is self.__handover:
+                    handed_over = self.__hand_over(server, ws_server, udp)
+                    break
+                ## Drain wake up bytes, queued messages are flushed in next round
+                if sock is self.__wakeup_r:
+                    try:
+                        while sock.recv(BUF):
+                            pass
+                    except BlockingIOError:
+                        pass
                     continue
 
-                ## Handle client requests
-                while sock is self.__sock:
-                    ret = self.__recv_handler()
-                    if ret == True:
+                ## Handle client requests, one session at a time
+                session = self.__sessions.get(sock)
+                if session is None or sock.fileno() == -1:
+                    continue
+                self.__session = session
+                res = self.__recv() # once, the socket is non-blocking and other sessions wait
+                if res and res is not Quit:
+                    self.__buf += res
+                    while session.buf and sock.fileno() != -1 and self.__recv_handler():
                         continue
-                    else:
-                        break
+                self.__session = None
+            self.metrics.loop_seconds.observe(perf_counter()-busy)
 
-        self.__log_write(3, 'Server terminated by %s' %('user' if will.term == signal.SIGINT else 'system',))
+        if handed_over:
+            self.__log_write(3, 'Server handed over to its successor')
+        else:
+            self.__log_write(3, 'Server terminated by %s', 'user' if will.term == signal.SIGINT else 'system')
         ## Stop the event loop created previously
         self.__loop.call_soon_threadsafe(self.__loop.stop)
         self.__log_write(4, 'Event loop thread stopped')
-        ## Say goodbye to existed client
-        self.__say_goodbye()
-        # close opened serial device
-        if self.__uart and self.__uart.is_open:
-            self.__uart.close()
-            self.__log_write(3, 'Closed opened serial device')
+        ## Say goodbye to existed clients, sessions handed over stay connected
+        if not handed_over:
+            self.__say_goodbye()
+        # stop macros, then wait queued serial writes
+        self.__scheduler.stop()
+        for target in self.__targets:
+            target.close()
+        for target in self.__targets:
+            # close opened serial device, one handed over is kept open by the successor
+            if target.uart and target.uart.is_open and not handed_over:
+                self.__restore_baud(target.uart)
+                target.uart.close()
+                self.__log_write(3, 'Closed opened serial device of %s', target)
+            # stop session recorder before its stream goes away
+            if target.recorder:
+                target.recorder.stop()
+        # terminate running mjpg-streamers, all at once then wait, ones handed over keep streaming
+        mjpgs = [target.mjpg for target in self.__targets
+                if target.mjpg and process_alive(target.mjpg.pid) and not handed_over]
+        for mjpg in mjpgs:
+            os.killpg(os.getpgid(mjpg.pid), signal.SIGINT)
+            self.__log_write(3, 'Sent SIGINT to mjpg-streamer service with PID %d', mjpg.pid)
+        timer = time()
+        while any(process_alive(mjpg.pid) for mjpg in mjpgs): # Wait until mjpg-streamer quit completely
+            sleep(0.1)
+            if time()-timer > WAIT_STOP_MJPG:
+                break
+        for mjpg in mjpgs:
+            if process_alive(mjpg.pid):
+                self.__log_write(2, 'Termination of mjpg-streamer service timeout')
+                os.killpg(os.getpgid(mjpg.pid), signal.SIGKILL)
+                self.__log_write(2, 'Sent SIGKILL to mjpg-streamer service with PID %d', mjpg.pid)
+        if mjpgs:
+            self.__log_write(3, 'MJPG-Streamer service has been terminated')
         # close opened mjpg logfile
         if self.__mjpg_log and self.__mjpg_log is not stdout:
             self.__mjpg_log.close()
             self.__log_write(3, 'Closed opened mjpg logfile')
-        # terminate running mjpg-streamer
-        if self.__mjpg and process_alive(self.__mjpg.pid):
-            os.killpg(os.getpgid(self.__mjpg.pid), signal.SIGINT)
-            self.__log_write(3, 'Sent SIGINT to mjpg-streamer service')
-            should_kill, timer = False, time()
-            while process_alive(self.__mjpg.pid): # Wait until mjpg-streamer quit completely
-                sleep(0.1)
-                if time()-timer > WAIT_STOP_MJPG:
-                    should_kill = True
-                    break
-            if should_kill:
-                self.__log_write(2, 'Termination of mjpg-streamer service timeout')
-                os.killpg(os.getpgid(self.__mjpg.pid), signal.SIGKILL)
-                self.__log_write(2, 'Sent SIGKILL to mjpg-streamer service')
-            self.__log_write(3, 'MJPG-Streamer service has been terminated')
+        # write the trace in progress
+        if self.__tracer:
+            self.__toggle_trace()
         # Close socket
         server.close()
+        if ws_server:
+            ws_server.close()
+        if udp:
+            udp.close()
+        self.__wakeup_r.close()
+        self.__wakeup_w.close()
+        if self.__handover:
+            self.__handover.close()
+            if not handed_over and os.path.exists(self.handover): # else the path is the successor's socket now
+                os.unlink(self.handover)
+        if self.metrics_port:
+            self.__metrics_server.shutdown()
+        # close input journal
+        if self.__journal:
+            self.__journal.close()
+            self.__log_write(4, 'Input journal closed')
         self.__log_write(3, 'Server terminated completely')
-        # close logfile
-        if self.__log_fh and self.__log_fh is not stdout:
-            self.__log_fh.close()
+        # flush pending log records and close logfile
+        self.__logger.close()
+        if handed_over:
+            ## quit at once, finalizing the asyncio transports of the mjpg-streamers handed over kills them
+            os._exit(0)
+
+    def __listen(self, port, type=socket.SOCK_STREAM): # socket bound to the address, the server quits when it is taken
+        server = socket.socket(socket.AF_INET6, type)
+        if type == socket.SOCK_STREAM:
+            server.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) # disable Nagle Delay
+        server.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0) # enable ipv4/ipv6 dual-stack
+        try:
+            server.bind((self.bind, port))
+        except socket.error as e:
+            sys.exit(48)
+        if type == socket.SOCK_STREAM:
+            server.listen()
+        return server
 
-    def __log_write(self, level: int, txt):
+    def __log_write(self, level: int, txt, *args): # txt % args formatted by the log writer subthread
         if self.log_level < level:
             return
-        out = '{} [{}]: {}\n'.format(datetime.now().isoformat(), LOG_LEVEL[level], txt)
-        with self.__log_lock:
-            if self.__log_fh is stdout and level < 2:
-                stderr.write(out)
-            else:
-                self.__log_fh.write(out)
-
-    def __recv_handler(self): # True: continue, False: break
-        if self.__buf == b'':
-            res = self.__recv()
-            if res is None: # non-block null return
-                return True
-            elif res is Quit:
-                return False
-            self.__buf += res
+        self.__logger.write(level, txt, args)
+
+    ## request handlers work on the session and target served by the running thread
+    @property
+    def __session(self):
+        return getattr(self.__local, 'session', None)
+
+    @__session.setter
+    def __session(self, session):
+        self.__local.session = session
+
+    @property
+    def __trace_req(self): # id of the traced request this thread works for, 0 for none
+        return getattr(self.__local, 'trace_req', 0)
+
+    @__trace_req.setter
+    def __trace_req(self, req):
+        self.__local.trace_req = req
+
+    @property
+    def __target(self): # the target of a serial writer job, else the one selected by the session
+        target = getattr(self.__local, 'target', None)
+        if target:
+            return target
+        session = self.__session
+        return session.target if session and session.target else self.__targets[0]
+
+    @property
+    def __uart(self):
+        return self.__target.uart
+
+    @__uart.setter
+    def __uart(self, uart):
+        self.__target.uart = uart
+
+    @property
+    def __sock(self):
+        return self.__session.sock if self.__session else None
+
+    @property
+    def __buf(self):
+        return self.__session.buf
+
+    @__buf.setter
+    def __buf(self, buf):
+        self.__session.buf = buf
+
+    @property
+    def __accept(self):
+        return self.__session.accept if self.__session else False
+
+    @__accept.setter
+    def __accept(self, accept):
+        self.__session.accept = accept
+
+    def __read(self, n): # next n bytes of the message, Incomplete until they are received
+        if len(self.__buf) < n:
+            raise Incomplete
+        data, self.__buf = self.__buf[:n], self.__buf[n:]
+        return data
+
+    def __recv_handler(self): # True: a message was handled, False: wait for more bytes
         if not self.__accept:
-            if len(self.__buf) < 4: # continue as received message length not enough
-                return True
+            if len(self.__buf) < 4: # wait as received message length not enough
+                return False
             if self.__buf[:4] != HANDSHAKE_MSG:
                 # Reject as incoming connection initially send invalid handshake message
-                with self.__sockets_lock:
-                    if self.__sock:
-                        self.__sock.close()
+                self.__buf = b''
+                self.__sock.close()
                 return False
         loc = self.__buf.find(MAGIC)
-        if loc == -1:
-            self.__buf = b''
-            return True
+        if loc == -1: # skip to a magic, whose start may end the bytes received so far
+            keep = next((i for i in range(len(MAGIC)-1, 0, -1) if self.__buf.endswith(MAGIC[:i])), 0)
+            self.__buf = self.__buf[len(self.__buf)-keep:]
+            return False
         head = self.__buf[loc:][:4] # protocol magic and type
         if len(head) < 4:
-            return True
+            self.__buf = self.__buf[loc:]
+            return False
         # Handle request individually (see __RECV_HANDLE_SWITCH for a specific function)
         case = Kvm.__RECV_HANDLE_SWITCH.get(head[-1])
         self.__buf = self.__buf[loc+4:] # trim magic and type
-        case(self) if case else None
-        return False
+        if case and head[-1]>>4 in LEASE_TYPES and self.__session is not self.__target.controller:
+            ## Refuse input from observers, the rest of the message is skipped by searching next magic
+            self.__log_write(2, 'Refused message type <%02X> from %s without input lease', head[-1], self.__session)
+            self.__send_async(STATUS_CODE_RES(head[-1]|0x80, STATUS_FAILURE,
+                'Session Error: Input lease held by another session'))
+            return True
+        if case:
+            message = self.__buf
+            tracer = self.__tracer
+            if tracer:
+                self.__trace_req = tracer.request()
+            timer = perf_counter()
+            try:
+                case(self)
+            except Incomplete: # handled again from the head once the rest is received
+                self.__buf = head+message
+                return False
+            finally:
+                req, self.__trace_req = self.__trace_req, 0
+            end = perf_counter()
+            self.metrics.requests.inc('%02X' %head[-1])
+            self.metrics.request_seconds.observe(end-timer)
+            if tracer:
+                tracer.add('handle <%02X>' %head[-1], req, timer, end)
+        return True
+
+    def __toggle_trace(self):
+        if self.__tracer:
+            tracer, self.__tracer = self.__tracer, None
+            tracer.close()
+            return False
+        path = os.path.join(self.profile_dir, 'ikvm-trace-%d.json' %int(time()))
+        self.__tracer = Tracer(path, log=self.__log_write)
+        self.__log_write(3, 'Tracing started, spans will be written to %s', path)
+        return True
 
     def __list_available_caps(self):
         caps = shell('ls /dev/video*', shell=True)
@@ -232,78 +522,159 @@ class Kvm:
                 caps.remove(cap) # Remove unavailable captures
         return caps
 
-    async def __sleep_ask_alive(self):
-        while self.__accept and not self.__alive_answer:
-            await asyncio.sleep(0.01)
-
-    async def __wait_ask_alive(self, client, ipport):
+    async def __ask_alive(self, session, timeout=ASK_ALIVE_TIMEOUT):
+        ## RTT of the session, None if it did not reply in time, concurrent asks share one message
+        if session.alive is None:
+            self.__log_write(4, 'Sent ask alive message to %s', session)
+            session.alive = asyncio.get_running_loop().create_future()
+            session.alive_sent = perf_counter()
+            self.__send_async(ASK_ALIVE_MSG, session)
+        alive = session.alive
         try:
-            await asyncio.wait_for(self.__sleep_ask_alive(), timeout=ASK_ALIVE_TIMEOUT)
+            return await asyncio.wait_for(asyncio.shield(alive), timeout=timeout)
         except asyncio.exceptions.TimeoutError:
-            pass
+            if session.alive is alive:
+                session.alive = None # a late reply is not taken as the RTT of the next ask
+            return None
 
-        if self.__alive_answer:
-            # reject if previous connection is alive
-            client.close()
-            self.__log_write(3, 'Received another connection from %s, rejected' %ipport)
-        else:
-            if self.__accept:
-                # disconnect since receive ask alive response from old client timeout
-                self.__disconnect('wait ask alive response timeout')
-            # accept a connection from new client
-            with self.__sockets_lock:
-                self.__sockets.pop()
-                self.__sockets.append(client)
-                self.__sock = client
-            self.__log_write(3, 'Received a connection from %s, accepted' %ipport)
-
-    def __handle_incoming_connection(self, sock):
-        client, ipport = sock.accept()
-        client.settimeout(SOCK_TIMEOUT)
+    def __replied_alive(self, session, alive, rtt): # run by the event loop
+        if session.alive is not alive or alive.done():
+            return
+        session.alive, session.missed = None, 0
+        session.rtt.update(rtt)
+        self.metrics.client_rtt_seconds.observe(rtt)
+        alive.set_result(rtt)
+
+    def __heartbeat(self): # run by the event loop every heartbeat interval
+        ## ask every session alive, a session missing HEARTBEAT_MISSES in a row is closed as dead
+        with self.__sockets_lock:
+            sessions = [session for session in self.__sessions.values() if session.accept]
+        for session in sessions:
+            asyncio.create_task(self.__check_alive(session))
+        self.__loop.call_later(self.heartbeat, self.__heartbeat)
+
+    async def __check_alive(self, session):
+        if await self.__ask_alive(session, min(self.heartbeat, ASK_ALIVE_TIMEOUT)) is not None or not session.accept:
+            return
+        session.missed += 1
+        self.metrics.heartbeat_misses.inc()
+        self.__log_write(4, '%s missed %d heartbeat(s)', session, session.missed)
+        if session.missed >= HEARTBEAT_MISSES:
+            self.metrics.connections.inc('dead')
+            self.__close_client(f'Disconnected the TCP as {session.missed} heartbeats unanswered', session)
+
+    async def __wait_ask_alive(self, target, holder, session, reply=False):
+        # ask the lease holder alive
+        alive = await self.__ask_alive(holder) is not None
+
+        if alive and holder.accept:
+            # keep the lease if its holder is alive
+            self.metrics.connections.inc('observer')
+            self.__log_write(3, '%s keeps the input lease of %s, %s stays observer', holder, target, session)
+            if reply:
+                self.__send_async(STATUS_CODE_RES(TYPE_LEASE_RES, STATUS_FAILURE,
+                    f'Session Error: Lease held by {holder}'), session)
+            return
+        if holder.accept:
+            # disconnect since receive ask alive response from old client timeout
+            self.__close_client('Disconnected the TCP as wait ask alive response timeout', holder)
+            self.metrics.connections.inc('takeover')
+        if target.controller in (holder, None) and session.accept and session.target is target:
+            self.__set_controller(target, session)
+            if reply:
+                self.__send_async(STATUS_CODE_RES(TYPE_LEASE_RES, STATUS_SUCCESS, 'Acquired'), session)
+
+    def __handle_incoming_connection(self, sock, websocket=False):
+        try:
+            client, ipport = sock.accept()
+        except (BlockingIOError, ConnectionAbortedError): # reset by the client since select
+            return
+        client.setblocking(False) # a partial message must not hold the loop, see __recv_handler
         ip = ipport[0][7:] if '.' in ipport[0] else f'[{ipport[0]}]' # ip addr representation convert
         ipport = f'{ip}:{ipport[1]}'
+        self.metrics.connections.inc('connected')
 
         with self.__sockets_lock:
-            if len(self.__sockets) == 1:
-                # accept a connection from client
-                self.__sockets.append(client)
-                self.__sock = client
-                self.__log_write(3, 'Received a connection from %s, accepted' %ipport)
+            if len(self.__sessions) >= SESSION_MAX:
+                # reject as too many sessions
+                client.close()
+                self.metrics.connections.inc('rejected')
+                self.__log_write(2, 'Received a connection from %s, rejected as %d sessions connected', ipport, SESSION_MAX)
                 return
-
-        if not self.__accept:
-            with self.__sockets_lock:
-                # close old connection if the old client is not accepted
-                self.__sock.close()
-                # accept a connnection from new
-                self.__sockets.pop()
-                self.__sockets.append(client)
-                self.__sock = client
-            self.__log_write(3, 'Received a connection from %s, accepted' %ipport)
+            # accept a connection from client
+            session = Session(client, ipport)
+            session.target = self.__targets[0]
+            session.ws = WebSocket(self.ws_deflate) if websocket else None
+            self.__sessions[client] = session
+        self.__log_write(3, 'Received a %sconnection from %s, accepted as session %d',
+                'WebSocket ' if websocket else '', ipport, session.id)
+
+    def __set_controller(self, target, session):
+        previous, target.controller = target.controller, session
+        if previous and previous is not session:
+            self.__release_input(target, previous)
+        self.metrics.lease_changes.inc()
+        self.__log_write(3, 'Input lease of %s %s', target, f'granted to {session}' if session else 'is free')
+        self.__notify(NOTIFY_LEASE, str(session) if session else '', target)
+
+    def __release_input(self, target, session):
+        ## Release what the session left pressed, before any write of the new holder
+        keys, buttons = session.input.clear()
+        if not (keys or buttons):
             return
+        self.metrics.input_released.inc()
+        self.__log_write(3, 'Release keys and buttons left pressed by %s on %s', session, target)
+        target.submit(self.__run_on_target, self.__trace_req, session, target, self.__write_release, (keys, buttons))
 
-        # send ask alive message to client
-        self.__log_write(4, 'Sent ask alive message to client')
-        self.__alive_answer = False
-        self.__send_async(ASK_ALIVE_MSG)
-        self.__log_write(5, 'Put the coroutine __wait_ask_alive into the event loop')
-        self.__async_run(self.__wait_ask_alive(client, ipport))
+    def __write_release(self, keys, buttons): # run by the target writer
+        if self.__uart is None or not self.__uart.is_open:
+            return
+        report, cmds = self.__target.report, b''
+        if keys:
+            cmds += report.clear_keys()
+            if self.__journal:
+                self.__journal.append(TYPE_SEND_KEY_REQ, KEY_CLEAR, target=self.__target.id)
+        if buttons:
+            cmds += report.clear_buttons()
+            if self.__journal:
+                self.__journal.append(TYPE_SEND_MOUSE_REQ, MOUSE_CLEAR, target=self.__target.id)
+        res = self.__uart_write(cmds, replay=True)
+        if res['result'] != 'success':
+            self.__log_write(1, 'Release keys and buttons of %s failed as %s', self.__target, res.get('detail'))
+
+    def __follow_input(self, records, revert=False): # run by the target writer
+        ## broadcast and macro presses are released with the direct ones when the session leaves the lease
+        session = self.__session
+        if session and self.__target.controller is session:
+            for record in records:
+                session.input.follow(*record[:3], revert=revert)
+
+    def __notify(self, event, detail, target=None): # to sessions of the target, all sessions when target is None
+        with self.__sockets_lock:
+            sessions = [session for session in self.__sessions.values()
+                    if session.accept and (target is None or session.target is target)]
+        msg = NOTIFY(event, detail[:255])
+        for session in sessions:
+            self.__send_async(msg, session)
 
     ## non-blocking socket.recv handling process
     def __recv(self):
         try:
-            with self.__sockets_lock:
-                if self.__sock:
-                    recv = self.__sock.recv(BUF)
+            recv = self.__sock.recv(BUF)
             if recv == b'':
                 # Disconnected from client sent by FIN
                 self.__disconnect('server got FIN')
                 return Quit
+            if self.__session.ws:
+                return self.__ws_recv(recv)
             return recv
+        except TimeoutError:
+            # Disconnected since socket timed out, caught first as TimeoutError is a socket.error
+            self.__disconnect('socket timeout')
+            return Quit
         except socket.error as e:
             if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK,):
                 # No data yet
-                sleep(0.01)
                 return None
             elif e.args[0] == errno.ECONNRESET:
                 # Disconnected from client sent by RST
@@ -313,51 +684,120 @@ class Kvm:
                 # Disconnected since server aborted
                 self.__disconnect('connection aborted')
                 return Quit
+            elif e.args[0] == errno.EBADF:
+                # Closed by a subthread meanwhile
+                return Quit
             else:
-                raise e
-        except TimeoutError:
-            # Disconnected since socket timed out
-            self.__disconnect('socket timeout')
+                # Any other error ends this session only, the main loop serves the rest
+                self.__log_write(1, 'Receive from %s failed as %s', self.__session, e)
+                self.__disconnect(f'receive failed as {e}')
+                return Quit
+
+    def __ws_recv(self, data): # request bytes carried by WebSocket frames, None while there are none
+        session = self.__session
+        ws = session.ws
+        if not ws.open:
+            try:
+                response = ws.upgrade(data)
+            except ValueError as e:
+                self.metrics.websocket_upgrades.inc('refused')
+                self.__log_write(2, 'Refused WebSocket upgrade of %s: %s', session, e)
+                self.__close_ws(session, refusal(str(e)), 'Refused the WebSocket upgrade')
+                return Quit
+            if response is None:
+                return None
+            self.metrics.websocket_upgrades.inc('upgraded')
+            self.__log_write(4, 'Upgraded %s to WebSocket%s', session, ' with permessage-deflate' if ws.deflate else '')
+            self.__send_async(response, raw=True)
+            data = b''
+        try:
+            data, controls = ws.feed(data)
+        except ValueError as e:
+            self.__log_write(2, 'WebSocket protocol error of %s, closing with code %d', session, e.args[0])
+            self.__close_ws(session, close_frame(e.args[0]), 'Closed the WebSocket on a protocol error')
             return Quit
+        for opcode, payload in controls:
+            if opcode == OP_PING:
+                self.__send_async(frame(payload, OP_PONG), raw=True)
+            elif opcode == OP_CLOSE:
+                self.__close_ws(session, close_frame(CLOSE_NORMAL), 'Disconnected the WebSocket as client sent close')
+                return Quit
+        return data if data else None
 
-    ## secure socket.send
-    def __send(self, msg):
-        sent, timer = 0, 0
-        while True:
-            sleep(0.01)
-            if timer > TIMEOUT_RT:
+    def __close_ws(self, session, last, reason): # the last bytes are sent at once before the socket closes
+        with session.out_lock:
+            out, session.out = session.out, b''
+        try:
+            session.sock.send(out+last, socket.MSG_DONTWAIT)
+        except OSError:
+            pass
+        self.__close_client(reason, session)
+
+    ## non-blocking socket.send of a session outbound queue, the rest is kept for next writable
+    def __flush(self, session):
+        with session.out_lock:
+            msg = session.out
+            session.out = b''
+        if msg == b'': # Skip as no message for sending
+            return
+        timer = perf_counter()
+        try:
+            sent = session.sock.send(msg, socket.MSG_DONTWAIT)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except socket.error as e:
+            if e.args[0] in (errno.ECONNRESET, errno.EPIPE):
+                # Disconnected from client sent by RST
+                self.__close_client('Disconnected the TCP as server got RST', session)
+            elif e.args[0] == errno.ECONNABORTED:
+                # Disconnected since server aborted
+                self.__close_client('Disconnected the TCP as connection aborted', session)
+            elif e.args[0] != errno.EBADF:
+                raise e
+            return
+        if sent < len(msg):
+            with session.out_lock:
+                session.out = msg[sent:]+session.out
+        self.metrics.send_queue.set(len(msg)-sent)
+        session.flushed += sent
+        end = perf_counter()
+        # a traced message is flushed once its last byte is sent, maybe by a later flush
+        while session.traced and session.traced[0][0] <= session.flushed:
+            _, req = session.traced.popleft()
+            if self.__tracer:
+                self.__tracer.add('socket flush', req, timer, end)
+        self.__log_write(4, 'Sent a message %s to %s', lazy(base64, msg[:sent]), session) # may not secure
+
+    def __send_async(self, msg, session=None, raw=False, req=None): # queue msg for the session, current one by default
+        session = session if session else self.__session
+        if session is None or session.sock.fileno() == -1:
+            return
+        req = self.__trace_req if req is None else req # traced request the message replies to
+        if self.__tracer:
+            timer = perf_counter()
+        if session.ws and not raw: # one binary message each, framed in queue order
+            if not session.ws.open:
                 return
+            msg = session.ws.frame(msg)
+        with session.out_lock:
+            session.out += msg
+            session.queued += len(msg)
+            if req and self.__tracer:
+                session.traced.append((session.queued, req))
+            depth = len(session.out)
+        self.metrics.send_queue.set(depth)
+        if depth > self.metrics.send_queue_peak.value:
+            self.metrics.send_queue_peak.set(depth)
+        if depth > SESSION_MAX_QUEUE:
+            # a slow reader must not hold the server memory, other sessions have their own queues
+            self.__close_client(f'Dropped {session} as its outbound queue overflowed', session)
+        elif threading.get_ident() != self.__main_thread:
             try:
-                with self.__sockets_lock:
-                    if self.__sock:
-                        sent = self.__sock.send(msg)
-            except socket.error as e:
-                if e.args[0] == errno.ECONNRESET:
-                    # Disconnected from client sent by RST
-                    self.__disconnect('server got RST')
-                    return
-                elif e.args[0] == errno.ECONNABORTED:
-                    # Disconnected since server aborted
-                    self.__disconnect('connection aborted')
-                    return
-                else:
-                    raise e
-            except TimeoutError:
-                # Disconnected since socket timed out
-                self.__disconnect('socket timeout')
-                return
-            msg = msg[sent:]
-            if len(msg) > 0:
-                timer += 1
-                continue
-            return
-
-    def __send_async(self, msg): # use function __send when in start() called select()
-        with self.__send_msg_lock:
-            self.__send_msg += msg
-            with self.__sockets_lock:
-                if self.__sock:
-                    self.__w_queue.append(self.__sock)
+                self.__wakeup_w.send(b'\0')
+            except BlockingIOError: # wake up already pending
+                pass
+        if self.__tracer:
+            self.__tracer.add('send async', req, timer, perf_counter())
 
     def __async_run(self, task):
         if not self.__loop:
@@ -366,20 +806,49 @@ class Kvm:
 
     def __handle_handshake(self):
         self.__log_write(3, 'Got a handshake message')
+        if self.__accept:
+            return
+        session = self.__session
         self.__accept = True
+        self.metrics.handshake_seconds.observe(perf_counter()-session.accepted)
         self.__log_write(5, 'Put handshake response to write queue')
         self.__send_async(HANDSHAKE_MSG)
+        self.__send_async(NOTIFY(NOTIFY_SESSION, str(session)))
+        self.__claim_lease(session.target, session)
 
-    def __close_client(self, reason):
-        self.__log_write(3, reason)
-        if self.__uart and self.__uart.is_open:
-            self.__uart.close()
-            self.__log_write(3, 'Close the opened serial device')
-        with self.__sockets_lock:
-            if self.__sock:
-                self.__sock.close()
-        self.__accept = False
-        self.__log_write(3, 'Closed the accepted client socket')
+    def __claim_lease(self, target, session):
+        holder = target.controller
+        if holder is None:
+            self.__set_controller(target, session)
+            return
+        self.__send_async(NOTIFY(NOTIFY_LEASE, str(holder)), session)
+        # take the lease over if its holder is gone, otherwise the session observes
+        self.__log_write(5, 'Put the coroutine __wait_ask_alive into the event loop')
+        self.__async_run(self.__wait_ask_alive(target, holder, session))
+
+    def __close_client(self, reason, session=None):
+        session = session if session else self.__session
+        self.__log_write(3, '%s: %s', session, reason)
+        for target in self.__targets:
+            if target.paste and target.paste.session is session:
+                self.__end_paste(target, target.paste, 'Paste Error: Session closed')
+            if session is not target.controller:
+                continue
+            self.__set_controller(target, None) # keys are released before the device is closed
+            if target.uart and target.uart.is_open and target.submit(self.__close_uart, target):
+                self.__log_write(4, 'Put closing serial device of %s to its writer', target)
+        session.accept = False
+        session.sock.close()
+        self.__log_write(3, 'Closed the client socket of %s', session)
+
+    def __close_uart(self, target): # run by the target writer after queued writes
+        target.link = None
+        if target.uart and target.uart.is_open:
+            self.__restore_baud(target.uart)
+            target.uart.close()
+            target.uart.baudrate = BAUDRATE # a re-open starts at the rate of the firmware at power on
+            self.__log_write(3, 'Close the opened serial device of %s', target)
+            self.__notify(NOTIFY_UART, 'Closed', target)
 
     def __disconnect(self, reason):
         self.__close_client('Disconnected the TCP as ' + reason)
@@ -389,21 +858,266 @@ class Kvm:
 
     def __handle_reply_alive(self):
         self.__log_write(4, 'Got a replay alive message')
-        self.__alive_answer = True
+        session = self.__session
+        alive = session.alive
+        if alive is None: # not asked or too late
+            return
+        self.__loop.call_soon_threadsafe(self.__replied_alive, session, alive, perf_counter()-session.alive_sent)
+
+    def __handle_lease_request(self):
+        self.__log_write(4, 'Got a lease request message')
+        ## Read flag
+        flag = self.__read(1)[0]
+
+        ## Read session id when flag is LEASE_HANDOFF
+        to = struct.unpack('!H', self.__read(2))[0] if flag == LEASE_HANDOFF else 0
+
+        session, target = self.__session, self.__target
+        holder = target.controller
+        code, detail = STATUS_SUCCESS, ''
+        if flag == LEASE_QUERY:
+            detail = str(holder) if holder else 'Free'
+        elif flag == LEASE_ACQUIRE:
+            if holder is session:
+                detail = 'Already held'
+            elif holder is None:
+                self.__set_controller(target, session)
+                detail = 'Acquired'
+            else:
+                ## Reply after the holder failed or answered ask alive
+                self.__log_write(5, 'Put the coroutine __wait_ask_alive into the event loop')
+                self.__async_run(self.__wait_ask_alive(target, holder, session, reply=True))
+                return
+        elif flag in (LEASE_RELEASE, LEASE_HANDOFF):
+            with self.__sockets_lock:
+                match = [other for other in self.__sessions.values() if other.id == to and other.accept]
+            if holder is not session:
+                code, detail = STATUS_FAILURE, 'Session Error: Lease not held by this session'
+            elif flag == LEASE_HANDOFF and not match:
+                code, detail = STATUS_FAILURE, f'Session Error: No such session {to}'
+            elif flag == LEASE_HANDOFF and match[0].target is not target:
+                code, detail = STATUS_FAILURE, f'Session Error: {match[0]} selected another target'
+            else:
+                self.__set_controller(target, match[0] if flag == LEASE_HANDOFF else None)
+                detail = f'Handed off to {match[0]}' if flag == LEASE_HANDOFF else 'Released'
+        else:
+            self.__log_write(2, 'Got the lease request invalid flag <%02X>', flag)
+            code, detail = STATUS_FAILURE, 'Protocol Error: Received flag <{:02X}> is invalid'.format(flag)
+        self.__log_write(5, 'Put a lease response to write queue')
+        self.__send_async(STATUS_CODE_RES(TYPE_LEASE_RES, code, detail[:255]))
+
+    def __handle_input_state_request(self):
+        self.__log_write(4, 'Got an input state request message')
+        holder = self.__target.controller
+        state = holder.input if holder else InputState()
+        self.__log_write(5, 'Put an input state response to write queue')
+        self.__send_async(INPUT_STATE_RES(state.buttons, state.bitset()))
+
+    def __handle_datagram_request(self):
+        self.__log_write(4, 'Got a datagram channel request message')
+        session = self.__session
+        if self.__udp is None:
+            self.__log_write(5, 'Put a datagram channel disabled response to write queue')
+            self.__send_async(DATAGRAM_RES(0, bytes(16)))
+            return
+        if session.datagram is None:
+            session.datagram = Datagram()
+            self.__tokens[session.datagram.token] = session
+            self.__log_write(3, 'Opened the datagram channel of %s', session)
+        self.__log_write(5, 'Put a datagram channel response to write queue')
+        self.__send_async(DATAGRAM_RES(self.__udp.getsockname()[1], session.datagram.token))
+
+    def __handle_datagrams(self, sock): # all datagrams received, moves merge while the writer is busy
+        for _ in range(SESSION_MAX_QUEUE//DATAGRAM_MAX): # a flood still lets the loop serve connections
+            try:
+                data, address = sock.recvfrom(DATAGRAM_MAX)
+            except OSError: # drained
+                return
+            datagram = parse_datagram(data)
+            if datagram is None:
+                self.metrics.datagrams.inc('invalid')
+                continue
+            token, seq, flag, args = datagram
+            session = self.__tokens.get(token)
+            if session is None or session.sock.fileno() == -1:
+                self.metrics.datagrams.inc('unknown')
+                continue
+            target = session.target
+            if session is not target.controller:
+                self.metrics.datagrams.inc('refused')
+                continue
+            if not session.datagram.accept(seq):
+                self.metrics.datagrams.inc('stale')
+                continue
+            self.metrics.datagrams.inc('accepted')
+            self.__log_write(5, 'Datagram %d of %s from %s flag <%02X>', seq, session, address, flag)
+            ## no reply is sent, the writer runs without a session
+            if flag in (MOUSE_WHEEL_UP, MOUSE_WHEEL_DOWN):
+                queued = target.submit(self.__run_on_target, self.__trace_req, None, target, self.__send_mouse_scroll_wheel_to_uart, (flag,))
+            elif session.datagram.add(flag, *args):
+                queued = target.submit(self.__run_on_target, self.__trace_req, None, target, self.__write_datagram_moves, (session.datagram,))
+            else:
+                continue # merged into the queued write
+            if not queued:
+                session.datagram.take() # dropped like a lost datagram
+                self.metrics.datagrams.inc('busy')
+
+    def __write_datagram_moves(self, datagram): # run by the target writer
+        position, (x, y) = datagram.take()
+        if position:
+            self.__send_mouse_position_to_uart(MOUSE_MOVE_ABS, *position)
+        while x or y: # the merged moves in frames of signed char
+            dx, dy = max(min(x, 127), -127), max(min(y, 127), -127)
+            self.__send_mouse_move_to_uart(dx, dy)
+            x, y = x-dx, y-dy
+
+    def __handle_list_targets_request(self):
+        self.__log_write(4, 'Got a list targets request message')
+        targets = []
+        for target in self.__targets:
+            state = TARGET_UART if target.uart and target.uart.is_open else 0
+            if target.mjpg and process_alive(target.mjpg.pid):
+                state |= TARGET_MJPG
+            targets.append((target.id, state, target.name))
+        self.__log_write(5, 'Put a list targets response to write queue')
+        self.__send_async(LIST_TARGET_RES(targets))
+
+    def __handle_select_target_request(self):
+        self.__log_write(4, 'Got a select target request message')
+        ## Read target id
+        target = self.__read(1)[0]
+
+        if target >= len(self.__targets):
+            self.__log_write(2, 'Got the select target request invalid target %d', target)
+            self.__log_write(5, 'Put a failure select target response to write queue')
+            self.__send_async(STATUS_CODE_RES(TYPE_SELECT_TARGET_RES, STATUS_FAILURE,
+                f'Protocol Error: No such target {target}'))
+            return
+
+        session, target = self.__session, self.__targets[target]
+        if session.target is not target:
+            ## Leave the lease of the previous target
+            previous, session.target = session.target, target
+            if previous.controller is session:
+                self.__set_controller(previous, None)
+            self.__log_write(3, '%s selected %s', session, target)
+        self.__log_write(5, 'Put a success select target response to write queue')
+        self.__send_async(STATUS_CODE_RES(TYPE_SELECT_TARGET_RES, STATUS_SUCCESS, str(target)[:255]))
+        if target.controller is not session:
+            self.__claim_lease(target, session)
+
+    def __handle_broadcast_request(self):
+        self.__log_write(4, 'Got a broadcast request message')
+        ## Read target ids, then message type and flag (signal of atx) of the command
+        ids = self.__read(self.__read(1)[0])
+        head = self.__read(2)
+        ids = list(ids) if ids else [target.id for target in self.__targets]
+        type, flag = head
+        a, b, chars, error = 0, 0, b'', ''
+
+        ## Read the command content the same as message type 21/22/23
+        if type == TYPE_SEND_KEY_REQ and flag in (KEY_PRESS, KEY_RELEASE):
+            a = self.__read(1)[0]
+        elif type == TYPE_SEND_KEY_REQ and flag == KEY_TEXT_SEND:
+            chars = self.__read(struct.unpack('!H', self.__read(2))[0])
+            if not chars:
+                error = 'Protocol Error: the flag KEY_TEXT_SEND followed zero commands length'
+        elif type == TYPE_SEND_KEY_REQ and flag != KEY_CLEAR:
+            error = 'Protocol Error: Received flag <{:02X}> is invalid'.format(flag)
+        elif type == TYPE_SEND_MOUSE_REQ and flag in (MOUSE_PRESS, MOUSE_RELEASE):
+            a = self.__read(1)[0]
+            if a not in (MOUSE_LEFT, MOUSE_RIGHT, MOUSE_MIDDLE):
+                error = 'Invalid mouse button <{:02X}>'.format(a)
+        elif type == TYPE_SEND_MOUSE_REQ and flag == MOUSE_MOVE:
+            a, b = struct.unpack('!bb', self.__read(2))
+        elif type == TYPE_SEND_MOUSE_REQ and flag not in (MOUSE_CLEAR, MOUSE_WHEEL_UP, MOUSE_WHEEL_DOWN):
+            error = 'Protocol Error: Received flag <{:02X}> is invalid'.format(flag)
+        elif type == TYPE_SEND_ATX_REQ and flag not in ATX_SIGNAL.values():
+            error = 'Protocol Error: Received invalid signal <{:02X}>'.format(flag)
+        elif type not in (TYPE_SEND_KEY_REQ, TYPE_SEND_MOUSE_REQ, TYPE_SEND_ATX_REQ):
+            error = 'Protocol Error: Received type <{:02X}> can not be broadcast'.format(type)
+
+        if error:
+            self.__log_write(2, 'Got the broadcast request invalid command: %s', error)
+            self.__log_write(5, 'Put a failure broadcast response to write queue')
+            self.__send_async(BROADCAST_RES([(id, STATUS_FAILURE, error) for id in ids]))
+            return
+
+        ## Fan the command out to the serial writer of each target
+        session = self.__session
+        record = (0, type, flag, 0, a, b)
+        def done(results):
+            success = sum(code == STATUS_SUCCESS for _, code, _ in results)
+            self.__log_write(3, 'Broadcast <%02X> command to %d target(s), %d succeeded', type, len(results), success)
+            self.__log_write(5, 'Put a broadcast response to write queue')
+            self.__send_async(BROADCAST_RES(results), session)
+        fanout = Fanout(len(ids), done)
+        for id in ids:
+            target = self.__targets[id] if id < len(self.__targets) else None
+            if target is None:
+                fanout.result(id, STATUS_FAILURE, f'Protocol Error: No such target {id}')
+            elif target.controller not in (None, session):
+                fanout.result(id, STATUS_FAILURE, 'Session Error: Input lease held by another session')
+            elif not target.submit(self.__run_on_target, self.__trace_req, session, target, self.__broadcast_to_uart, (fanout, record, chars)):
+                fanout.result(id, STATUS_FAILURE, 'Serial Error: Device busy')
+
+    def __broadcast_to_uart(self, fanout, record, chars):
+        target = self.__target
+        if self.__uart is None or not self.__uart.is_open:
+            self.__log_write(1, 'Broadcast to %s failed as serial device not opened', target)
+            fanout.result(target.id, STATUS_FAILURE, 'Serial Error: Device not opened')
+            return
+        if self.__journal and chars:
+            self.__journal.append_text(chars, target=target.id)
+        elif self.__journal:
+            self.__journal.append(*record[1:3], *record[4:], target=target.id)
+        self.__follow_input([(*record[1:3], record[4])])
+        # through the report state of the target, held keys and buttons stay in report mode
+        cmd = target.report.text(chars) if chars else target.report.command(*record[1:3], *record[4:])
+        res = self.__uart_write(cmd) # send command to uart device
+        if res['result'] == 'success':
+            self.__log_write(4, 'Broadcast command to serial of %s success', target)
+            fanout.result(target.id, STATUS_SUCCESS, 'Sent')
+        else:
+            self.__follow_input([(*record[1:3], record[4])], revert=True) # the host did not see the change
+            detail = ' as {}'.format(res.get('detail')) if res.get('detail') else ''
+            self.__log_write(1, f'Broadcast command to serial of {target} failed{detail}')
+            fanout.result(target.id, STATUS_FAILURE, f'Serial Error: Send failed{detail}'[:255])
+
+    def __cached_inventory(self, type):
+        ## device nodes are added and removed in /dev, an unchanged mtime means the same devices
+        stamp = os.stat('/dev').st_mtime_ns
+        cached = self.__inventory.get(type)
+        return (stamp, cached[1] if cached and cached[0] == stamp else None)
 
     def __handle_list_uarts_request(self):
         self.__log_write(4, 'Got a list uarts request message')
+        stamp, res = self.__cached_inventory(TYPE_LIST_UART_REQ)
+        if res:
+            self.__log_write(5, 'Put a cached list uarts response to write queue')
+            self.__send_async(res)
+            return
+        timer = perf_counter()
         devs = [(
             port.device,
             0 if port.vid is None else port.vid,
             0 if port.pid is None else port.pid,
         ) for port in list_ports.comports()]
+        self.metrics.enumerate_uart_seconds.observe(perf_counter()-timer)
+        res = LIST_UART_RES(devs)
+        self.__inventory[TYPE_LIST_UART_REQ] = (stamp, res)
         self.__log_write(5, 'Put a list uarts response to write queue')
-        self.__send_async(LIST_UART_RES(devs))
+        self.__send_async(res)
 
     def __handle_list_captures_request(self):
         self.__log_write(4, 'Got a list captures request message')
+        stamp, res = self.__cached_inventory(TYPE_LIST_CAP_REQ)
+        if res:
+            self.__log_write(5, 'Put a cached list captures response to write queue')
+            self.__send_async(res)
+            return
         ## Get all available video captures
+        timer = perf_counter()
         caps = self.__list_available_caps()
 
         ## Get all resolution and frame rate
@@ -417,7 +1131,7 @@ class Kvm:
             exts = shell(r'sed -r "s/Interval: Discrete .*s \((.*) fps\)/\1/"', input=exts.stdout, shell=True)
             if exts.stderr:
                 ## Send when shell command execution failed
-                self.__log_write(1, 'Execution with video capture %s specs failure' %cap)
+                self.__log_write(1, 'Execution with video capture %s specs failure', cap)
                 self.__log_write(5, 'Put an empty list captures response to write queue')
                 self.__send_async(LIST_CAP_RES([]))
                 return
@@ -434,155 +1148,109 @@ class Kvm:
                     fps.append(int(float(ext)))
             devs.append((cap, attr))
 
+        self.metrics.enumerate_cap_seconds.observe(perf_counter()-timer)
         ## Send all available video captures with resolution and frame rate
-        self.__log_write(5, 'Put a%s list captures response to write queue' %('' if devs else 'n empty',))
-        self.__send_async(LIST_CAP_RES(devs))
+        res = LIST_CAP_RES(devs)
+        self.__inventory[TYPE_LIST_CAP_REQ] = (stamp, res) # failures above are never cached
+        self.__log_write(5, 'Put a%s list captures response to write queue', '' if devs else 'n empty')
+        self.__send_async(res)
 
-    async def __start_mjpg_streamer(self, cap_name, width, height, fps, mjpg_port):
+    async def __start_mjpg_streamer(self, session, target, cap_name, width, height, fps, mjpg_port):
         # Check if restart mjpg-streamer
-        if self.__mjpg and process_alive(self.__mjpg.pid):
-            if( cap_name        == self.__mjpg_cap_name and
-                (width, height) == self.__mjpg_resolution and
-                fps             == self.__mjpg_fps and
-                mjpg_port       == self.__mjpg_port
+        if target.mjpg and process_alive(target.mjpg.pid):
+            if( cap_name        == target.mjpg_cap_name and
+                (width, height) == target.mjpg_resolution and
+                fps             == target.mjpg_fps and
+                mjpg_port       == target.mjpg_port
             ):
                 # Reply if mjpg-streamer is running and with same parameters
                 self.__log_write(4, 'MJPG-Streamer service already started')
                 self.__log_write(5, 'Put a success run mjpg-streamer response to write queue')
-                self.__send_async(STATUS_CODE_RES(TYPE_RUN_MJPG_RES, STATUS_SUCCESS, 'Already started'))
+                self.__send_async(STATUS_CODE_RES(TYPE_RUN_MJPG_RES, STATUS_SUCCESS, 'Already started'), session)
                 return
             # Terminates subprocess when the settings from client was changed
-            os.killpg(os.getpgid(self.__mjpg.pid), signal.SIGINT)
+            self.metrics.mjpg_starts.inc('restart')
+            os.killpg(os.getpgid(target.mjpg.pid), signal.SIGINT)
             self.__log_write(4, 'Sent SIGINT to mjpg-streamer service for the change of capture/specs')
             try:
-                await asyncio.wait_for(self.__mjpg.wait(), timeout=WAIT_STOP_MJPG)
+                await asyncio.wait_for(target.mjpg.wait(), timeout=WAIT_STOP_MJPG)
             except asyncio.exceptions.TimeoutError:
                 # mjpg-streamer doesn't quit during WAIT_STOP_MJPG second(s)
                 self.__log_write(2, 'Termination of mjpg-streamer service timeout')
                 # Force terminates mjpg-streamer
-                os.killpg(os.getpgid(self.__mjpg.pid), signal.SIGKILL)
+                os.killpg(os.getpgid(target.mjpg.pid), signal.SIGKILL)
                 self.__log_write(2, 'Sent SIGKILL to mjpg-streamer service')
             self.__log_write(4, 'MJPG-Streamer service has been terminated')
 
 
         ## Set arguments of mjpg-streamer
-        self.__mjpg_cap_name = cap_name
-        self.__mjpg_resolution = (width, height)
-        self.__mjpg_fps = fps
-        self.__mjpg_port = mjpg_port
+        target.mjpg_cap_name = cap_name
+        target.mjpg_resolution = (width, height)
+        target.mjpg_fps = fps
+        target.mjpg_port = mjpg_port
         cmd = get_start_mjpg_cmd(self.mjpg_root, cap_name, width, height, fps, mjpg_port)
 
         # Open logfile/stdout
         if not self.__mjpg_log:
             self.__mjpg_log = open(self.mjpg_logfile, 'w', LOG_BUFSIZE) if self.mjpg_logfile else stdout
         # Start MJPG-Streamer
-        self.__mjpg = await asyncio.create_subprocess_shell(
+        target.mjpg = await asyncio.create_subprocess_shell(
                 cmd, shell=True,
                 stdout=self.__mjpg_log, stderr=self.__mjpg_log, # set mjpg-streamer logfile
                 env=dict(os.environ, LD_LIBRARY_PATH=self.mjpg_root), # add enviroment variable
                 preexec_fn=os.setsid) # add to process group for termination
         try:
-            exit_code = await asyncio.wait_for(self.__mjpg.wait(), timeout=WAIT_START_MJPG)
+            exit_code = await asyncio.wait_for(target.mjpg.wait(), timeout=WAIT_START_MJPG)
         except asyncio.exceptions.TimeoutError:
             # Reply success if mjpg-streamer survive at least WAIT_START_MJPG second(s)
-            self.__log_write(3, 'MJPG-Streamer service started with PID %d' %(self.__mjpg.pid,))
+            self.__log_write(3, 'MJPG-Streamer service of %s started with PID %d', target, target.mjpg.pid)
+            self.metrics.mjpg_starts.inc('started')
+            if target.recorder:
+                target.recorder.start(mjpg_port)
             self.__log_write(5, 'Put a success run mjpg-streamer response to write queue')
-            self.__send_async(STATUS_CODE_RES(TYPE_RUN_MJPG_RES, STATUS_SUCCESS, 'Started'))
+            self.__send_async(STATUS_CODE_RES(TYPE_RUN_MJPG_RES, STATUS_SUCCESS, 'Started'), session)
+            self.__notify(NOTIFY_MJPG, f'{cap_name} {width}x{height}@{fps} port {mjpg_port}', target)
         else:
             # Reply failure if mjpg-streamer exited
-            self.__log_write(1, 'MJPG-Streamer service exited with status %d unexpected' %exit_code)
+            self.__log_write(1, 'MJPG-Streamer service exited with status %d unexpected', exit_code)
+            self.metrics.mjpg_starts.inc('failed')
             self.__log_write(5, 'Put a failure run mjpg-streamer response to write queue')
             self.__send_async(STATUS_CODE_RES(
                 TYPE_RUN_MJPG_RES, STATUS_FAILURE,
-                'Server Error: mjpg-streamer exited with status %d unexpected' %exit_code))
+                'Server Error: mjpg-streamer exited with status %d unexpected' %exit_code), session)
+            self.__notify(NOTIFY_MJPG, 'Exited', target)
 
     def __handle_run_mjpg_request(self):
         self.__log_write(4, 'Got a run mjpg-streamer request message')
         ## Read video capture name
-        cap_name = ''
-        while True:
-            if len(self.__buf) == 0: # for get name length
-                res = self.__recv()
-                if res is None:
-                    continue
-                elif res is Quit:
-                    return
-                self.__buf += res
-                continue
-            cap_name_len = self.__buf[0]
-            if cap_name_len == 0:
-                ## Reply if no video capture name found
-                self.__log_write(2, 'Got the run mjpg-streamer request name length is 0')
-                self.__log_write(5, 'Put a failure run mjpg-streamer response to write queue')
-                self.__send_async(STATUS_CODE_RES(
-                    TYPE_RUN_MJPG_RES, STATUS_FAILURE,
-                    'Protocol Error: Video capture name length is 0'))
-                return
-            elif len(self.__buf)-1 < cap_name_len: # for get name
-                res = self.__recv()
-                if res is None:
-                    continue
-                elif res is Quit:
-                    return
-                self.__buf += res
-                continue
-            try:
-                cap_name = self.__buf[1:][:cap_name_len].decode('utf-8')
-            except UnicodeDecodeError:
-                ## Reply if serial device name is not UTF-8 encoding
-                self.__log_write(2, 'Resolved the run mjpg-streamer request video capture name failed')
-                self.__log_write(5, 'Put a failure run mjpg-streamer response to write queue')
-                self.__send_async(STATUS_CODE_RES(
-                    TYPE_RUN_MJPG_RES, STATUS_FAILURE,
-                    'Protocol Error: Video capture name is not valid UTF-8 encoding'))
-                return
-            self.__buf = self.__buf[1+cap_name_len:]
-            break
+        cap_name_len = self.__read(1)[0]
+        if cap_name_len == 0:
+            ## Reply if no video capture name found
+            self.__log_write(2, 'Got the run mjpg-streamer request name length is 0')
+            self.__log_write(5, 'Put a failure run mjpg-streamer response to write queue')
+            self.__send_async(STATUS_CODE_RES(
+                TYPE_RUN_MJPG_RES, STATUS_FAILURE,
+                'Protocol Error: Video capture name length is 0'))
+            return
+        try:
+            cap_name = self.__read(cap_name_len).decode('utf-8')
+        except UnicodeDecodeError:
+            ## Reply if serial device name is not UTF-8 encoding
+            self.__log_write(2, 'Resolved the run mjpg-streamer request video capture name failed')
+            self.__log_write(5, 'Put a failure run mjpg-streamer response to write queue')
+            self.__send_async(STATUS_CODE_RES(
+                TYPE_RUN_MJPG_RES, STATUS_FAILURE,
+                'Protocol Error: Video capture name is not valid UTF-8 encoding'))
+            return
 
         ## Read resolution
-        width, height = 0, 0
-        while True:
-            if len(self.__buf) < 4:
-                res = self.__recv()
-                if res is None:
-                    continue
-                elif res is Quit:
-                    return
-                self.__buf += res
-                continue
-            width, height = struct.unpack('!HH', self.__buf[:4])
-            self.__buf = self.__buf[4:]
-            break
+        width, height = struct.unpack('!HH', self.__read(4))
 
         ## Read frame rate
-        fps = 0
-        while True:
-            if len(self.__buf) == 0: # for get frame rate
-                res = self.__recv()
-                if res is None:
-                    continue
-                elif res is Quit:
-                    return
-                self.__buf += res
-                continue
-            fps = self.__buf[0]
-            self.__buf = self.__buf[1:]
-            break
+        fps = self.__read(1)[0]
 
         ## Read required mjpg-streamer port
-        mjpg_port = 0
-        while True:
-            if len(self.__buf) < 2:
-                res = self.__recv()
-                if res is None:
-                    continue
-                elif res is Quit:
-                    return
-                self.__buf += res
-                continue
-            mjpg_port, = struct.unpack('!H', self.__buf[:2])
-            self.__buf = self.__buf[2:]
-            break
+        mjpg_port, = struct.unpack('!H', self.__read(2))
 
         ## Search partial matched video capture
         match = list(filter(lambda cap: cap_name in cap, self.__list_available_caps()))
@@ -598,53 +1266,49 @@ class Kvm:
 
         ## Async run mjpg-streamer
         self.__log_write(5, 'Put the coroutine __start_mjpg_streamer into the event loop')
-        self.__async_run(self.__start_mjpg_streamer(cap_name, width, height, fps, mjpg_port))
+        self.__async_run(self.__start_mjpg_streamer(self.__session, self.__target, cap_name, width, height, fps, mjpg_port))
 
     def __handle_open_uart_request(self):
         self.__log_write(4, 'Got a open uart request message')
         ## Read serial device name
-        uart_name = ''
-        while True:
-            if len(self.__buf) == 0: # for get name length
-                res = self.__recv()
-                if res is None:
-                    continue
-                elif res is Quit:
-                    return
-                self.__buf += res
-                continue
-            uart_name_len = self.__buf[0]
-            if uart_name_len == 0:
-                ## Reply if no serial device name found
-                self.__log_write(2, 'Got the open uart request name length is 0')
-                self.__log_write(5, 'Put a failure open uart response to write queue')
-                self.__send_async(STATUS_CODE_RES(
-                    TYPE_OPEN_UART_RES, STATUS_FAILURE,
-                    'Protocol Error: Serial device name length is 0'))
-                return
-            elif len(self.__buf)-1 < uart_name_len: # for get name
-                res = self.__recv()
-                if res is None:
-                    continue
-                elif res is Quit:
-                    return
-                self.__buf += res
-                continue
-            try:
-                uart_name = self.__buf[1:][:uart_name_len].decode('utf-8')
-            except UnicodeDecodeError:
-                ## Reply if serial device name is not UTF-8 encoding
-                self.__log_write(2, 'Resolved the open uart request serial device name failed')
-                self.__log_write(5, 'Put a failure open uart response to write queue')
-                self.__send_async(STATUS_CODE_RES(
-                    TYPE_OPEN_UART_RES, STATUS_FAILURE,
-                    'Protocol Error: Serial device name is not valid UTF-8 encoding'))
-                return
-            self.__buf = self.__buf[1+uart_name_len:]
-            break
+        uart_name_len = self.__read(1)[0]
+        if uart_name_len == 0:
+            ## Reply if no serial device name found
+            self.__log_write(2, 'Got the open uart request name length is 0')
+            self.__log_write(5, 'Put a failure open uart response to write queue')
+            self.__send_async(STATUS_CODE_RES(
+                TYPE_OPEN_UART_RES, STATUS_FAILURE,
+                'Protocol Error: Serial device name length is 0'))
+            return
+        try:
+            uart_name = self.__read(uart_name_len).decode('utf-8')
+        except UnicodeDecodeError:
+            ## Reply if serial device name is not UTF-8 encoding
+            self.__log_write(2, 'Resolved the open uart request serial device name failed')
+            self.__log_write(5, 'Put a failure open uart response to write queue')
+            self.__send_async(STATUS_CODE_RES(
+                TYPE_OPEN_UART_RES, STATUS_FAILURE,
+                'Protocol Error: Serial device name is not valid UTF-8 encoding'))
+            return
 
         ## Search partial matched serial device on local
         for uart_port in list_ports.grep(uart_name):
+            owner = [target for target in self.__targets
+                    if target is not self.__target and target.uart and target.uart.port == uart_port.device]
+            if owner:
+                ## Reply failure as the serial device is managed by another target
+                self.__log_write(3, 'Serial device %s already opened by %s', uart_port.device, owner[0])
+                self.__log_write(5, 'Put a failure open uart response to write queue')
+                self.__send_async(STATUS_CODE_RES(TYPE_OPEN_UART_RES, STATUS_FAILURE,
+                    f'Server Error: Device opened by {owner[0]}'[:255]))
+                return
+            if self.__target.link:
+                ## an explicit open stops looking for the lost device
+                self.__target.link = None
+                try:
+                    self.__uart.close()
+                except serial.SerialException:
+                    pass
             ## Open serial device
             try:
                 if self.__uart is None:
@@ -660,20 +1324,22 @@ class Kvm:
                     secure_name = uart_port.device[:239]
                     msg = f'Changed from "{secure_name}"'
                     if self.__uart.is_open:
+                        self.__restore_baud(self.__uart)
                         self.__uart.close()
                         self.__uart = serial.Serial(uart_port.device, BAUDRATE, write_timeout=UART_TIMEOUT)
             except serial.SerialException:
-                self.__log_write(1, 'Open serial device %s failed' %uart_port.device)
+                self.__log_write(1, 'Open serial device %s failed', uart_port.device)
                 self.__log_write(5, 'Put a failure open uart response to write queue')
                 secure_name = uart_port.device[:219]
                 self.__send_async(STATUS_CODE_RES(
                     TYPE_OPEN_UART_RES, STATUS_FAILURE, 
                     f'Serial Error: Cannot open device "{secure_name}"'))
                 return
-            ## Reply success message
-            self.__log_write(3, '%s serial device %s' %(msg+' to' if msg[0] == 'C' else msg, uart_port.device))
-            self.__log_write(5, 'Put a success open uart response to write queue')
-            self.__send_async(STATUS_CODE_RES(TYPE_OPEN_UART_RES, STATUS_SUCCESS, msg))
+            self.__target.port = uart_port
+            ## Negotiate the rate and reply by the writer, after writes queued to the device
+            self.__log_write(3, '%s serial device %s', msg+' to' if msg[0] == 'C' else msg, uart_port.device)
+            self.__log_write(5, 'Put negotiating serial rate of %s to its writer', self.__target)
+            self.__uart_submit(TYPE_OPEN_UART_RES, self.__negotiate_baud, msg, uart_port.device)
             return
 
         ## Reply no devicees failure message
@@ -683,21 +1349,162 @@ class Kvm:
         self.__send_async(STATUS_CODE_RES(TYPE_OPEN_UART_RES, STATUS_FAILURE,
             f'Server Error: No such device "{secure_name}"'))
 
-    def __uart_write(self, data):
+    def __negotiate_baud(self, msg, device):
+        target = self.__target
+        try:
+            if msg != 'Already opened':
+                baud, target.firmware = negotiate(self.__uart, self.max_baud)
+                self.__apply_firmware(target)
+                if target.firmware:
+                    self.__log_write(3, 'Firmware version %d features 0x%02X of %s, serial at %d baud',
+                            target.firmware[0], target.firmware[1], device, baud)
+                else:
+                    self.__log_write(3, 'Firmware of %s replied no query, serial at %d baud', device, baud)
+        except serial.SerialException as e:
+            self.metrics.uart_errors.inc('error')
+            self.__log_write(1, 'Negotiate serial rate of %s failed: %s', device, e)
+            self.__log_write(5, 'Put a failure open uart response to write queue')
+            self.__send_async(STATUS_CODE_RES(TYPE_OPEN_UART_RES, STATUS_FAILURE, f'Serial Error: {e}'[:255]))
+            return
+        ## Reply success message
+        baud = self.__uart.baudrate
+        self.__log_write(5, 'Put a success open uart response to write queue')
+        self.__send_async(STATUS_CODE_RES(TYPE_OPEN_UART_RES, STATUS_SUCCESS, f'{msg} at {baud} baud'[:255]))
+        if msg != 'Already opened':
+            self.__notify(NOTIFY_UART, f'{msg} {device} at {baud} baud'[:255], target)
+
+    def __apply_firmware(self, target):
+        ## features the firmware reported add to the ones of the options
+        features = target.firmware[1] if target.firmware else 0
+        target.pointer.absolute = self.abs_mouse or bool(features&FEATURE_ABS_MOUSE)
+        target.report.enabled = self.hid_reports or bool(features&FEATURE_REPORTS)
+        target.batch = self.batch_frames or bool(features&FEATURE_BATCH)
+
+    def __restore_baud(self, uart):
+        ## leave the firmware at the rate the next open starts with
+        try:
+            restore(uart)
+        except serial.SerialException as e:
+            self.__log_write(2, 'Restore serial rate of %s failed: %s', uart.port, e)
+
+    def __lose_uart(self, error): # run by the target writer
+        target = self.__target
+        if target.link or target.port is None:
+            return
+        target.link = Reconnect(target.port)
+        self.metrics.uart_lost.inc()
+        self.__log_write(1, 'Lost serial device %s of %s as %s, reconnecting', target.link, target, error)
+        self.__notify(NOTIFY_UART, f'Lost {target.link}, reconnecting', target)
+        self.__log_write(5, 'Put the coroutine __watch_uart into the event loop')
+        self.__async_run(self.__watch_uart(target, target.link))
+
+    async def __watch_uart(self, target, link):
+        ## look for the device until it is back, given up or another device is opened
+        loop = asyncio.get_running_loop()
+        while target.link is link and link.elapsed < UART_RECONNECT_TIMEOUT:
+            await asyncio.sleep(UART_RECONNECT_POLL)
+            if link.opening:
+                continue
+            port = link.find(await loop.run_in_executor(None, list_ports.comports))
+            if port is not None:
+                link.opening = True
+                target.submit(self.__run_on_target, self.__trace_req, None, target, self.__reopen_uart, (link, port))
+        if target.link is link:
+            target.link = None
+            self.__log_write(1, 'Gave up serial device %s of %s after %ds', link, target, UART_RECONNECT_TIMEOUT)
+            self.__notify(NOTIFY_UART, f'Gave up {link} after {UART_RECONNECT_TIMEOUT}s', target)
+            target.submit(self.__close_uart, target)
+
+    def __reopen_uart(self, link, port): # run by the target writer
+        target = self.__target
+        link.opening = False
+        if target.link is not link:
+            return
+        uart = None
+        try:
+            uart = serial.Serial(port.device, BAUDRATE, write_timeout=UART_TIMEOUT)
+            baud, firmware = negotiate(uart, self.max_baud)
+        except serial.SerialException as e:
+            self.__log_write(4, 'Reopen serial device %s of %s failed: %s', port.device, target, e)
+            if uart:
+                uart.close()
+            return # the lost one stays until the device is found again
+        try:
+            target.uart.close()
+        except serial.SerialException:
+            pass
+        target.uart, target.port, target.firmware, target.link = uart, port, firmware, None
+        self.__apply_firmware(target)
+        target.pointer.position = None # the host may have reset the cursor
+        ## replay the releases written while it was lost, from release all if some were dropped
+        replay = list(link.replay)
+        if link.overflow:
+            replay.insert(0, target.report.clear_keys()+target.report.clear_buttons())
+        elapsed = link.elapsed
+        res = self.__uart_write(b''.join(replay)) if replay else {'result': 'success'}
+        self.metrics.uart_recovery_seconds.observe(elapsed)
+        self.__log_write(3, 'Reconnected serial device %s of %s as %s in %.3fs at %d baud, replayed %d release(s) %s',
+                link, target, port.device, elapsed, baud, len(replay), res['result'])
+        self.__notify(NOTIFY_UART, f'Reconnected {port.device} in {elapsed:.2f}s at {baud} baud', target)
+
+    def __uart_submit(self, res_type, func, *args):
+        ## Run func by the writer of the target, the reply goes to the requesting session
+        session, target = self.__session, self.__target
+        if not target.submit(self.__run_on_target, self.__trace_req, session, target, func, args):
+            self.__log_write(1, 'Serial writes of %s queued over %d, refused', target, TARGET_MAX_JOBS)
+            self.__log_write(5, 'Put a failure response to write queue')
+            self.__send_async(STATUS_CODE_RES(res_type, STATUS_FAILURE, 'Serial Error: Device busy'))
+
+    def __run_on_target(self, req, session, target, func, args): # req: traced request that queued the job
+        self.__local.session, self.__local.target, self.__trace_req = session, target, req
+        try:
+            func(*args)
+        finally:
+            self.__local.session, self.__local.target, self.__trace_req = None, None, 0
+
+    def __uart_write(self, data, replay=False): # replay: a release kept while the device is lost
+        link = self.__target.link
+        if link:
+            if replay:
+                link.keep(data)
+                return {'result': 'success', 'detail': 'kept until reconnected'}
+            return {'result': 'error', 'detail': f'device {link} lost, reconnecting'}
+        timer = perf_counter()
         try:
-            while len(data) > 0: # send all bytes to serial device
-                sent = self.__uart.write(data[:UART_MAX_BUF])
-                data = data[sent:]
+            frames, events = [(data, 0)], 0
+            if self.__target.batch and len(data) > UART_FRAME_MAX:
+                frames = uart_pack(data)
+            for frame, count in frames:
+                ## a packed frame carries many events, keep the firmware ring from overflowing
+                ahead = (events-UART_RING//2)/UART_EVENT_RATE - (perf_counter()-timer)
+                if ahead > 0:
+                    sleep(ahead)
+                events += count
+                while len(frame) > 0: # send all bytes to serial device
+                    sent = self.__uart.write(frame[:UART_TIMEOUT*self.__uart.baudrate//10])
+                    frame = frame[sent:]
         except serial.SerialTimeoutException:
+            self.metrics.uart_errors.inc('timeout')
             return {'result': 'error', 'detail': 'timeout'}
         except serial.serialutil.SerialException as e:
-            return {'result': 'error', 'detail': e.args[0]}
+            self.metrics.uart_errors.inc('error')
+            self.__lose_uart(e)
+            if replay and self.__target.link:
+                self.__target.link.keep(data)
+                return {'result': 'success', 'detail': 'kept until reconnected'}
+            return {'result': 'error', 'detail': e.args[0] if e.args else 'error'}
+        finally:
+            end = perf_counter()
+            self.metrics.uart_write_seconds.observe(end-timer)
+            if self.__tracer:
+                self.__tracer.add('uart write', self.__trace_req, timer, end)
         return {'result': 'success'}
 
     def __send_key_to_uart(self, act, key):
         if self.__uart is None or not self.__uart.is_open:
             ## Send failure message when serial device is not opened
             self.__log_write(1, 'Send key failed as serial device not opened')
+            self.__session.input.key(key, act != KEY_PRESS)
             self.__log_write(5, 'Put a failure send key response to write queue')
             self.__send_async(STATUS_CODE_RES(TYPE_SEND_KEY_RES, STATUS_FAILURE, 'Serial Error: Device not opened'))
             return
@@ -705,8 +1512,10 @@ class Kvm:
         press = 'press' if act == KEY_PRESS else 'release'
         # Determine detail be with printable key or hex code
         key_txt = '"%s"' %chr(key) if chr(key).isprintable() and key in range(0x80) else '<{:02X}>'.format(key)
-        cmd = UART_SEND_KEY(act, key) # construct serial protocol format
-        res = self.__uart_write(cmd) # send command to uart device
+        cmd = self.__target.report.key(act, key) # construct serial protocol format, empty if no report changed
+        if self.__journal:
+            self.__journal.append(TYPE_SEND_KEY_REQ, act, key, target=self.__target.id)
+        res = self.__uart_write(cmd, replay=act == KEY_RELEASE) # send command to uart device
         if res['result'] == 'success':
             ## Send success message
             self.__log_write(4, 'Send key command to serial success')
@@ -716,6 +1525,7 @@ class Kvm:
             ## Send failure message
             detail = ' as {}'.format(res.get('detail')) if res.get('detail') else ''
             self.__log_write(1, f'Send key command to serial failed{detail}')
+            self.__session.input.key(key, act != KEY_PRESS) # the host did not see the change
             self.__log_write(5, 'Put a failure send key response to write queue')
             self.__send_async(STATUS_CODE_RES(TYPE_SEND_KEY_RES, STATUS_FAILURE,
                 f'Serial Error: Send {press} key {key_txt} failed{detail}'))
@@ -731,7 +1541,9 @@ class Kvm:
         # Prepare shown characters in replay message
         chrs = raw(''.join([chr(char) for char in chars][:MAX_SHOW]))
         # divide a single command to multiple commands that can be handled with hardware
-        cmds = b''.join([UART_SEND_CHAR(char) for char in chars])
+        cmds = self.__target.report.text(chars)
+        if self.__journal:
+            self.__journal.append_text(chars, target=self.__target.id)
         res = self.__uart_write(cmds) # send commands to uart device
         if res['result'] == 'success':
             ## Send success message
@@ -747,6 +1559,177 @@ class Kvm:
             self.__send_async(STATUS_CODE_RES(TYPE_SEND_KEY_RES, STATUS_FAILURE,
                 f'Serial Error: Send text characters started with {chrs} failed{detail}'))
 
+    def __send_layout_text_to_uart(self, layout, text, cmds, events):
+        if self.__uart is None or not self.__uart.is_open:
+            ## Send failure message when serial device is not opened
+            self.__log_write(1, 'Send layout text failed as serial device not opened')
+            self.__log_write(5, 'Put a failure send key response to write queue')
+            self.__send_async(STATUS_CODE_RES(TYPE_SEND_KEY_RES, STATUS_FAILURE, 'Serial Error: Device not opened'))
+            return
+
+        # Prepare shown characters in replay message
+        chrs = raw(text[:MAX_SHOW])
+        report = self.__target.report
+        if report.enabled: # the compiled frames are legacy key frames
+            cmds = b''.join([report.key(act, key, True) for act, key in events])
+        if self.__journal:
+            self.__journal.append_keys(events, target=self.__target.id)
+        res = self.__uart_write(cmds) # one batched write of every key stroke
+        if res['result'] == 'success':
+            ## Send success message
+            self.__log_write(4, 'Send %s layout text command to serial success', layout)
+            self.__log_write(5, 'Put a success send key response to write queue')
+            self.__send_async(STATUS_CODE_RES(TYPE_SEND_KEY_RES, STATUS_SUCCESS,
+                f'Send {layout} layout text started with {chrs} success'))
+        else:
+            ## Send failure message
+            detail = ' as {}'.format(res.get('detail')) if res.get('detail') else ''
+            self.__log_write(1, f'Send {layout} layout text command to serial failed{detail}')
+            self.__log_write(5, 'Put a failure send key response to write queue')
+            self.__send_async(STATUS_CODE_RES(TYPE_SEND_KEY_RES, STATUS_FAILURE,
+                f'Serial Error: Send {layout} layout text started with {chrs} failed{detail}'))
+
+    def __layout_text(self, layout, text):
+        error = ''
+        try:
+            layout, text = layout.decode('utf-8') or 'us', text.decode('utf-8')
+            cmds, events = compile_text(layout, text)
+        except UnicodeDecodeError:
+            error = 'Protocol Error: Layout or text is not utf-8 encoded'
+        except KeyError:
+            error = 'Layout Error: Unknown layout {}, expected one of {}'.format(
+                raw(layout[:MAX_SHOW]), '/'.join(LAYOUTS))
+        except ValueError as e:
+            error = 'Layout Error: {} cannot type {}'.format(layout, raw(e.args[0][:MAX_SHOW]))
+        if error:
+            self.__log_write(2, error)
+            self.__log_write(5, 'Put a failure send key response to write queue')
+            self.__send_async(STATUS_CODE_RES(TYPE_SEND_KEY_RES, STATUS_FAILURE, error))
+            return
+        self.__uart_submit(TYPE_SEND_KEY_RES, self.__send_layout_text_to_uart, layout, text, cmds, events)
+
+    def __paste_chunk(self, chars, last):
+        session, target = self.__session, self.__target
+        paste = target.paste
+        detail = ''
+        if paste and paste.session is not session:
+            detail = 'Paste Error: Another session is pasting'
+        elif self.__uart is None or not self.__uart.is_open:
+            self.__log_write(1, 'Paste failed as serial device not opened')
+            detail = 'Serial Error: Device not opened'
+        elif paste is None:
+            paste = target.paste = Paste(session)
+            self.__log_write(3, 'Streaming paste started on %s', target)
+        if not detail and not paste.add(chars, last):
+            ## the client does not wait replies of its chunks, memory of the paste is bounded
+            self.__end_paste(target, paste, f'Paste Error: Queued characters exceed {PASTE_MAX_PENDING}')
+            detail = 'Paste Error: Paste cancelled'
+        if detail:
+            self.__log_write(5, 'Put a failure send key response to write queue')
+            self.__send_async(STATUS_CODE_RES(TYPE_SEND_KEY_RES, STATUS_FAILURE, detail))
+            return
+        if paste.pump():
+            self.__scheduler.at(max(paste.due, perf_counter()), self.__pump_paste, target, paste)
+
+    def __pump_paste(self, target, paste): # run by the scheduler
+        piece = paste.take()
+        if piece is None:
+            return
+        chars = piece[0]
+        if not target.submit(self.__run_on_target, self.__trace_req, paste.session, target, self.__write_paste, (paste, *piece)):
+            self.__end_paste(target, paste, 'Serial Error: Device busy')
+            return
+        ## pace the next slice by the time the host takes typing this one
+        paste.due = max(paste.due, perf_counter()) + len(chars)/PASTE_RATE
+        self.__scheduler.at(paste.due, self.__pump_paste, target, paste)
+
+    def __write_paste(self, paste, chars, chunk_end, end): # run by the target writer
+        target = self.__target
+        if paste.cancelled:
+            return
+        if self.__journal:
+            self.__journal.append_text(chars, target=target.id)
+        res = self.__uart_write(target.report.text(chars))
+        if res['result'] != 'success':
+            detail = ' as {}'.format(res.get('detail')) if res.get('detail') else ''
+            self.__end_paste(target, paste, f'Serial Error: Paste failed{detail}')
+            return
+        paste.written += len(chars)
+        if not chunk_end:
+            return
+        with paste.lock:
+            paste.unreplied -= 1
+        detail = f'Pasted {paste.written} characters'
+        if end:
+            paste.cancelled = True # finished
+            if target.paste is paste:
+                target.paste = None
+            detail += f' in {perf_counter()-paste.start:.1f} s'
+            self.__log_write(3, 'Streaming paste on %s done: %s', target, detail)
+        self.__log_write(5, 'Put a success send key response to write queue')
+        self.__send_async(STATUS_CODE_RES(TYPE_SEND_KEY_RES, STATUS_SUCCESS, detail))
+
+    def __end_paste(self, target, paste, detail):
+        with paste.lock:
+            if paste.cancelled:
+                return
+            paste.cancelled = True
+            unreplied, paste.unreplied = paste.unreplied, 0
+        paste.clear()
+        paste.session.input.clear(buttons=False)
+        if target.paste is paste:
+            target.paste = None
+        self.__log_write(1, 'Streaming paste on %s ended after %d characters: %s', target, paste.written, detail)
+        ## every queued chunk gets its reply, then nothing is left pressed on the controlled host
+        for _ in range(unreplied):
+            self.__send_async(STATUS_CODE_RES(TYPE_SEND_KEY_RES, STATUS_FAILURE, detail), paste.session)
+        target.submit(self.__run_on_target, self.__trace_req, paste.session, target, self.__write_release, (True, False))
+
+    def __cancel_paste(self):
+        session, target = self.__session, self.__target
+        paste = target.paste
+        if paste is None or paste.session is not session:
+            code, detail = STATUS_FAILURE, 'Paste Error: No paste of this session in progress'
+        else:
+            self.__end_paste(target, paste, 'Paste Error: Paste cancelled')
+            code, detail = STATUS_SUCCESS, f'Paste cancelled after {paste.written} characters'
+        self.__log_write(5, 'Put a %s send key response to write queue', STATUS_CODE[code])
+        self.__send_async(STATUS_CODE_RES(TYPE_SEND_KEY_RES, code, detail))
+
+    def __send_report_to_uart(self, res_type, *state):
+        what = 'keyboard' if res_type == TYPE_SEND_KEY_RES else 'mouse'
+        if self.__uart is None or not self.__uart.is_open:
+            ## Send failure message when serial device is not opened
+            self.__log_write(1, 'Send %s report failed as serial device not opened', what)
+            self.__log_write(5, 'Put a failure send %s response to write queue', what)
+            self.__send_async(STATUS_CODE_RES(res_type, STATUS_FAILURE, 'Serial Error: Device not opened'))
+            return
+
+        report = self.__target.report
+        # only the change is written, one report frame or the press/release frames of it
+        cmds, records = report.keyboard(*state) if res_type == TYPE_SEND_KEY_RES else report.mouse(*state)
+        if not records:
+            self.__log_write(4, 'Dropped %s report as nothing changed', what)
+            self.__send_async(STATUS_CODE_RES(res_type, STATUS_SUCCESS, f'{what.capitalize()} report unchanged'))
+            return
+        if self.__journal:
+            for record in records:
+                self.__journal.append(*record, target=self.__target.id)
+        release = all([record[1] in (KEY_RELEASE, MOUSE_RELEASE) for record in records])
+        res = self.__uart_write(cmds, replay=release) # send command to uart device
+        if res['result'] == 'success':
+            ## Send success message
+            self.__log_write(4, 'Send %s report to serial success in %d bytes', what, len(cmds))
+            self.__log_write(5, 'Put a success send %s response to write queue', what)
+            self.__send_async(STATUS_CODE_RES(res_type, STATUS_SUCCESS, f'{what.capitalize()} report sent'))
+        else:
+            ## Send failure message
+            detail = ' as {}'.format(res.get('detail')) if res.get('detail') else ''
+            self.__log_write(1, f'Send {what} report to serial failed{detail}')
+            self.__log_write(5, f'Put a failure send {what} response to write queue')
+            self.__send_async(STATUS_CODE_RES(res_type, STATUS_FAILURE,
+                f'Serial Error: Send {what} report failed{detail}'))
+
     def __send_clear_keys_to_uart(self):
         if self.__uart is None or not self.__uart.is_open:
             ## Send failure message when serial device is not opened
@@ -755,8 +1738,10 @@ class Kvm:
             self.__send_async(STATUS_CODE_RES(TYPE_SEND_KEY_RES, STATUS_FAILURE, 'Serial Error: Device not opened'))
             return
 
-        cmd = UART_SEND_KEY_CLEAR
-        res = self.__uart_write(cmd) # send command to uart device
+        cmd = self.__target.report.clear_keys()
+        if self.__journal:
+            self.__journal.append(TYPE_SEND_KEY_REQ, KEY_CLEAR, target=self.__target.id)
+        res = self.__uart_write(cmd, replay=True) # send command to uart device
         if res['result'] == 'success':
             ## Send success message
             self.__log_write(4, 'Send release all keys command to serial success')
@@ -774,67 +1759,70 @@ class Kvm:
     def __handle_send_key_request(self):
         self.__log_write(4, 'Got a send key request message')
         ## Read flag
-        flag = 0
-        while True:
-            if len(self.__buf) == 0:
-                res = self.__recv()
-                if res is None:
-                    continue
-                elif res is Quit:
-                    return
-                self.__buf += res
-                continue
-            flag = self.__buf[0]
-            self.__buf = self.__buf[1:]
-            break
+        flag = self.__read(1)[0]
 
-        if flag not in (KEY_TEXT_SEND, KEY_PRESS, KEY_RELEASE, KEY_CLEAR):
+        if flag not in (KEY_TEXT_SEND, KEY_PRESS, KEY_RELEASE, KEY_CLEAR, KEY_TEXT_CHUNK, KEY_TEXT_CANCEL, KEY_TEXT_LAYOUT,
+                KEY_REPORT):
             ## Send failure message when first byte of message is invalid
-            self.__log_write(2, 'Got the send key request invalid flag <{:02X}>'.format(flag))
+            self.__log_write(2, 'Got the send key request invalid flag <%02X>', flag)
             self.__log_write(5, 'Put a failure send key response to write queue')
             self.__send_async(STATUS_CODE_RES(
                 TYPE_SEND_KEY_RES, STATUS_FAILURE,
                 'Protocol Error: Received flag <{:02X}> is invalid'.format(flag)))
             return
 
+        ## stop the streaming paste when flag is KEY_TEXT_CANCEL
+        if flag == KEY_TEXT_CANCEL:
+            self.__cancel_paste()
+            return
+
+        ## Read more and a chunk of the streaming paste when flag is KEY_TEXT_CHUNK
+        if flag == KEY_TEXT_CHUNK:
+            more = self.__read(1)[0]
+            chars = self.__read(struct.unpack('!H', self.__read(2))[0])
+            self.__paste_chunk(chars, more == 0)
+            return
+
+        ## Read the whole keyboard state when flag is KEY_REPORT
+        if flag == KEY_REPORT:
+            data = self.__read(7)
+            modifiers, keys = data[0], [key for key in data[1:] if key]
+            self.__session.input.set(keys=[0x80+i for i in range(8) if modifiers>>i&1]+[key+136 for key in keys if key+136 < 0x100])
+            self.__uart_submit(TYPE_SEND_KEY_RES, self.__send_report_to_uart, TYPE_SEND_KEY_RES, modifiers, keys)
+            return
+
+        ## Read layout and utf-8 text when flag is KEY_TEXT_LAYOUT
+        if flag == KEY_TEXT_LAYOUT:
+            layout = self.__read(self.__read(1)[0])
+            text = self.__read(struct.unpack('!H', self.__read(2))[0])
+            self.__layout_text(layout, text)
+            return
+
         ## send release all keys command to controled host when flag is KEY_CLEAR
         if flag == KEY_CLEAR:
-            self.__send_clear_keys_to_uart()
+            self.__session.input.clear(buttons=False)
+            self.__uart_submit(TYPE_SEND_KEY_RES, self.__send_clear_keys_to_uart)
             return
 
         ## Read is_press and key when flag is in KEY_PRESS or KEY_RELEASE
         if flag in (KEY_PRESS, KEY_RELEASE):
-            while True:
-                key = 0
-                if len(self.__buf) == 0:
-                    res = self.__recv()
-                    if res is None:
-                        continue
-                    elif res is Quit:
-                        return
-                    self.__buf += res
-                    continue
-                key = self.__buf[0]
-                self.__buf = self.__buf[1:]
-                break
-            self.__send_key_to_uart(flag, key)
+            key = self.__read(1)[0]
+            if not self.__session.input.key(key, flag == KEY_PRESS):
+                ## Drop the duplicate, the host already has the key in this state
+                press = 'pressed' if flag == KEY_PRESS else 'released'
+                key_txt = '"%s"' %chr(key) if chr(key).isprintable() and key in range(0x80) else '<{:02X}>'.format(key)
+                self.metrics.input_dropped.inc('key')
+                self.__log_write(4, 'Dropped send key command as key %s already %s', key_txt, press)
+                # replied through the writer, after the replies of the requests queued before
+                self.__uart_submit(TYPE_SEND_KEY_RES, self.__send_async,
+                    STATUS_CODE_RES(TYPE_SEND_KEY_RES, STATUS_SUCCESS, f'Key {key_txt} already {press}'))
+                return
+            self.__uart_submit(TYPE_SEND_KEY_RES, self.__send_key_to_uart, flag, key)
             return
 
         ## Read text characters when flag is KEY_TEXT_SEND
         # Read length of text
-        txt_len = 0
-        while True:
-            if len(self.__buf) < 2:
-                res = self.__recv()
-                if res is None:
-                    continue
-                elif res is Quit:
-                    return
-                self.__buf += res
-                continue
-            txt_len, = struct.unpack('!H', self.__buf[:2])
-            self.__buf = self.__buf[2:]
-            break
+        txt_len, = struct.unpack('!H', self.__read(2))
 
         if txt_len == 0:
             ## Send failure message when length of is_press and keys are zero
@@ -846,21 +1834,9 @@ class Kvm:
             return
 
         # Read text characters
-        chars = b''
-        while True:
-            if len(self.__buf) < txt_len:
-                res = self.__recv()
-                if res is None:
-                    continue
-                elif res is Quit:
-                    return
-                self.__buf += res
-                continue
-            chars = self.__buf[:txt_len]
-            self.__buf = self.__buf[txt_len:]
-            break
+        chars = self.__read(txt_len)
 
-        self.__send_text_chars_to_uart(chars)
+        self.__uart_submit(TYPE_SEND_KEY_RES, self.__send_text_chars_to_uart, chars)
 
     def __send_clear_mouse_buttons_to_uart(self):
         if self.__uart is None or not self.__uart.is_open:
@@ -870,8 +1846,10 @@ class Kvm:
             self.__send_async(STATUS_CODE_RES(TYPE_SEND_MOUSE_RES, STATUS_FAILURE, 'Serial Error: Device not opened'))
             return
 
-        cmd = UART_SEND_MOUSE_CLEAR
-        res = self.__uart_write(cmd) # send command to uart device
+        cmd = self.__target.report.clear_buttons()
+        if self.__journal:
+            self.__journal.append(TYPE_SEND_MOUSE_REQ, MOUSE_CLEAR, target=self.__target.id)
+        res = self.__uart_write(cmd, replay=True) # send command to uart device
         if res['result'] == 'success':
             ## Send success message
             self.__log_write(4, 'Send release all mouse buttons command to serial success')
@@ -895,11 +1873,13 @@ class Kvm:
             self.__send_async(STATUS_CODE_RES(TYPE_SEND_MOUSE_RES, STATUS_FAILURE, 'Serial Error: Device not opened'))
             return
 
-        cmd = UART_SEND_MOUSE_WHEEL(flag&0x0F) # transform flag 0x10/0x11 to 0x00/0x01
+        cmd = self.__target.report.wheel(flag) # transform flag 0x10/0x11 to 0x00/0x01 or a mouse report
+        if self.__journal:
+            self.__journal.append(TYPE_SEND_MOUSE_REQ, flag, target=self.__target.id)
         res = self.__uart_write(cmd) # send command to uart device
         if res['result'] == 'success':
             ## Send success message
-            self.__log_write(4, f'Send mouse scroll wheel {orient} command to serial success')
+            self.__log_write(4, 'Send mouse scroll wheel %s command to serial success', orient)
             self.__log_write(5, 'Put a success send mouse response to write queue')
             self.__send_async(STATUS_CODE_RES(TYPE_SEND_MOUSE_RES, STATUS_SUCCESS, f'Mouse scrolled wheel {orient}'))
         else:
@@ -914,12 +1894,13 @@ class Kvm:
         if self.__uart is None or not self.__uart.is_open:
             ## Send failure message when serial device is not opened
             self.__log_write(1, 'Send click mouse button failed as serial device not opened')
+            self.__session.input.button(button, act != MOUSE_PRESS)
             self.__log_write(5, 'Put a failure send mouse response to write queue')
             self.__send_async(STATUS_CODE_RES(TYPE_SEND_MOUSE_RES, STATUS_FAILURE, 'Serial Error: Device not opened'))
             return
 
         if button not in (MOUSE_LEFT, MOUSE_RIGHT, MOUSE_MIDDLE):
-            self.__log_write(2, 'Received invalid click mouse button code <{:02X}>'.format(button))
+            self.__log_write(2, 'Received invalid click mouse button code <%02X>', button)
             self.__log_write(5, 'Put a failure send mouse response to write queue')
             self.__send_async(STATUS_CODE_RES(TYPE_SEND_MOUSE_RES, STATUS_FAILURE,
                 'Invalid mouse button <{:02X}>'.format(button)))
@@ -927,8 +1908,10 @@ class Kvm:
 
         press = 'press' if act == MOUSE_PRESS else 'release'
         btn_txt = 'left' if button == MOUSE_LEFT else ('right' if button == MOUSE_RIGHT else 'middle')
-        cmd = UART_SEND_MOUSE_CLICK(act, button) # construct serial protocol format
-        res = self.__uart_write(cmd) # send command to uart device
+        cmd = self.__target.report.button(act, button) # construct serial protocol format, empty if no report changed
+        if self.__journal:
+            self.__journal.append(TYPE_SEND_MOUSE_REQ, act, button, target=self.__target.id)
+        res = self.__uart_write(cmd, replay=act == MOUSE_RELEASE) # send command to uart device
         if res['result'] == 'success':
             ## Send success message
             self.__log_write(4, 'Send click mouse button command to serial success')
@@ -938,6 +1921,7 @@ class Kvm:
             ## Send failure message
             detail = ' as {}'.format(res.get('detail')) if res.get('detail') else ''
             self.__log_write(1, f'Send click mouse button command to serial failed{detail}')
+            self.__session.input.button(button, act != MOUSE_PRESS) # the host did not see the change
             self.__log_write(5, 'Put a failure send mouse response to write queue')
             self.__send_async(STATUS_CODE_RES(TYPE_SEND_MOUSE_RES, STATUS_FAILURE,
                 f'Serial Error: Send {press} mouse button {btn_txt} failed{detail}'))
@@ -950,9 +1934,12 @@ class Kvm:
             self.__send_async(STATUS_CODE_RES(TYPE_SEND_MOUSE_RES, STATUS_FAILURE, 'Serial Error: Device not opened'))
             return
 
-        cmd = UART_SEND_MOUSE_MOVE(x, y) # construct serial protocol format
+        cmd = self.__target.report.move(x, y) # construct serial protocol format
+        if self.__journal:
+            self.__journal.append(TYPE_SEND_MOUSE_REQ, MOUSE_MOVE, x, y, target=self.__target.id)
         res = self.__uart_write(cmd) # send command to uart device
         if res['result'] == 'success':
+            self.__target.pointer.shift(x, y)
             ## Send success message
             self.__log_write(4, 'Send mouse move command to serial success')
             self.__log_write(5, 'Put a success send mouse response to write queue')
@@ -965,26 +1952,53 @@ class Kvm:
             self.__send_async(STATUS_CODE_RES(TYPE_SEND_MOUSE_RES, STATUS_FAILURE,
                 f'Serial Error: Send mouse move command failed{detail}'))
 
+    def __send_mouse_position_to_uart(self, flag, x, y):
+        if self.__uart is None or not self.__uart.is_open:
+            ## Send failure message when serial device is not opened
+            self.__log_write(1, 'Send mouse position command failed as serial device not opened')
+            self.__log_write(5, 'Put a failure send mouse response to write queue')
+            self.__send_async(STATUS_CODE_RES(TYPE_SEND_MOUSE_RES, STATUS_FAILURE, 'Serial Error: Device not opened'))
+            return
+
+        pointer = self.__target.pointer
+        if flag == MOUSE_MOVE_ABS and pointer.screen is None:
+            self.__log_write(2, 'Send mouse position command refused as the screen is not calibrated')
+            self.__log_write(5, 'Put a failure send mouse response to write queue')
+            self.__send_async(STATUS_CODE_RES(TYPE_SEND_MOUSE_RES, STATUS_FAILURE,
+                'Mouse Error: Screen size unknown, calibrate first'))
+            return
+        # plan the fewest frames from the last known position, homing first when it is unknown
+        records = pointer.calibrate(x, y) if flag == MOUSE_CALIBRATE else pointer.move_to(x, y)
+        report = self.__target.report
+        cmds = b''.join([report.command(TYPE_SEND_MOUSE_REQ, move, a, b) for move, a, b in records])
+        if self.__journal:
+            for record in records:
+                self.__journal.append(TYPE_SEND_MOUSE_REQ, *record, target=self.__target.id)
+        what = 'Screen {}x{} calibrated'.format(x, y) if flag == MOUSE_CALIBRATE else 'Mouse moved to ({}, {})'.format(*pointer.position)
+        res = self.__uart_write(cmds) # send commands to uart device
+        if res['result'] == 'success':
+            ## Send success message
+            self.__log_write(4, 'Send mouse position command to serial success in %d frame(s)', len(records))
+            self.__log_write(5, 'Put a success send mouse response to write queue')
+            self.__send_async(STATUS_CODE_RES(TYPE_SEND_MOUSE_RES, STATUS_SUCCESS, what))
+        else:
+            pointer.position = None # the host may have seen a part of the path
+            ## Send failure message
+            detail = ' as {}'.format(res.get('detail')) if res.get('detail') else ''
+            self.__log_write(1, f'Send mouse position command to serial failed{detail}')
+            self.__log_write(5, 'Put a failure send mouse response to write queue')
+            self.__send_async(STATUS_CODE_RES(TYPE_SEND_MOUSE_RES, STATUS_FAILURE,
+                f'Serial Error: Send mouse position command failed{detail}'))
+
     def __handle_send_mouse_request(self):
         self.__log_write(4, 'Got a send mouse request message')
         ## Read flag
-        flag = 0
-        while True:
-            if len(self.__buf) == 0:
-                res = self.__recv()
-                if res is None:
-                    continue
-                elif res is Quit:
-                    return
-                self.__buf += res
-                continue
-            flag = self.__buf[0]
-            self.__buf = self.__buf[1:]
-            break
+        flag = self.__read(1)[0]
 
-        if flag not in (MOUSE_RELEASE, MOUSE_PRESS, MOUSE_CLEAR, MOUSE_WHEEL_UP, MOUSE_WHEEL_DOWN, MOUSE_MOVE):
+        if flag not in (MOUSE_RELEASE, MOUSE_PRESS, MOUSE_CLEAR, MOUSE_WHEEL_UP, MOUSE_WHEEL_DOWN, MOUSE_MOVE,
+                MOUSE_MOVE_ABS, MOUSE_CALIBRATE, MOUSE_REPORT):
             ## Send failure message when first byte of message is invalid
-            self.__log_write(2, 'Got the send mouse request invalid flag <{:02X}>'.format(flag))
+            self.__log_write(2, 'Got the send mouse request invalid flag <%02X>', flag)
             self.__log_write(5, 'Put a failure send mouse response to write queue')
             self.__send_async(STATUS_CODE_RES(
                 TYPE_SEND_MOUSE_RES, STATUS_FAILURE,
@@ -993,75 +2007,73 @@ class Kvm:
 
         ## send release all mouse buttons command to controled host when flag is MOUSE_CLEAR
         if flag == MOUSE_CLEAR:
-            self.__send_clear_mouse_buttons_to_uart()
+            self.__session.input.clear(keys=False)
+            self.__uart_submit(TYPE_SEND_MOUSE_RES, self.__send_clear_mouse_buttons_to_uart)
             return
 
         ## send mouse scroll wheel command to controled host when flag is MOUSE_WHEEL_XX
         if flag in (MOUSE_WHEEL_UP, MOUSE_WHEEL_DOWN):
-            self.__send_mouse_scroll_wheel_to_uart(flag)
+            self.__uart_submit(TYPE_SEND_MOUSE_RES, self.__send_mouse_scroll_wheel_to_uart, flag)
             return
 
         ## Read is_press and button when flag is in MOUSE_PRESS or MOUSE_RELEASE
         if flag in (MOUSE_PRESS, MOUSE_RELEASE):
-            while True:
-                btn = 0
-                if len(self.__buf) == 0:
-                    res = self.__recv()
-                    if res is None:
-                        continue
-                    elif res is Quit:
-                        return
-                    self.__buf += res
-                    continue
-                btn = self.__buf[0]
-                self.__buf = self.__buf[1:]
-                break
-            self.__send_click_mouse_butten_to_uart(flag, btn)
+            btn = self.__read(1)[0]
+            if btn in (MOUSE_LEFT, MOUSE_RIGHT, MOUSE_MIDDLE) and not self.__session.input.button(btn, flag == MOUSE_PRESS):
+                ## Drop the duplicate, the host already has the button in this state
+                press = 'pressed' if flag == MOUSE_PRESS else 'released'
+                btn_txt = 'left' if btn == MOUSE_LEFT else ('right' if btn == MOUSE_RIGHT else 'middle')
+                self.metrics.input_dropped.inc('button')
+                self.__log_write(4, 'Dropped click mouse button command as %s button already %s', btn_txt, press)
+                # replied through the writer, after the replies of the requests queued before
+                self.__uart_submit(TYPE_SEND_MOUSE_RES, self.__send_async,
+                    STATUS_CODE_RES(TYPE_SEND_MOUSE_RES, STATUS_SUCCESS, f'Mouse button {btn_txt} already {press}'))
+                return
+            self.__uart_submit(TYPE_SEND_MOUSE_RES, self.__send_click_mouse_butten_to_uart, flag, btn)
+            return
+
+        ## Read the whole mouse state when flag is MOUSE_REPORT
+        if flag == MOUSE_REPORT:
+            buttons, x, y, wheel = struct.unpack('!Bbbb', self.__read(4))
+            buttons &= MOUSE_LEFT|MOUSE_RIGHT|MOUSE_MIDDLE
+            self.__session.input.set(buttons=buttons)
+            self.__uart_submit(TYPE_SEND_MOUSE_RES, self.__send_report_to_uart, TYPE_SEND_MOUSE_RES, buttons, x, y, wheel)
+            return
+
+        ## Read position or screen size when flag is MOUSE_MOVE_ABS or MOUSE_CALIBRATE
+        if flag in (MOUSE_MOVE_ABS, MOUSE_CALIBRATE):
+            x, y = struct.unpack('!HH', self.__read(4))
+            if flag == MOUSE_CALIBRATE and not (x and y):
+                self.__log_write(2, 'Got the calibrate request with empty screen %dx%d', x, y)
+                self.__log_write(5, 'Put a failure send mouse response to write queue')
+                self.__send_async(STATUS_CODE_RES(TYPE_SEND_MOUSE_RES, STATUS_FAILURE,
+                    f'Protocol Error: Screen size {x}x{y} is invalid'))
+                return
+            self.__uart_submit(TYPE_SEND_MOUSE_RES, self.__send_mouse_position_to_uart, flag, x, y)
             return
 
         ## Read x-move and y-move when flag is MOUSE_MOVE
-        x, y = 0, 0
-        while True:
-            if len(self.__buf) < 2:
-                res = self.__recv()
-                if res is None:
-                    continue
-                elif res is Quit:
-                    return
-                self.__buf += res
-                continue
-            x, y = struct.unpack('!bb', self.__buf[:2])
-            self.__buf = self.__buf[2:]
-            break
+        x, y = struct.unpack('!bb', self.__read(2))
 
-        self.__send_mouse_move_to_uart(x, y)
+        self.__uart_submit(TYPE_SEND_MOUSE_RES, self.__send_mouse_move_to_uart, x, y)
 
     def __handle_send_atx_request(self):
         self.__log_write(4, 'Got a send atx request message')
         ## Read atx signal
-        sig = b''
-        while True:
-            if len(self.__buf) == 0:
-                res = self.__recv()
-                if res is None:
-                    continue
-                elif res is Quit:
-                    return
-                self.__buf += res
-                continue
-            sig = self.__buf[0]
-            self.__buf = self.__buf[1:]
-            break
+        sig = self.__read(1)[0]
 
         if sig not in ATX_SIGNAL.values():
             ## Send failure message when signal is invalid
-            self.__log_write(2, 'Got the send atx request invalid signal <{:02X}>'.format(sig))
+            self.__log_write(2, 'Got the send atx request invalid signal <%02X>', sig)
             self.__log_write(5, 'Put a failure send atx response to write queue')
             self.__send_async(STATUS_CODE_RES(
                 TYPE_SEND_ATX_RES, STATUS_FAILURE,
                 'Protocol Error: Received invalid signal <{:02X}>'.format(sig)))
             return
 
+        self.__uart_submit(TYPE_SEND_ATX_RES, self.__send_atx_to_uart, sig)
+
+    def __send_atx_to_uart(self, sig):
         if self.__uart is None or not self.__uart.is_open:
             ## Send failure message when serial device is not opened
             self.__log_write(1, 'Send atx signal failed as serial device not opened')
@@ -1070,6 +2082,8 @@ class Kvm:
             return
 
         cmd = UART_SEND_ATX(sig)
+        if self.__journal:
+            self.__journal.append(TYPE_SEND_ATX_REQ, sig, target=self.__target.id)
         res = self.__uart_write(cmd) # send command to uart device
         if res['result'] == 'success':
             ## Send success message
@@ -1085,6 +2099,243 @@ class Kvm:
             self.__send_async(STATUS_CODE_RES(TYPE_SEND_ATX_RES, STATUS_FAILURE,
                 f'Serial Error: Send signal <{sig:02X}> failed{detail}'))
 
+    def __handle_macro_request(self):
+        self.__log_write(4, 'Got a macro request message')
+        ## Read flag, then name and steps as the flag requires
+        flag, name = self.__read(1)[0], ''
+        if flag in (MACRO_DEFINE, MACRO_RUN, MACRO_DELETE):
+            name = self.__read(self.__read(1)[0]).decode('utf-8', 'replace')
+        steps = b''
+        if flag == MACRO_DEFINE:
+            steps = self.__read(struct.unpack('!H', self.__read(2))[0])
+
+        code, detail = STATUS_SUCCESS, ''
+        if flag not in (MACRO_DEFINE, MACRO_RUN, MACRO_DELETE, MACRO_LIST, MACRO_CANCEL):
+            self.__log_write(2, 'Got the macro request invalid flag <%02X>', flag)
+            code, detail = STATUS_FAILURE, 'Protocol Error: Received flag <{:02X}> is invalid'.format(flag)
+        elif flag in (MACRO_DEFINE, MACRO_RUN, MACRO_DELETE) and not name:
+            self.__log_write(2, 'Got the macro request name length is 0')
+            code, detail = STATUS_FAILURE, 'Protocol Error: Macro name length is 0'
+        elif flag == MACRO_DEFINE:
+            try:
+                macro = compile_macro(name, steps)
+            except ValueError as e:
+                self.__log_write(2, 'Compile macro "%s" failed as %s', name, e)
+                code, detail = STATUS_FAILURE, str(e)
+            else:
+                if name not in self.__macros and len(self.__macros) >= MACRO_MAX:
+                    code, detail = STATUS_FAILURE, f'Server Error: Macros exceed {MACRO_MAX}'
+                else:
+                    self.__macros[name] = macro
+                    self.__log_write(3, 'Defined macro "%s" of %d frame(s) in %d ms',
+                            name, len(macro.schedule), macro.duration*1000)
+                    detail = f'Defined with {len(macro.schedule)} frame(s) in {macro.duration*1000:.0f} ms'
+        elif flag == MACRO_DELETE:
+            if self.__macros.pop(name, None):
+                self.__log_write(3, 'Deleted macro "%s"', name)
+                detail = 'Deleted'
+            else:
+                code, detail = STATUS_FAILURE, f'Server Error: No such macro "{name}"'
+        elif flag == MACRO_LIST:
+            detail = ','.join(sorted(self.__macros))
+        elif flag == MACRO_RUN:
+            code, detail = self.__play_macro(name)
+        else:
+            code, detail = self.__cancel_macro()
+        if code == STATUS_SUCCESS and flag == MACRO_RUN:
+            return # replied when the playback ends
+        self.__log_write(5, 'Put a %s macro response to write queue', STATUS_CODE[code])
+        self.__send_async(STATUS_CODE_RES(TYPE_MACRO_RES, code, detail[:255]))
+
+    def __play_macro(self, name):
+        target, macro = self.__target, self.__macros.get(name)
+        if macro is None:
+            return STATUS_FAILURE, f'Server Error: No such macro "{name}"'
+        if self.__uart is None or not self.__uart.is_open:
+            self.__log_write(1, 'Play macro failed as serial device not opened')
+            return STATUS_FAILURE, 'Serial Error: Device not opened'
+        if target.macro:
+            return STATUS_FAILURE, f'Server Error: Macro "{target.macro.macro.name}" is playing'
+        playback = target.macro = Playback(macro, self.__session)
+        playback.start = perf_counter()
+        self.__log_write(3, 'Play macro "%s" on %s', name, target)
+        ## Frames are handed to the target writer at their time by the scheduler
+        last = len(macro.schedule)-1
+        for i, (offset, frame, records) in enumerate(macro.schedule):
+            self.__scheduler.at(playback.start+offset, self.__submit_macro_frame, target, playback, frame, records, i == last)
+        if last < 0:
+            self.__end_macro(target, playback, STATUS_SUCCESS, 'Done in 0 ms')
+        return STATUS_SUCCESS, ''
+
+    def __submit_macro_frame(self, target, playback, frame, records, last): # run by the scheduler
+        if playback.cancelled:
+            return
+        if not target.submit(self.__run_on_target, self.__trace_req, playback.session, target, self.__write_macro_frame,
+                (playback, frame, records, last)):
+            self.__end_macro(target, playback, STATUS_FAILURE, 'Serial Error: Device busy')
+
+    def __write_macro_frame(self, playback, frame, records, last): # run by the target writer
+        target = self.__target
+        if playback.cancelled:
+            return
+        if self.__journal:
+            for record in records:
+                self.__journal.append(*record, target=target.id)
+        if target.report.enabled: # the compiled frame is made of legacy frames
+            frame = b''.join([target.report.command(*record) for record in records])
+        self.__follow_input(records)
+        res = self.__uart_write(frame)
+        if res['result'] != 'success':
+            self.__follow_input(records, revert=True) # the host did not see the change
+            detail = ' as {}'.format(res.get('detail')) if res.get('detail') else ''
+            self.__end_macro(target, playback, STATUS_FAILURE, f'Serial Error: Play macro failed{detail}')
+        elif last:
+            self.__end_macro(target, playback, STATUS_SUCCESS,
+                    f'Done in {(perf_counter()-playback.start)*1000:.1f} ms')
+
+    def __end_macro(self, target, playback, code, detail):
+        if playback.cancelled:
+            return
+        playback.cancelled = True
+        if target.macro is playback:
+            target.macro = None
+        self.__log_write(3 if code == STATUS_SUCCESS else 1, 'Macro "%s" on %s: %s', playback.macro.name, target, detail)
+        self.__log_write(5, 'Put a %s macro response to write queue', STATUS_CODE[code])
+        self.__send_async(STATUS_CODE_RES(TYPE_MACRO_RES, code, detail[:255]), playback.session)
+
+    def __cancel_macro(self):
+        target = self.__target
+        if target.macro is None:
+            return STATUS_FAILURE, 'Server Error: No macro playing'
+        name = target.macro.macro.name
+        self.__end_macro(target, target.macro, STATUS_FAILURE, f'Server Error: Macro "{name}" cancelled')
+        ## leave nothing pressed on the controlled host
+        self.__session.input.clear()
+        target.submit(self.__run_on_target, self.__trace_req, self.__session, target, self.__write_release, (True, True))
+        return STATUS_SUCCESS, f'Cancelled "{name}"'
+
+    def __measure_latency(self, session, target, stimulus, samples):
+        stream = None
+        try:
+            stream = mjpeg_connect(target.mjpg_port, timeout=LATENCY_TIMEOUT)
+            def inject(cmd): # written by the target writer in turn with other input, time it left the port
+                written = Future()
+                def write():
+                    try:
+                        start = time()
+                        res = self.__uart_write(cmd)
+                        written.set_result((res, (start+time())/2))
+                    except BaseException as e:
+                        written.set_exception(e)
+                        raise
+                if not target.submit(self.__run_on_target, self.__trace_req, None, target, write, ()):
+                    raise serial.SerialException('Device busy')
+                try:
+                    res, sent = written.result(timeout=LATENCY_WRITE_TIMEOUT)
+                except FutureTimeout:
+                    raise serial.SerialException('stimulus not written in time')
+                if res['result'] != 'success':
+                    raise serial.SerialException(res.get('detail', 'write failed'))
+                return sent
+            probe = LatencyProbe(mjpeg_frames(stream), inject, stimulus, samples).run()
+        except (OSError, serial.SerialException, StopIteration) as e:
+            detail = 'stream ended' if isinstance(e, StopIteration) else str(e)
+            self.__log_write(1, f'Latency measurement failed as {detail}')
+            self.__log_write(5, 'Put a failure latency response to write queue')
+            self.__send_async(STATUS_CODE_RES(TYPE_LATENCY_RES, STATUS_FAILURE,
+                f'Server Error: Latency measurement failed as {detail}'[:255]), session)
+        else:
+            self.__log_write(3, 'Latency measurement done: %s', probe.report())
+            self.__log_write(5, 'Put a success latency response to write queue')
+            self.__send_async(STATUS_CODE_RES(TYPE_LATENCY_RES, STATUS_SUCCESS, probe.report()[:255]), session)
+        finally:
+            if stream:
+                stream.close()
+            target.probe = None
+
+    def __handle_latency_request(self):
+        self.__log_write(4, 'Got a latency request message')
+        ## Read stimulus and samples
+        stimulus, samples = self.__read(2)
+
+        if stimulus not in STIMULUS:
+            self.__log_write(2, 'Got the latency request invalid stimulus <%02X>', stimulus)
+            self.__log_write(5, 'Put a failure latency response to write queue')
+            self.__send_async(STATUS_CODE_RES(
+                TYPE_LATENCY_RES, STATUS_FAILURE,
+                'Protocol Error: Received invalid stimulus <{:02X}>'.format(stimulus)))
+            return
+
+        if self.__uart is None or not self.__uart.is_open:
+            self.__log_write(1, 'Latency measurement failed as serial device not opened')
+            self.__log_write(5, 'Put a failure latency response to write queue')
+            self.__send_async(STATUS_CODE_RES(TYPE_LATENCY_RES, STATUS_FAILURE, 'Serial Error: Device not opened'))
+            return
+
+        target = self.__target
+        if target.mjpg is None or not process_alive(target.mjpg.pid):
+            self.__log_write(1, 'Latency measurement failed as mjpg-streamer not running')
+            self.__log_write(5, 'Put a failure latency response to write queue')
+            self.__send_async(STATUS_CODE_RES(TYPE_LATENCY_RES, STATUS_FAILURE,
+                'Server Error: mjpg-streamer not running'))
+            return
+
+        if target.probe:
+            self.__log_write(2, 'Latency measurement already running')
+            self.__log_write(5, 'Put a failure latency response to write queue')
+            self.__send_async(STATUS_CODE_RES(TYPE_LATENCY_RES, STATUS_FAILURE,
+                'Server Error: Latency measurement already running'))
+            return
+
+        ## Measure in a subthread as the stream is read blocking
+        self.__log_write(3, 'Latency measurement started')
+        target.probe = threading.Thread(target=self.__measure_latency,
+                args=(self.__session, target, stimulus, samples if samples else LATENCY_SAMPLES), daemon=True)
+        target.probe.start()
+
+    def __handle_stats_request(self):
+        self.__log_write(4, 'Got a stats request message')
+        self.__log_write(5, 'Put a stats response to write queue')
+        with self.__sockets_lock:
+            sessions = [session for session in self.__sessions.values() if session.accept]
+        stats = self.metrics.snapshot()
+        stats['sessions'] = [{'id': session.id, 'peer': session.ipport, 'transport': 'websocket' if session.ws else 'tcp',
+                'target': session.target.id if session.target else None, **session.rtt.snapshot()}
+                for session in sessions]
+        self.__send_async(STATS_RES(json.dumps(stats, separators=(',', ':'))))
+
+    def __handle_profile_request(self):
+        self.__log_write(4, 'Got a profile request message')
+        ## Read action and seconds
+        action, seconds = struct.unpack('!BH', self.__read(3))
+
+        if action not in (PROFILE_SAMPLE, PROFILE_TRACE) or seconds == 0:
+            self.__log_write(2, 'Got the profile request invalid action <%02X> or zero seconds', action)
+            self.__log_write(5, 'Put a failure profile response to write queue')
+            self.__send_async(STATUS_CODE_RES(
+                TYPE_PROFILE_RES, STATUS_FAILURE,
+                'Protocol Error: Received invalid action <{:02X}> or zero seconds'.format(action)))
+            return
+
+        if action == PROFILE_SAMPLE:
+            started = self.__profiler.start(seconds)
+        else:
+            started = not self.__tracer and self.__toggle_trace()
+            if started: # stop tracing after seconds, unless stopped by signal meanwhile
+                tracer = self.__tracer
+                self.__loop.call_soon_threadsafe(self.__loop.call_later, seconds,
+                        lambda: self.__tracer is tracer and self.__toggle_trace())
+        what = 'Profiling' if action == PROFILE_SAMPLE else 'Tracing'
+        if not started:
+            self.__log_write(2, '%s already running', what)
+            self.__log_write(5, 'Put a failure profile response to write queue')
+            self.__send_async(STATUS_CODE_RES(TYPE_PROFILE_RES, STATUS_FAILURE,
+                f'Server Error: {what} already running'))
+            return
+        self.__log_write(5, 'Put a success profile response to write queue')
+        self.__send_async(STATUS_CODE_RES(TYPE_PROFILE_RES, STATUS_SUCCESS,
+            f'{what} {seconds} second(s) into {self.profile_dir}'[:255]))
+
     __RECV_HANDLE_SWITCH = {
         TYPE_HANDSHAKE: __handle_handshake,
         TYPE_GOODBYE: __handle_goodbye,
@@ -1092,14 +2343,161 @@ class Kvm:
         TYPE_REPLY_ALIVE: __handle_reply_alive,
         TYPE_LIST_UART_REQ: __handle_list_uarts_request,
         TYPE_LIST_CAP_REQ: __handle_list_captures_request,
+        TYPE_STATS_REQ: __handle_stats_request,
+        TYPE_LEASE_REQ: __handle_lease_request,
+        TYPE_LIST_TARGET_REQ: __handle_list_targets_request,
+        TYPE_SELECT_TARGET_REQ: __handle_select_target_request,
+        TYPE_BROADCAST_REQ: __handle_broadcast_request,
+        TYPE_INPUT_STATE_REQ: __handle_input_state_request,
+        TYPE_DATAGRAM_REQ: __handle_datagram_request,
         TYPE_RUN_MJPG_REQ: __handle_run_mjpg_request,
         TYPE_OPEN_UART_REQ: __handle_open_uart_request,
         TYPE_SEND_KEY_REQ: __handle_send_key_request,
         TYPE_SEND_MOUSE_REQ: __handle_send_mouse_request,
-        TYPE_SEND_ATX_REQ: __handle_send_atx_request,}
+        TYPE_SEND_ATX_REQ: __handle_send_atx_request,
+        TYPE_MACRO_REQ: __handle_macro_request,
+        TYPE_LATENCY_REQ: __handle_latency_request,
+        TYPE_PROFILE_REQ: __handle_profile_request,}
 
     def __say_goodbye(self):
-        if self.__sock:
-            self.__send_async(GOODBYE_MSG)
-            self.__log_write(3, 'Sent goodbye message to client')
-        self.__accept = False
+        for session in list(self.__sessions.values()):
+            try:
+                goodbye = GOODBYE_MSG
+                if session.ws:
+                    goodbye = session.ws.frame(GOODBYE_MSG)+close_frame(CLOSE_GOING_AWAY) if session.ws.open else b''
+                session.sock.send(session.out+goodbye, socket.MSG_DONTWAIT)
+                self.__log_write(3, 'Sent goodbye message to %s', session)
+            except OSError:
+                pass
+            session.accept = False
+            session.sock.close()
+
+    def __start_successor(self): # run by SIGHUP, the successor takes the state over by the handover socket
+        if self.__successor and self.__successor.poll() is None:
+            self.__log_write(2, 'Successor server with PID %d is already starting', self.__successor.pid)
+            return
+        self.__successor = subprocess.Popen([sys.executable]+sys.argv)
+        self.__log_write(3, 'Started successor server with PID %d', self.__successor.pid)
+
+    def __hand_over(self, server, ws_server, udp): # True when the successor holds the state, else the server quits as usual
+        try:
+            conn, _ = self.__handover.accept()
+        except OSError:
+            return False
+        self.__log_write(3, 'Handing the state over to a successor server')
+        ## freeze the state: no event loop task, macro or serial write runs any more
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+        self.__scheduler.stop()
+        for target in self.__targets:
+            target.close()
+        ## release what the successor opens again by name
+        for target in self.__targets:
+            if target.recorder:
+                target.recorder.stop()
+        if self.metrics_port:
+            self.__metrics_server.shutdown()
+            self.__metrics_server.server_close()
+        if self.__journal:
+            self.__journal.close()
+            self.__journal = None
+        fds = [sock.fileno() for sock in (server, ws_server, udp) if sock]
+        sessions = []
+        for session in self.__sessions.values():
+            if session.sock.fileno() == -1:
+                continue
+            with session.out_lock:
+                out = session.out
+            sessions.append(dict(fd=len(fds), id=session.id, ipport=session.ipport, accept=session.accept,
+                    buf=base64(session.buf), out=base64(out), target=session.target.id if session.target else 0,
+                    keys=session.input.keys, buttons=session.input.buttons,
+                    ws=dict(open=session.ws.open, deflate=session.ws.deflate, pending=base64(session.ws.pending),
+                        fragments=[base64(fragment) for fragment in session.ws.fragments],
+                        compressed=session.ws.compressed) if session.ws else None,
+                    datagram=dict(token=session.datagram.token.hex(), seq=session.datagram.seq) if session.datagram else None))
+            fds.append(session.sock.fileno())
+        targets = []
+        for target in self.__targets:
+            uart = target.uart if target.uart and target.uart.is_open and not target.link else None
+            if target.link:
+                self.__log_write(2, 'Lost serial device %s of %s is not handed over', target.link, target)
+            mjpg = target.mjpg.pid if target.mjpg and process_alive(target.mjpg.pid) else None
+            targets.append(dict(name=target.name, device=uart.port if uart else None, fd=len(fds) if uart else None,
+                    baud=uart.baudrate if uart else None, firmware=target.firmware,
+                    controller=target.controller.id if target.controller else None,
+                    report=(target.report.modifiers, target.report.keys, target.report.buttons),
+                    screen=target.pointer.screen, position=target.pointer.position,
+                    mjpg=mjpg, mjpg_cap_name=target.mjpg_cap_name, mjpg_resolution=target.mjpg_resolution,
+                    mjpg_fps=target.mjpg_fps, mjpg_port=target.mjpg_port))
+            if uart:
+                fds.append(uart.fileno())
+        macros = [dict(name=macro.name, schedule=[(offset, base64(frame), records)
+                for offset, frame, records in macro.schedule]) for macro in self.__macros.values()]
+        state = dict(server=0, ws_server=1 if ws_server else None, udp=1+bool(ws_server) if udp else None, next_session=next_session_id(), sessions=sessions, targets=targets, macros=macros)
+        try:
+            with conn:
+                if handover_send(conn, state, fds):
+                    return True
+                self.__log_write(1, 'Successor server did not acknowledge the handover')
+        except OSError as e:
+            self.__log_write(1, 'Hand the state over failed: %s', e)
+        return False
+
+    def __resume(self, state, fds): # state and fds handed over by the previous server
+        resume_session_ids(state['next_session'])
+        sessions = {}
+        for item in state['sessions']:
+            sock = socket.socket(fileno=fds[item['fd']])
+            sock.setblocking(False)
+            session = Session(sock, item['ipport'], item['id'])
+            session.accept = item['accept']
+            session.buf = b64decode(item['buf'])
+            session.out = b64decode(item['out'])
+            session.target = self.__targets[item['target']] if item['target'] < len(self.__targets) else self.__targets[0]
+            session.input.keys, session.input.buttons = item['keys'], item['buttons']
+            session.ws = WebSocket() if item.get('ws') else None
+            if session.ws:
+                session.ws.open, session.ws.deflate = item['ws']['open'], item['ws']['deflate']
+                session.ws.pending = b64decode(item['ws']['pending'])
+                session.ws.fragments = [b64decode(fragment) for fragment in item['ws']['fragments']]
+                session.ws.compressed = item['ws']['compressed']
+            if item.get('datagram'):
+                session.datagram = Datagram(bytes.fromhex(item['datagram']['token']), item['datagram']['seq'])
+                self.__tokens[session.datagram.token] = session
+            sessions[session.id] = self.__sessions[sock] = session
+        for item in state['targets']:
+            target = next((target for target in self.__targets if target.name == item['name']), None)
+            if target is None:
+                self.__log_write(2, 'Target "%s" handed over is not managed any more', item['name'])
+                if item['fd'] is not None:
+                    os.close(fds[item['fd']])
+                continue
+            target.controller = sessions.get(item['controller'])
+            target.pointer.screen = tuple(item['screen']) if item['screen'] else None
+            target.pointer.position = tuple(item['position']) if item['position'] else None
+            if item['device']:
+                ## opened again by name at the negotiated rate, the fd handed over holds the device
+                ## open meanwhile so its last close does not drop DTR and reset the board
+                try:
+                    target.uart = serial.Serial(item['device'], item['baud'], write_timeout=UART_TIMEOUT)
+                    target.port = next((port for port in list_ports.comports() if port.device == item['device']), None)
+                    target.firmware = tuple(item['firmware']) if item['firmware'] else None
+                    self.__apply_firmware(target)
+                    self.__log_write(3, 'Serial device %s of %s taken over at %d baud', item['device'], target, item['baud'])
+                except serial.SerialException as e:
+                    self.__log_write(1, 'Take over serial device %s of %s failed: %s', item['device'], target, e)
+                os.close(fds[item['fd']])
+            modifiers, keys, buttons = item['report']
+            target.report.modifiers, target.report.keys, target.report.buttons = modifiers, tuple(keys), buttons
+            target.report.held = modifiers
+            if item['mjpg']:
+                target.mjpg = Adopted(item['mjpg'])
+                target.mjpg_cap_name = item['mjpg_cap_name']
+                target.mjpg_resolution = tuple(item['mjpg_resolution'])
+                target.mjpg_fps = item['mjpg_fps']
+                target.mjpg_port = item['mjpg_port']
+                self.__log_write(3, 'MJPG-Streamer service of %s taken over with PID %d', target, item['mjpg'])
+                if target.recorder:
+                    target.recorder.start(target.mjpg_port)
+        for item in state['macros']:
+            self.__macros[item['name']] = Macro(item['name'], [(offset, b64decode(frame), [tuple(record) for record in records])
+                    for offset, frame, records in item['schedule']])
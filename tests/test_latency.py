@@ -0,0 +1,89 @@
+# coding: utf-8
+import pytest
+from ikvm._globals import LATENCY_BASELINE, LATENCY_TIMEOUT
+from ikvm._protocol import KEY_PRESS
+from ikvm._uart import *
+from ikvm._uart import CMD_KEY_CLICK, CMD_MOUSE_MOVE
+from ikvm._latency import *
+from ikvm._latency import KEY_CAPS_LOCK
+
+PERIOD = 0.1 # second(s) between synthetic frames
+DELIVERY = 0.02 # second(s) from capture to receive of every frame
+SIZE = 1000 # jpeg size of the screen with the cursor home and caps lock off
+CHANGE = 500 # jpeg size added by the cursor away from home or the caps lock indicator
+
+def jpeg(size):
+    return b'\xff\xd8'+bytes(size-4)+b'\xff\xd9'
+
+class Screen:
+    """ synthetic controlled host decoding the serial frames written to it, the cursor
+        position and the caps lock indicator show delay frames after their write """
+    def __init__(self, delay, count=None):
+        self.delay = delay
+        self.count = count
+        self.index = 0 # frames yielded
+        self.cursor = [0, 0]
+        self.caps = False
+        self.shown = (0, 0), False # state the frames show
+        self.pending = [] # (frame index, state) to show
+        self.sent = []
+
+    def inject(self, cmd):
+        sent = (self.index-1)*PERIOD+PERIOD/2 # half a period after the last frame
+        self.sent.append(sent)
+        while cmd:
+            type, content, cmd = uart_reply(cmd)
+            if type == CMD_MOUSE_MOVE:
+                x, y = int.from_bytes(content[:1], 'big', signed=True), int.from_bytes(content[1:2], 'big', signed=True)
+                self.cursor = [self.cursor[0]+x, self.cursor[1]+y]
+            elif type == CMD_KEY_CLICK and content == bytes([KEY_PRESS, KEY_CAPS_LOCK]):
+                self.caps = not self.caps
+        self.pending.append((self.index+self.delay, (tuple(self.cursor), self.caps)))
+        return sent
+
+    def frames(self):
+        while self.count is None or self.index < self.count:
+            while self.pending and self.pending[0][0] <= self.index:
+                self.shown = self.pending.pop(0)[1]
+            (x, y), caps = self.shown
+            stamp = self.index*PERIOD
+            self.index += 1
+            yield stamp+DELIVERY, stamp, jpeg(SIZE+CHANGE*((x, y) != (0, 0))+CHANGE*caps)
+
+@pytest.mark.parametrize('stimulus', [STIMULUS_MOUSE, STIMULUS_CAPS])
+def test_photon(stimulus):
+    screen = Screen(delay=3)
+    probe = LatencyProbe(screen.frames(), screen.inject, stimulus, samples=4).run()
+    assert probe.photon == pytest.approx([3.5*PERIOD]*4)
+    assert probe.missed == 0
+    assert probe.delivery == pytest.approx([DELIVERY]*len(probe.delivery))
+    assert len(probe.delivery) == 4*(LATENCY_BASELINE+4) # the changed frame included
+    assert len(screen.sent) == 4
+    assert screen.shown == ((0, 0), False) # every stimulus undone
+    assert '4/4 detected' in probe.report()
+
+def test_restore_odd_samples():
+    screen = Screen(delay=1)
+    probe = LatencyProbe(screen.frames(), screen.inject, samples=3).run()
+    assert len(probe.photon) == 3
+    assert len(screen.sent) == 4 # the last stimulus is undone
+    assert screen.cursor == [0, 0]
+
+def test_other_writes_not_detected():
+    screen = Screen(delay=1)
+    other = UART_SEND_KEY(KEY_PRESS, ord('a'))+UART_SEND_MOUSE_MOVE(0, 0) # nothing the screen shows
+    probe = LatencyProbe(screen.frames(), lambda cmd: screen.inject(other), samples=2).run()
+    assert probe.photon == []
+    assert probe.missed == 2
+    # frames are read until one is captured after the timeout
+    waited = int(LATENCY_TIMEOUT/PERIOD)+1
+    assert len(probe.delivery) == 2*(LATENCY_BASELINE+waited)
+    assert '0/2 detected' in probe.report()
+
+def test_frames_exhausted():
+    screen = Screen(delay=3, count=LATENCY_BASELINE+2)
+    probe = LatencyProbe(screen.frames(), screen.inject, samples=1)
+    with pytest.raises(StopIteration):
+        probe.run()
+    assert probe.photon == []
+    assert len(screen.sent) == 1
@@ -0,0 +1,73 @@
+# coding: utf-8
+import asyncio, os, socket, subprocess, sys, time
+import pytest
+from ikvm._protocol import *
+from ikvm.client import Client, _parse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def server(tmp_path):
+    """ port of an ikvm-server.py started with a stand-in mjpg_streamer """
+    mjpg = tmp_path/'mjpg_streamer'
+    mjpg.write_text('#!/bin/sh\nexec sleep 1000\n')
+    mjpg.chmod(0o755)
+    with socket.socket(socket.AF_INET6) as sock:
+        sock.bind(('::1', 0))
+        port = sock.getsockname()[1]
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, 'ikvm-server.py'), str(port), '-B', '::1',
+            '--mjpg-root', str(tmp_path), '--log-level', '1'], cwd=ROOT, stdout=subprocess.DEVNULL)
+    deadline = time.time()+10
+    while True:
+        try:
+            socket.create_connection(('::1', port), timeout=1).close()
+            break
+        except OSError:
+            if time.time() > deadline or proc.poll() is not None:
+                proc.kill()
+                pytest.fail('server did not start')
+            time.sleep(0.1)
+    yield port
+    proc.terminate()
+    proc.wait()
+
+def replies(sock, types, timeout=3):
+    """ {type: value} of the first message of each type, until all arrived or the timeout """
+    buf, found, deadline = b'', {}, time.time()+timeout
+    while set(types)-set(found) and time.time() < deadline:
+        sock.settimeout(max(deadline-time.time(), 0.01))
+        try:
+            data = sock.recv(4096)
+        except socket.timeout:
+            break
+        if not data:
+            break
+        buf += data
+        while True:
+            loc = buf.find(MAGIC)
+            msg = _parse(buf, loc) if loc != -1 else None
+            if msg is None:
+                break
+            type, value, end = msg
+            buf = buf[end:]
+            found.setdefault(type, value)
+    return found
+
+def test_refused_input_keeps_pipelined_requests(server):
+    async def run():
+        async with Client('::1', server) as holder: # holds the lease and answers ask alive
+            observer = socket.create_connection(('::1', server), timeout=3)
+            try:
+                observer.sendall(HANDSHAKE_MSG)
+                assert TYPE_HANDSHAKE in await asyncio.to_thread(replies, observer, [TYPE_HANDSHAKE])
+                # refused input and a request behind it, received at once
+                observer.sendall(SEND_KEY_REQ_K(KEY_PRESS, ord('a'))+STATS_REQ)
+                found = await asyncio.to_thread(replies, observer, [TYPE_SEND_KEY_RES, TYPE_STATS_RES])
+            finally:
+                observer.close()
+            assert holder.connected
+        return found
+    found = asyncio.run(run())
+    assert found[TYPE_SEND_KEY_RES][0] == STATUS_FAILURE
+    assert 'lease' in found[TYPE_SEND_KEY_RES][1]
+    assert TYPE_STATS_RES in found
@@ -0,0 +1,22 @@
+# coding: utf-8
+import io, threading
+from ikvm._log import Logger
+
+THREADS = 8
+WRITES = 20000
+
+def test_drops_counted_from_every_thread():
+    fh = io.StringIO()
+    fh.close = lambda: None # read after the logger closes it
+    logger = Logger(fh, queue_max=0, interval=60) # every record is dropped
+    def write():
+        for i in range(WRITES):
+            logger.write(3, 'line %d', (i,))
+    threads = [threading.Thread(target=write) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    logger.close()
+    assert logger.dropped == THREADS*WRITES
+    assert 'dropped %d records in total' %(THREADS*WRITES) in fh.getvalue()
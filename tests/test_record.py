@@ -0,0 +1,48 @@
+# coding: utf-8
+import os, socket, subprocess, sys, threading, time
+import pytest
+from ikvm._record import Recorder, segments
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FRAMES = 5
+
+@pytest.fixture
+def stream():
+    """ port of a mjpg-streamer stand-in sending FRAMES frames a second apart in capture time """
+    server = socket.create_server(('localhost', 0))
+    def serve():
+        conn, _ = server.accept()
+        with conn:
+            conn.recv(1024)
+            conn.sendall(b'HTTP/1.0 200 OK\r\nContent-Type: multipart/x-mixed-replace\r\n\r\n')
+            for i in range(FRAMES):
+                jpeg = b'\xff\xd8'+bytes(16)+b'\xff\xd9'
+                conn.sendall(b'--boundarydonotcross\r\nContent-Type: image/jpeg\r\n'
+                        b'Content-Length: %d\r\nX-Timestamp: %d.000000\r\n\r\n' %(len(jpeg), 1000+i) + jpeg)
+            threading.Event().wait(5) # the recorder stops meanwhile
+    threading.Thread(target=serve, daemon=True).start()
+    yield server.getsockname()[1]
+    server.close()
+
+def record(folder, port, retention):
+    recorder = Recorder(str(folder), segment_size=1, retention=retention) # a segment per frame
+    recorder.start(port)
+    deadline = time.time()+5
+    while len(segments(str(folder))) < (min(FRAMES, retention) if retention > 0 else FRAMES) and time.time() < deadline:
+        time.sleep(0.05)
+    time.sleep(0.2)
+    recorder.stop()
+    return segments(str(folder))
+
+def test_retention_keeps_latest(tmp_path, stream):
+    assert record(tmp_path, stream, 2) == ['%016d' %((1000+i)*1000) for i in (FRAMES-2, FRAMES-1)]
+
+@pytest.mark.parametrize('retention', [0, -1])
+def test_retention_not_positive_keeps_all(tmp_path, stream, retention):
+    assert len(record(tmp_path, stream, retention)) == FRAMES
+
+def test_negative_retention_refused():
+    res = subprocess.run([sys.executable, os.path.join(ROOT, 'ikvm-server.py'), '--record-retention', '-1'],
+            capture_output=True, text=True)
+    assert res.returncode == 2
+    assert 'argument --record-retention: Value should not be negative' in res.stderr
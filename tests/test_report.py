@@ -0,0 +1,63 @@
+# coding: utf-8
+from ikvm._protocol import *
+from ikvm._uart import *
+from ikvm._uart import CMD_KEY_REPORT, CMD_MOUSE_REPORT
+from ikvm._report import HidReport
+
+KEY_LEFT_SHIFT = 0x81
+
+def frames(data):
+    """ [(command, content),] of the concatenated frames """
+    res = []
+    while data:
+        cmd, content, data = uart_reply(data)
+        res.append((cmd, content))
+    return res
+
+def test_move_keeps_buttons():
+    report = HidReport(True)
+    report.button(MOUSE_PRESS, MOUSE_LEFT)
+    cmds = report.command(TYPE_SEND_MOUSE_REQ, MOUSE_MOVE, -5, 7)
+    assert frames(cmds) == [(CMD_MOUSE_REPORT, bytes([MOUSE_LEFT, 0xFB, 7, 0]))]
+
+def test_text_keeps_modifiers():
+    report = HidReport(True)
+    report.key(KEY_PRESS, 0x80) # left ctrl
+    cmds = report.text(b'c')
+    assert frames(cmds) == [(CMD_KEY_REPORT, bytes([0x01, 0x06, 0, 0, 0, 0, 0])),
+                            (CMD_KEY_REPORT, bytes([0x01, 0, 0, 0, 0, 0, 0]))]
+    assert report.command(TYPE_SEND_KEY_REQ, KEY_TEXT_SEND, ord('c')) == cmds
+
+def test_legacy_frames():
+    report = HidReport()
+    assert report.text(b'ab') == UART_SEND_CHAR(ord('a'))+UART_SEND_CHAR(ord('b'))
+    assert report.command(TYPE_SEND_MOUSE_REQ, MOUSE_MOVE, 1, 2) == UART_SEND_MOUSE_MOVE(1, 2)
+    assert report.command(TYPE_SEND_KEY_REQ, KEY_PRESS, KEY_LEFT_SHIFT) == UART_SEND_KEY(KEY_PRESS, KEY_LEFT_SHIFT)
+    assert report.modifiers == 0x02
+
+def test_shifted_character_keeps_held_shift():
+    report = HidReport(True)
+    report.key(KEY_PRESS, KEY_LEFT_SHIFT)
+    report.key(KEY_PRESS, ord('A'))
+    report.key(KEY_RELEASE, ord('A'))
+    assert report.modifiers == 0x02
+    report.key(KEY_RELEASE, KEY_LEFT_SHIFT)
+    assert report.modifiers == 0
+
+def test_shifted_character_drops_implicit_shift():
+    report = HidReport(True)
+    report.key(KEY_PRESS, ord('A'))
+    assert report.modifiers == 0x02
+    report.key(KEY_RELEASE, ord('A'))
+    assert report.modifiers == 0
+
+def test_implicit_modifier_keeps_held_shift():
+    report = HidReport(True)
+    report.key(KEY_PRESS, KEY_LEFT_SHIFT)
+    report.key(KEY_PRESS, KEY_LEFT_SHIFT, True)
+    report.key(KEY_RELEASE, KEY_LEFT_SHIFT, True)
+    assert report.modifiers == 0x02
+    report.keyboard(0, ())
+    report.key(KEY_PRESS, ord('A'))
+    report.key(KEY_RELEASE, ord('A'))
+    assert report.modifiers == 0
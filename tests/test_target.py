@@ -0,0 +1,34 @@
+# coding: utf-8
+import threading
+from time import perf_counter
+from ikvm._target import Target
+
+STALLED = 8 # more targets stalled than the 4 workers writers used to share
+
+def test_stalled_targets_do_not_delay_others():
+    release = threading.Event()
+    stalled = [Target(i, f'stalled {i}') for i in range(STALLED)]
+    healthy = Target(STALLED, 'healthy')
+    try:
+        for target in stalled:
+            for _ in range(3): # a write timing out, more queued behind it
+                assert target.submit(release.wait, 10)
+        done = threading.Event()
+        start = perf_counter()
+        assert healthy.submit(done.set)
+        assert done.wait(1)
+        assert perf_counter()-start < 0.5
+        assert all(target.pending for target in stalled)
+    finally:
+        release.set()
+        for target in stalled+[healthy]:
+            target.close()
+    assert not any(target.pending for target in stalled)
+
+def test_jobs_run_in_order_until_closed():
+    target, order = Target(0, 'default'), []
+    for i in range(100):
+        assert target.submit(order.append, i)
+    target.close()
+    assert order == list(range(100))
+    assert not target.submit(order.append, 100)